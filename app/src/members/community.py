@@ -4,13 +4,20 @@
 # stdlib
 import json
 import time
+import os
+import struct
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from tempfile import NamedTemporaryFile
 
 # pypi
 from flask import current_app, g
-from fluent_discourse import Discourse, DiscourseError
+from fluent_discourse import Discourse, DiscourseError, PageNotFoundError
+from requests import RequestException
 from fasteners import InterProcessLock
-from datetime import date
+from datetime import date, datetime, timedelta, timezone
 
 # Lock/state files below live on the 'community-locks' Docker volume
 # (docker-compose.yml), NOT /tmp -- 'app' (web requests, e.g. calendar_feed())
@@ -30,11 +37,16 @@ _LOCKS_DIR = Path('/locks')
 # _RateLimiter has no way to coordinate against
 COMMUNITY_LOCKFILE = str(_LOCKS_DIR / 'communitygroupmanager.lock')
 
-# _RateLimiter's shared state: a JSON list of recent call timestamps, plus its
-# own dedicated lock (a short per-call critical section, unlike COMMUNITY_LOCKFILE
-# which some but not all community commands hold for their whole duration)
-_RATE_LIMIT_STATE_FILE = _LOCKS_DIR / 'discourse_ratelimit_state.json'
+# _RateLimiter's shared state: a fixed-size record holding the token bucket's theoretical
+# arrival time, updated in place, plus its own dedicated lock (a short
+# per-call critical section, unlike COMMUNITY_LOCKFILE which some but not all
+# community commands hold for their whole duration)
+_RATE_LIMIT_STATE_FILE = _LOCKS_DIR / 'discourse_ratelimit_state.bin'
+_RATE_LIMIT_STATE = struct.Struct('<d')
 _RATE_LIMIT_STATE_LOCKFILE = str(_LOCKS_DIR / 'discourse_ratelimit_state.lock')
+# InterProcessLock doesn't exclude other threads in the same process, e.g. concurrent
+# fetches sharing one client
+_rate_limit_state_local_lock = threading.Lock()
 
 # Discourse's confirmed default (config/discourse_defaults.conf,
 # max_admin_api_reqs_per_minute = 60) is 60 calls/minute for the admin API key;
@@ -49,10 +61,25 @@ _RATE_LIMIT_STATE_LOCKFILE = str(_LOCKS_DIR / 'discourse_ratelimit_state.lock')
 # than permanently taxing every normal run's throughput by lowering this further.
 DISCOURSE_RATE_LIMIT_MAX_CALLS = 55
 DISCOURSE_RATE_LIMIT_WINDOW_SECS = 60
+# calls which can be made back to back; the rest of the budget is spread evenly across the
+# window, so no window ever sees more than DISCOURSE_RATE_LIMIT_MAX_CALLS
+DISCOURSE_RATE_LIMIT_BURST = 5
+
+# priorities. all callers draw from the same budget, but DISCOURSE_RATE_LIMIT_INTERACTIVE_BURST
+# of the burst is held back for interactive callers (web requests), so they go straight
+# through while others are busy. scheduled callers (cron commands) claim the next free slot,
+# but not past the held back burst, so they never queue in front of interactive callers. bulk
+# callers never claim a slot ahead: they wait until one is free, so any scheduled or
+# interactive caller which arrives in the meantime goes first.
+DISCOURSE_PRIORITY_INTERACTIVE = 'interactive'
+DISCOURSE_PRIORITY_SCHEDULED = 'scheduled'
+DISCOURSE_PRIORITY_BULK = 'bulk'
+DISCOURSE_PRIORITIES = (DISCOURSE_PRIORITY_INTERACTIVE, DISCOURSE_PRIORITY_SCHEDULED, DISCOURSE_PRIORITY_BULK)
+DISCOURSE_RATE_LIMIT_INTERACTIVE_BURST = 3
 
 
 class _RateLimiter:
-    """Sliding-window rate limiter shared across processes via a small state file.
+    """Token-bucket rate limiter shared across processes via a small state file.
 
     A purely in-memory, per-process limiter (the original implementation) only
     protects a single process from exceeding the budget within its own lifetime.
@@ -65,40 +92,82 @@ class _RateLimiter:
     the real server-side limit being hit, not this class). Uses time.time()
     (wall clock), not time.monotonic(), since timestamps must be comparable
     across separate process invocations.
+
+    The bucket is kept as its theoretical arrival time (GCRA): the time at which
+    the bucket will be full again if no more calls are made. Each acquire()
+    reserves the next slot under the lock, in a read-modify-write of that one
+    value, then sleeps until its slot *after* releasing the lock, so a throttled
+    caller never blocks other processes from reserving theirs.
+
+    burst calls can be made back to back, after which calls are spaced
+    window_secs / (max_calls - burst) apart, which keeps any window_secs window
+    at or below max_calls (a sliding window's whole budget as a burst, then the
+    refill, would allow twice that). Every priority (see DISCOURSE_PRIORITIES)
+    is charged against the one bucket, so the whole budget is available to
+    whoever is calling; only reserved_burst of the burst is held back for
+    interactive callers, who can always use all of it.
     """
-    def __init__(self, max_calls, window_secs):
+    def __init__(self, max_calls, window_secs, burst=DISCOURSE_RATE_LIMIT_BURST,
+                 priority=DISCOURSE_PRIORITY_SCHEDULED, reserved_burst=DISCOURSE_RATE_LIMIT_INTERACTIVE_BURST):
+        if priority not in DISCOURSE_PRIORITIES:
+            raise ValueError(f'unknown rate limit priority {priority}, must be one of {DISCOURSE_PRIORITIES}')
         self.max_calls = max_calls
         self.window_secs = window_secs
+        self.priority = priority
+        burst = max(1, min(burst, max_calls - 1))
+        self.interval = window_secs / (max_calls - burst)
+        # non-interactive callers leave at least one call of the burst for interactive ones
+        heldback = max(0, min(reserved_burst, burst - 1))
+        self.burst = burst if priority == DISCOURSE_PRIORITY_INTERACTIVE else burst - heldback
 
-    def _read_calls(self) -> list[float]:
-        try:
-            return json.loads(_RATE_LIMIT_STATE_FILE.read_text())
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
+    def _reserve(self):
+        """reserve the next call slot for this limiter's priority
+
+        interactive callers reserve the next slot however far ahead, scheduled callers
+        only one interval ahead, bulk callers only a slot which is available now
+
+        :returns: (seconds to wait, True if the slot was reserved)
+        """
+        with _rate_limit_state_local_lock, InterProcessLock(_RATE_LIMIT_STATE_LOCKFILE):
+            fd = os.open(_RATE_LIMIT_STATE_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                state = os.pread(fd, _RATE_LIMIT_STATE.size, 0)
+                tat = _RATE_LIMIT_STATE.unpack(state)[0] if len(state) == _RATE_LIMIT_STATE.size else 0.0
+                now = time.time()
+                tat = max(tat, now)
+                # the call can go as soon as it's within this priority's burst allowance of the schedule
+                start = max(now, tat - (self.burst - 1) * self.interval)
+                if self.priority == DISCOURSE_PRIORITY_BULK and start > now:
+                    return start - now, False
+                # a scheduled caller queueing further ahead would push interactive callers back
+                # past their held back burst, so it waits to claim its slot instead
+                if self.priority == DISCOURSE_PRIORITY_SCHEDULED and start > now + self.interval:
+                    return start - now - self.interval, False
+                os.pwrite(fd, _RATE_LIMIT_STATE.pack(tat + self.interval), 0)
+            finally:
+                os.close(fd)
+        return start - now, True
 
     def acquire(self):
-        with InterProcessLock(_RATE_LIMIT_STATE_LOCKFILE):
-            now = time.time()
-            calls = [t for t in self._read_calls() if now - t < self.window_secs]
-            if len(calls) >= self.max_calls:
-                wait = self.window_secs - (now - calls[0])
-                if wait > 0:
-                    current_app.logger.debug(
-                        f'_RateLimiter.acquire(): throttling {wait:.1f}s '
-                        f'({len(calls)}/{self.max_calls} calls in window, shared across processes)'
-                    )
-                    time.sleep(wait)
-                    now = time.time()
-                    calls = [t for t in calls if now - t < self.window_secs]
-            calls.append(now)
-            _RATE_LIMIT_STATE_FILE.write_text(json.dumps(calls))
-
-
-def make_discourse_client(interest: str, username: str | None = None) -> '_RateLimitedDiscourse':
+        while True:
+            wait, reserved = self._reserve()
+            if wait > 0:
+                current_app.logger.debug(
+                    f'_RateLimiter.acquire(): {self.priority} throttling {wait:.1f}s (shared across processes)'
+                )
+                time.sleep(wait)
+            if reserved:
+                return
+
+
+def make_discourse_client(interest: str, username: str | None = None,
+                          priority: str = DISCOURSE_PRIORITY_SCHEDULED) -> '_RateLimitedDiscourse':
     """Create a rate-limited fluent_discourse client for the given interest.
 
     username overrides DISCOURSE_API_INVITE_USERNAME_{INTEREST} when provided,
     e.g. to post as a dedicated bot account rather than the default admin user.
+    priority is the rate limit priority, one of DISCOURSE_PRIORITIES: interactive for
+    web requests, scheduled for cron commands, bulk for long one-off commands.
     """
     uinterest = interest.upper()
     try:
@@ -109,7 +178,8 @@ def make_discourse_client(interest: str, username: str | None = None) -> '_RateL
                 api_key=current_app.config[f'DISCOURSE_API_KEY_{uinterest}'],
                 raise_for_rate_limit=False,
             ),
-            _RateLimiter(max_calls=DISCOURSE_RATE_LIMIT_MAX_CALLS, window_secs=DISCOURSE_RATE_LIMIT_WINDOW_SECS),
+            _RateLimiter(max_calls=DISCOURSE_RATE_LIMIT_MAX_CALLS, window_secs=DISCOURSE_RATE_LIMIT_WINDOW_SECS,
+                         priority=priority),
         )
     except KeyError as e:
         raise ValueError(f'Missing Discourse configuration for interest {interest}: {e}')
@@ -155,6 +225,94 @@ from .helpers import get_tags_users, make_runsignup_fluent_client
 from .model import Tag, localinterest_query_params
 
 
+# rows yielded by iter_query_paged(): the row list as returned by Discourse, a dict keyed by
+# column name, or a namedtuple with the columns as fields
+QUERY_ROW_LIST = 'list'
+QUERY_ROW_DICT = 'dict'
+QUERY_ROW_NAMEDTUPLE = 'namedtuple'
+QUERY_ROW_TYPES = [QUERY_ROW_LIST, QUERY_ROW_DICT, QUERY_ROW_NAMEDTUPLE]
+
+
+def _fetch_query_page(discourse, query_id, params, page, page_size):
+    query_params = {**params, 'page_num': str(page), 'page_size': str(page_size)}
+    resp = discourse.admin.plugins.explorer.queries._(query_id).run.post({'params': query_params})
+    current_app.logger.debug(
+        f'run_query_paged(): query {query_id} page {page} '
+        f'result_count={resp.get("result_count", 0)} rows={len(resp.get("rows", []))}'
+    )
+    return resp
+
+
+def _iter_query_pages(discourse, query_id, params, page_size, prefetch):
+    """yield (columns, rows) for each page of a Data Explorer query, at least once"""
+    # https://meta.discourse.org/t/run-data-explorer-queries-with-the-discourse-api/120063
+    base_params = dict(params or {})
+    app = current_app._get_current_object()
+
+    def fetch_in_app_context(page):
+        with app.app_context():
+            return _fetch_query_page(discourse, query_id, base_params, page, page_size)
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        page = 0
+        resp = _fetch_query_page(discourse, query_id, base_params, page, page_size)
+        while True:
+            result_count = resp.get('result_count', 0)
+            page_rows = resp.get('rows', [])
+            if result_count == 0 or not page_rows:
+                # first page only, a later empty page ends the query without yielding
+                if page == 0:
+                    yield resp.get('columns', []), []
+                return
+            lastpage = result_count < page_size
+            # a full page means there may be another, start fetching it while the caller
+            # processes this one
+            future = executor.submit(fetch_in_app_context, page + 1) if executor and not lastpage else None
+            yield resp['columns'], page_rows
+            if lastpage:
+                return
+            page += 1
+            resp = future.result() if future else _fetch_query_page(discourse, query_id, base_params, page, page_size)
+    finally:
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_query_paged(discourse, query_id, params=None, page_size=1000, rowtype=QUERY_ROW_DICT, prefetch=False):
+    """Run a Data Explorer query, yielding rows a page at a time.
+
+    Only one page of rows (two with prefetch) is held at a time, unlike run_query_paged()
+    which collects all of them.
+
+    :param discourse: rate-limited fluent_discourse client
+    :param query_id: Discourse Data Explorer query id
+    :param params: extra query params (e.g. an int_list filter) merged into every
+                    page's request alongside page_num/page_size
+    :param page_size: rows per page; must match the :page_size SQL parameter default
+    :param rowtype: one of QUERY_ROW_TYPES, how each row is yielded
+    :param prefetch: if True, fetch the next page in a background thread while the
+                    caller processes the current one
+    :rtype: iterator of rows
+    """
+    if rowtype not in QUERY_ROW_TYPES:
+        raise ValueError(f'rowtype must be one of {QUERY_ROW_TYPES}, got {rowtype!r}')
+    rowclass = rowcolumns = None
+    for columns, page_rows in _iter_query_pages(discourse, query_id, params, page_size, prefetch):
+        if rowtype == QUERY_ROW_LIST:
+            yield from page_rows
+        elif rowtype == QUERY_ROW_DICT:
+            for row in page_rows:
+                yield dict(zip(columns, row))
+        else:
+            if columns != rowcolumns:
+                # rename=True as column names aren't necessarily valid identifiers
+                rowclass = namedtuple('QueryRow', columns, rename=True)
+                rowcolumns = columns
+            for row in page_rows:
+                yield rowclass(*row)
+
+
 def run_query_paged(discourse, query_id, params=None, page_size=1000):
     """Run a Data Explorer query collecting all pages of results.
 
@@ -165,30 +323,247 @@ def run_query_paged(discourse, query_id, params=None, page_size=1000):
     :param page_size: rows per page; must match the :page_size SQL parameter default
     :returns: (columns, rows) where rows is the combined list across all pages
     """
-    # https://meta.discourse.org/t/run-data-explorer-queries-with-the-discourse-api/120063
     columns = []
     rows = []
-    page = 0
-    base_params = dict(params or {})
-    while True:
-        query_params = {**base_params, 'page_num': str(page), 'page_size': str(page_size)}
-        resp = discourse.admin.plugins.explorer.queries._(query_id).run.post({'params': query_params})
-        result_count = resp.get('result_count', 0)
-        page_rows = resp.get('rows', [])
-        current_app.logger.debug(
-            f'run_query_paged(): query {query_id} page {page} '
-            f'result_count={result_count} rows={len(page_rows)}'
-        )
-        if result_count == 0 or not page_rows:
-            columns = resp.get('columns', columns)
-            break
-        columns = resp['columns']
+    for columns, page_rows in _iter_query_pages(discourse, query_id, params, page_size, prefetch=False):
         rows.extend(page_rows)
-        if result_count < page_size:
-            break
-        page += 1
     return columns, rows
 
+# RunSignUp pages fetched at once, override with RSU_PAGE_FETCH_CONCURRENCY config
+RSU_PAGE_FETCH_CONCURRENCY = 4
+# retries per page after a failed request, with exponential backoff starting at
+# RSU_PAGE_FETCH_BACKOFF_SECS
+RSU_PAGE_FETCH_RETRIES = 3
+RSU_PAGE_FETCH_BACKOFF_SECS = 1.0
+
+
+def _fetch_rsu_page(getpage, page, retries, backoff_secs):
+    """getpage(page) with retry and exponential backoff on request or json decode errors"""
+    for attempt in range(retries + 1):
+        try:
+            return getpage(page)
+        except (RequestException, ValueError):
+            if attempt == retries:
+                raise
+            time.sleep(backoff_secs * 2 ** attempt)
+
+
+def fetch_rsu_pages(getpage, concurrency=None, retries=RSU_PAGE_FETCH_RETRIES, backoff_secs=RSU_PAGE_FETCH_BACKOFF_SECS):
+    """Fetch numbered RunSignUp pages concurrently, yielding them in page order.
+
+    RunSignUp doesn't report how many pages there are, only an empty page past the
+    last one. Page 1 is fetched first, then up to `concurrency` pages are kept in
+    flight, each completed page making room for the next, until an empty page is
+    seen. Pages are yielded in order and nothing after the empty page is yielded,
+    so callers see exactly what the serial page loop saw; at most concurrency-1
+    requests past the end are wasted.
+
+    getpage() runs in worker threads, without the flask app context.
+
+    :param getpage: getpage(page) returns the list of items on that page, [] past the last page
+    :param concurrency: maximum pages in flight, default RSU_PAGE_FETCH_CONCURRENCY config
+    :param retries: retries per page
+    :param backoff_secs: delay before first retry, doubling each retry
+    :returns: generator of (page, items)
+    """
+    if concurrency is None:
+        concurrency = current_app.config.get('RSU_PAGE_FETCH_CONCURRENCY', RSU_PAGE_FETCH_CONCURRENCY)
+    concurrency = max(1, concurrency)
+
+    # small results don't need the thread pool
+    items = _fetch_rsu_page(getpage, 1, retries, backoff_secs)
+    if not items:
+        return
+    yield 1, items
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        inflight = deque()
+        nextpage = 2
+        try:
+            while True:
+                while len(inflight) < concurrency:
+                    inflight.append((nextpage, pool.submit(_fetch_rsu_page, getpage, nextpage, retries, backoff_secs)))
+                    nextpage += 1
+                page, future = inflight.popleft()
+                items = future.result()
+                if not items:
+                    break
+                yield page, items
+        finally:
+            for page, future in inflight:
+                future.cancel()
+
+
+# RunSignUp roster snapshots are kept in APP_FILE_FOLDER/RSU_SNAPSHOT_DIRNAME, shared by the
+# app and crond containers. A snapshot refreshed within RSU_SNAPSHOT_MAX_AGE_SECS is used as is,
+# otherwise only records modified since its high-water mark (less RSU_SNAPSHOT_OVERLAP_HOURS, as
+# RunSignUp last_modified times are naive) are fetched. Incremental fetches can't see deleted
+# records, so the whole roster is fetched again after RSU_SNAPSHOT_FULL_REFRESH_SECS.
+RSU_SNAPSHOT_DIRNAME = 'rsusnapshots'
+RSU_SNAPSHOT_MAX_AGE_SECS = 300
+RSU_SNAPSHOT_FULL_REFRESH_SECS = 24 * 60 * 60
+RSU_SNAPSHOT_OVERLAP_HOURS = 24
+# snapshots written with a different record key are ignored and fully refreshed
+RSU_SNAPSHOT_VERSION = 2
+# fetched records with these statuses are dropped from the snapshot, so they don't linger until
+# the next full refresh
+RSU_SNAPSHOT_DROPPED_STATUSES = ('deleted', 'refunded')
+RSU_LAST_MODIFIED_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# keys of the records which were added, changed, removed by a snapshot refresh
+RsuSnapshotChanges = namedtuple('RsuSnapshotChanges', 'added changed removed')
+
+
+class RsuSnapshot:
+    """Local snapshot of a RunSignUp roster, refreshed incrementally and shared across processes.
+
+    The snapshot is a json file {'version', 'refreshed', 'fullrefresh', 'high_water', 'records'}, where
+    records are indexed by key(record), in the order RunSignUp returned them. Records whose status is
+    in RSU_SNAPSHOT_DROPPED_STATUSES are dropped, or removed if already in the snapshot. Refreshing is
+    done under an interprocess lock, so concurrent jobs wait for the first to download the roster
+    then use its snapshot.
+
+    Args:
+        name (str): snapshot file name, without extension
+        getpage (callable): getpage(page, params) returns the list of records on that page, [] past
+            the last page; params may include modified_after_timestamp
+        key (callable): key(record) returns a str which uniquely identifies the record
+    """
+
+    def __init__(self, name, getpage, key):
+        self.folder = os.path.join(current_app.config['APP_FILE_FOLDER'], RSU_SNAPSHOT_DIRNAME)
+        self.path = os.path.join(self.folder, f'{name}.json')
+        self.getpage = getpage
+        self.key = key
+        # set by records(), RsuSnapshotChanges from the last refresh, None if the snapshot was fresh
+        self.changes = None
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return snapshot if snapshot.get('version') == RSU_SNAPSHOT_VERSION else None
+
+    def _write(self, snapshot):
+        os.makedirs(self.folder, exist_ok=True)
+        with NamedTemporaryFile('w', dir=self.folder, suffix='.tmp', delete=False) as f:
+            json.dump(snapshot, f)
+        os.replace(f.name, self.path)
+
+    def _fetch(self, params):
+        records = {}
+        for page, pagerecords in fetch_rsu_pages(lambda page: self.getpage(page, params)):
+            current_app.logger.debug(f'{self._fetch.__qualname__}(): retrieved {os.path.basename(self.path)} page {page}')
+            for record in pagerecords:
+                records[self.key(record)] = record
+        return records
+
+    @staticmethod
+    def _dropped(record):
+        return str(record.get('status', '')).lower() in RSU_SNAPSHOT_DROPPED_STATUSES
+
+    def records(self, maxage=None, fullrefresh=False):
+        """get the roster, refreshing the snapshot if it's stale
+
+        :param maxage: seconds a snapshot can be used without refreshing, default RSU_SNAPSHOT_MAX_AGE_SECS config
+        :param fullrefresh: if True, fetch the whole roster regardless of the snapshot's age
+        :rtype: dict of RunSignUp records, indexed by key
+        """
+        config = current_app.config
+        if maxage is None:
+            maxage = config.get('RSU_SNAPSHOT_MAX_AGE_SECS', RSU_SNAPSHOT_MAX_AGE_SECS)
+        fullrefreshsecs = config.get('RSU_SNAPSHOT_FULL_REFRESH_SECS', RSU_SNAPSHOT_FULL_REFRESH_SECS)
+        overlap = timedelta(hours=config.get('RSU_SNAPSHOT_OVERLAP_HOURS', RSU_SNAPSHOT_OVERLAP_HOURS))
+
+        os.makedirs(self.folder, exist_ok=True)
+        with InterProcessLock(f'{self.path}.lock'):
+            snapshot = self._read()
+            now = time.time()
+            if snapshot and not fullrefresh and now - snapshot['refreshed'] < maxage:
+                self.changes = None
+                return snapshot['records']
+
+            incremental = (not fullrefresh and snapshot and snapshot['high_water']
+                           and now - snapshot['fullrefresh'] < fullrefreshsecs)
+            if incremental:
+                since = datetime.strptime(snapshot['high_water'], RSU_LAST_MODIFIED_FORMAT) - overlap
+                fetched = self._fetch({'modified_after_timestamp': int(since.timestamp())})
+                records = snapshot['records']
+            else:
+                fetched = self._fetch({})
+                records = snapshot['records'] if snapshot else {}
+            dropped = {key for key, record in fetched.items() if self._dropped(record)}
+            fetched = {key: record for key, record in fetched.items() if key not in dropped}
+            if incremental:
+                removed = [key for key in records if key in dropped]
+            else:
+                removed = [key for key in records if key not in fetched]
+
+            added = [key for key in fetched if key not in records]
+            changed = [key for key in fetched if key in records and fetched[key] != records[key]]
+            self.changes = RsuSnapshotChanges(added, changed, removed)
+
+            if incremental:
+                for key in removed:
+                    del records[key]
+                records.update(fetched)
+            else:
+                records = fetched
+            high_water = max((r['last_modified'] for r in records.values() if r.get('last_modified')), default=None)
+            self._write({
+                'version': RSU_SNAPSHOT_VERSION,
+                'refreshed': now,
+                'fullrefresh': now if not incremental else snapshot['fullrefresh'],
+                'high_water': high_water,
+                'records': records,
+            })
+            current_app.logger.info(f'{self.records.__qualname__}(): {os.path.basename(self.path)} '
+                                    f'{"incremental" if incremental else "full"} refresh, {len(added)} added, '
+                                    f'{len(changed)} changed, {len(removed)} removed')
+            return records
+
+
+def rsu_club_snapshot(rsu, clubid):
+    """snapshot of current RunSignUp club memberships, indexed by membership_id-user_id
+
+    a membership_id is shared by all the people on a family or other multi-person membership.
+    Incremental refreshes ask for expired memberships too, so a membership modified since the
+    last refresh is seen even if it has just expired; the next full refresh drops it
+
+    :param rsu: fluent RunSignUp client, see make_runsignup_fluent_client()
+    :param clubid: RunSignUp club id
+    :rtype: RsuSnapshot
+    """
+    def getpage(page, params):
+        # https://runsignup.com/API/club/:club_id/members/GET
+        currentonly = 'F' if 'modified_after_timestamp' in params else 'T'
+        resp = rsu.club._(clubid).members.params({'current_members_only': currentonly, 'include_questions': 'T',
+                                                  'results_per_page': 100, 'page': page, **params}).get()
+        resp.raise_for_status()
+        return resp.json().pop('club_members', [])
+    return RsuSnapshot(f'club-{clubid}', getpage, lambda m: f"{m['membership_id']}-{m['user']['user_id']}")
+
+
+def rsu_race_snapshot(rsu, raceid, eventid):
+    """snapshot of RunSignUp race event participants, indexed by registration_id-user_id
+
+    user_id is included in case one registration covers several participants
+
+    :param rsu: fluent RunSignUp client, see make_runsignup_fluent_client()
+    :param raceid: RunSignUp race id
+    :param eventid: RunSignUp event id
+    :rtype: RsuSnapshot
+    """
+    def getpage(page, params):
+        # https://runsignup.com/API/race/:race_id/participants/GET
+        resp = rsu.race._(raceid).participants.params({'event_id': eventid, 'page': page, **params}).get()
+        resp.raise_for_status()
+        return resp.json()[0].pop('participants', [])
+    return RsuSnapshot(f'race-{raceid}-{eventid}', getpage, lambda p: f"{p['registration_id']}-{p['user']['user_id']}")
+
+
 class RsuRaceSyncManager(SyncManager):
     """put participants into internal group from RunSignup
     
@@ -221,25 +596,10 @@ class RsuRaceSyncManager(SyncManager):
             current_app.logger.warning(f'{self.get_users_from_service.__qualname__}(): multiple events found for race {self.raceid}, using first one')
             
         event_id = events[0]['event_id']
-        page = 1
-        
+
         participants = {}
-        while True:
-            # https://runsignup.com/API/race/:race_id/participants/GET
-            current_app.logger.debug(f'{self.get_users_from_service.__qualname__}(): retrieving event {event_id} participants page {page}')
-            resp = self.rsu.race._(self.raceid).participants.params({'event_id': event_id, 'page':page}).get()
-            pageparticipants = resp.json()[0].pop('participants', [])
-            
-            # jump out of loop if we're done
-            if not pageparticipants:
-                break
-            
-            # collect all the participants on this page
-            for p in pageparticipants:
-                participants[p['user']['email'].lower()] = p
-            
-            # next page
-            page += 1
+        for p in rsu_race_snapshot(self.rsu, self.raceid, event_id).records().values():
+            participants[p['user']['email'].lower()] = p
             
         return participants
     
@@ -263,31 +623,220 @@ class RsuClubSyncManager(SyncManager):
         self.rsu = make_runsignup_fluent_client()
         
     def get_users_from_service(self):
-        """get members from RunSignup club, latest event
+        """get current members from RunSignup club
         
         :rtype: dict of service user records, indexed by email"""
-        page = 1
+        # the club snapshot is shared with the membership update, so has all memberships
+        today = date.today().isoformat()
         members = {}
-        while True:
-            # https://runsignup.com/API/club/:club_id/members/GET
-            current_app.logger.debug(f'{self.get_users_from_service.__qualname__}(): retrieving club {self.clubid} members page {page}')
-            resp = self.rsu.club._(self.clubid).members.params({'current_members_only': 'T', 'page':page}).get()
-            pagemembers = resp.json().pop('club_members', [])
-            
-            # jump out of loop if we're done
-            if not pagemembers:
-                break
-            
-            # collect all the members on this page
-            for m in pagemembers:
+        for m in rsu_club_snapshot(self.rsu, self.clubid).records().values():
+            if m['membership_start'] <= today <= m['membership_end']:
                 members[m['user']['email'].lower()] = m
             
-            # next page
-            page += 1
-            
         return members
     
 
+# Discourse user directory cache, on the shared locks volume. The cache is fully refreshed from
+# admin/users.json after DISCOURSE_USER_DIRECTORY_MAX_AGE_SECS (or on demand), and in between only
+# users created or updated since the last refresh are fetched, via the
+# DISCOURSE_API_USERS_UPDATED_QUERY_FSRC Data Explorer query. The watermark is backed off by
+# DISCOURSE_USER_DIRECTORY_OVERLAP_SECS to allow for clock skew between this host and Discourse.
+DISCOURSE_USER_DIRECTORY_MAX_AGE_SECS = 24 * 60 * 60
+DISCOURSE_USER_DIRECTORY_OVERLAP_SECS = 10 * 60
+
+
+class DiscourseUserDirectory:
+    """Discourse users by id, cached across processes and refreshed incrementally
+
+    Without DISCOURSE_API_USERS_UPDATED_QUERY_FSRC configured, every refresh is a full refresh.
+    Users deleted from Discourse stay in the cache until the next full refresh.
+
+    Args:
+        interest (str): interest short name
+        discourse: rate-limited fluent_discourse client
+    """
+
+    def __init__(self, interest, discourse):
+        self.interest = interest
+        self.discourse = discourse
+        self.path = _LOCKS_DIR / f'discourse_users_{interest}.json'
+        self.lockfile = str(_LOCKS_DIR / f'discourse_users_{interest}.lock')
+
+    def _read(self):
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, cache):
+        with NamedTemporaryFile('w', dir=self.path.parent, suffix='.tmp', delete=False) as f:
+            json.dump(cache, f)
+        os.replace(f.name, self.path)
+
+    def _fetch_all(self):
+        # https://docs.discourse.org/#tag/Admin/operation/adminListUsers
+        page = 1
+        userrows = []
+        while True:
+            resp = self.discourse.admin.users.json.get({'page': page})
+            if not resp:
+                break
+            userrows.extend(resp)
+            page += 1
+        return userrows
+
+    def _fetch_updated(self, query_id, since):
+        return iter_query_paged(self.discourse, query_id, prefetch=True,
+                                params={'updated_since': since.strftime('%Y-%m-%d %H:%M:%S')})
+
+    def users(self, fullrefresh=False):
+        """get the Discourse users, refreshing the cache
+
+        :param fullrefresh: if True, refresh all the users regardless of the cache age
+        :rtype: dict of user records indexed by user id
+        """
+        config = current_app.config
+        maxage = config.get('DISCOURSE_USER_DIRECTORY_MAX_AGE_SECS', DISCOURSE_USER_DIRECTORY_MAX_AGE_SECS)
+        overlap = timedelta(seconds=config.get('DISCOURSE_USER_DIRECTORY_OVERLAP_SECS', DISCOURSE_USER_DIRECTORY_OVERLAP_SECS))
+        query_id = config.get('DISCOURSE_API_USERS_UPDATED_QUERY_FSRC')
+
+        with InterProcessLock(self.lockfile):
+            cache = self._read()
+            # anything updated after this is picked up by the next refresh
+            now = datetime.now(timezone.utc)
+            incremental = (not fullrefresh and query_id and cache
+                           and now.timestamp() - cache['fullrefresh'] < maxage)
+            if incremental:
+                users = cache['users']
+                numfetched = 0
+                for row in self._fetch_updated(query_id, datetime.fromisoformat(cache['watermark']) - overlap):
+                    users[str(row['id'])] = {**users.get(str(row['id']), {}), **row}
+                    numfetched += 1
+                fullrefreshed = cache['fullrefresh']
+            else:
+                userrows = self._fetch_all()
+                users = {str(row['id']): row for row in userrows}
+                numfetched = len(userrows)
+                fullrefreshed = now.timestamp()
+
+            self._write({'fullrefresh': fullrefreshed, 'watermark': now.isoformat(), 'users': users})
+            current_app.logger.debug(f'{self.users.__qualname__}(): {"incremental" if incremental else "full"} refresh '
+                                     f'fetched {numfetched} of {len(users)} users')
+
+        return {int(userid): user for userid, user in users.items()}
+
+
+class DiscourseSnapshot:
+    """Discourse users, invites and user emails, loaded once so several community group
+    syncs can be reconciled against them
+
+    The caller should hold COMMUNITY_LOCKFILE from load() until the last sync using the
+    snapshot is finished, so other community commands can't change Discourse underneath it.
+
+    Args:
+        discourse: rate-limited fluent_discourse client
+        interest (str): interest short name
+    """
+
+    def __init__(self, discourse, interest):
+        self.discourse = discourse
+        self.interest = interest
+        self.id2users = {}
+        self.invites = {}
+        self.invitegroups = {}
+        self.email2user = {}
+        # groups are only paged through as far as needed to find the requested group names
+        self.groupids = {}
+        self._grouppage = 0
+        self._allgroups = False
+
+    def load(self):
+        """load users, invites and user emails from Discourse
+
+        :rtype: self
+        """
+        self.id2users = DiscourseUserDirectory(self.interest, self.discourse).users()
+
+        # https://meta.discourse.org/t/run-data-explorer-queries-with-the-discourse-api/120063
+        inviterows = iter_query_paged(self.discourse, current_app.config['DISCOURSE_API_INVITES_QUERY_FSRC'],
+                                      prefetch=True)
+        # only save active invites targeted to specific email addresses which have not been redeemed
+        self.invites = {row['email']: row for row in inviterows if not row['deleted_at'] and not row['invalidated_at']
+                        and row['email']
+                        and row['redemption_count']==0}
+
+        invitegrouprows = iter_query_paged(self.discourse, current_app.config['DISCOURSE_API_INVITE_GROUPS_QUERY_FSRC'],
+                                           rowtype=QUERY_ROW_NAMEDTUPLE, prefetch=True)
+        # create list of group ids by invite id
+        self.invitegroups = {}
+        for row in invitegrouprows:
+            self.invitegroups.setdefault(row.invite_id, [])
+            self.invitegroups[row.invite_id].append(row.group_id)
+
+        emailrows = iter_query_paged(self.discourse, current_app.config['DISCOURSE_API_USER_EMAIL_QUERY_FSRC'],
+                                     prefetch=True)
+        self.email2user = {row['email']: row for row in emailrows}
+
+        return self
+
+    def get_group_id(self, groupname):
+        """get the id of a Discourse group
+
+        :param groupname: Discourse group name
+        :rtype: group id, or None if not found
+        """
+        # https://docs.discourse.org/#tag/Groups/operation/listGroups
+        while groupname not in self.groupids and not self._allgroups:
+            resp = self.discourse.groups.json.get({'page': self._grouppage})
+            page_groups = resp.get('groups', [])
+            if not page_groups:
+                self._allgroups = True
+                break
+            for group in page_groups:
+                self.groupids[group['name']] = group['id']
+            self._grouppage += 1
+        return self.groupids.get(groupname)
+
+    def add_invite(self, invite, group_ids):
+        """record an invite created during the sync, so later syncs update it rather than create another
+
+        :param invite: invite record, having at least id and email
+        :param group_ids: list of group ids the invite is for
+        """
+        self.invites[invite['email']] = invite
+        self.invitegroups[invite['id']] = list(group_ids)
+
+    def set_invite_groups(self, invite_id, group_ids):
+        """record the groups an invite was updated to during the sync
+
+        :param invite_id: invite id
+        :param group_ids: list of group ids the invite is now for
+        """
+        self.invitegroups[invite_id] = list(group_ids)
+
+    def remove_invite(self, email):
+        """forget an invite deleted during the sync, so later syncs create a new one if needed
+
+        :param email: email address the invite was for
+        """
+        invite = self.invites.pop(email, None)
+        if invite:
+            self.invitegroups.pop(invite['id'], None)
+
+
+# invite mutations queued by a community group import, and run together by finish_import(), with
+# DISCOURSE_INVITE_CONCURRENCY calls at once (all still paced by the shared rate limiter). Creates
+# go through Discourse's bulk invite endpoint, DISCOURSE_BULK_INVITE_MAX emails per call
+DISCOURSE_INVITE_CONCURRENCY = 4
+DISCOURSE_BULK_INVITE_MAX = 200
+
+# Discourse Invite.emailed_status for an invite created with skip_email
+INVITE_EMAILED_STATUS_NOT_REQUIRED = 0
+
+# action is create, update or delete; group_ids is as sent to Discourse, a group id or comma separated ids
+InviteMutation = namedtuple('InviteMutation', 'action email invite_id group_ids')
+
+
 class CommunitySyncManager(SyncManager):
     """put participants into discourse community group
     
@@ -299,14 +848,19 @@ class CommunitySyncManager(SyncManager):
     Args:
         interest (str): interest short name
         communitygroupname (str): Discourse community group name
+        snapshot (DiscourseSnapshot): loaded snapshot shared with other group syncs, in which
+            case the caller holds COMMUNITY_LOCKFILE; default is to lock and load a snapshot for
+            this import only
     """
     
-    def __init__(self, interest, communitygroupname, skipemail):
+    def __init__(self, interest, communitygroupname, skipemail, snapshot=None):
         """_summary_
 
         """
+        self.interest = interest
         self.communitygroupname = communitygroupname
         self.skipemail = skipemail
+        self.sharedsnapshot = snapshot
         
         self.discourse = make_discourse_client(interest)
     
@@ -322,74 +876,39 @@ class CommunitySyncManager(SyncManager):
         email = self.get_email(svcuser)
         return self.email2user[email]['user_id'] if email in self.email2user else email
     
-    def _run_query_paged(self, query_id, page_size=1000):
-        """Run a Data Explorer query collecting all pages of results.
-
-        :param query_id: Discourse Data Explorer query id
-        :param page_size: rows per page; must match the :page_size SQL parameter default
-        :returns: (columns, rows) where rows is the combined list across all pages
-        """
-        return run_query_paged(self.discourse, query_id, page_size=page_size)
-
     def start_import(self):
         """runtime start for import from Community perspective
 
         """
-        # interprocess lock to prevent multiple imports at once
-        self.lock = InterProcessLock(COMMUNITY_LOCKFILE)
-        self.lock.acquire()
+        # interprocess lock to prevent multiple imports at once, unless the caller holds it for a shared snapshot
+        if self.sharedsnapshot:
+            self.lock = None
+            self.snapshot = self.sharedsnapshot
+        else:
+            self.lock = InterProcessLock(COMMUNITY_LOCKFILE)
+            self.lock.acquire()
+            self.snapshot = DiscourseSnapshot(self.discourse, self.interest).load()
         
         # sets to track users to add/remove
         self.add_userids = set()
         self.remove_userids = set()
         self.remove_group_invites = set()
+        # invite changes, made in finish_import
+        self.invite_mutations = []
+        self.invite_report = None
 
-        # https://docs.discourse.org/#tag/Admin/operation/adminListUsers
-        
-        page = 1
-        userrows = []
-        while True:
-            resp = self.discourse.admin.users.json.get({'page': page})
-            if not resp:
-                break
-            userrows.extend(resp)
-            page += 1
-        self.id2users = {row['id']: row for row in userrows}
+        # these are shared with any other syncs using the snapshot
+        self.id2users = self.snapshot.id2users
+        self.invites = self.snapshot.invites
+        self.invitegroups = self.snapshot.invitegroups
+        self.email2user = self.snapshot.email2user
 
         # save group id for current group
-        # https://docs.discourse.org/#tag/Groups/operation/listGroups
-        self.communitygroupid = None
-        page = 0
-        while not self.communitygroupid:
-            resp = self.discourse.groups.json.get({'page': page})
-            page_groups = resp.get('groups', [])
-            if not page_groups:
-                break
-            for group in page_groups:
-                if group['name'] == self.communitygroupname:
-                    self.communitygroupid = group['id']
-                    break
-            page += 1
+        self.communitygroupid = self.snapshot.get_group_id(self.communitygroupname)
         if not self.communitygroupid:
             raise ValueError(f'{self.start_import.__qualname__}(): community group {self.communitygroupname} not found in Discourse')
         current_app.logger.debug(f'{self.start_import.__qualname__}(): community group {self.communitygroupname} has id {self.communitygroupid}')
 
-        # https://meta.discourse.org/t/run-data-explorer-queries-with-the-discourse-api/120063
-        columns, rows = self._run_query_paged(current_app.config['DISCOURSE_API_INVITES_QUERY_FSRC'])
-        inviterows = [dict(zip(columns, row)) for row in rows]
-        # only save active invites targeted to specific email addresses which have not been redeemed
-        self.invites = {row['email']: row for row in inviterows if not row['deleted_at'] and not row['invalidated_at']
-                        and row['email']
-                        and row['redemption_count']==0}
-
-        columns, rows = self._run_query_paged(current_app.config['DISCOURSE_API_INVITE_GROUPS_QUERY_FSRC'])
-        invitegrouprows = [dict(zip(columns, row)) for row in rows]
-        # create list of group ids by invite id
-        self.invitegroups = {}
-        for row in invitegrouprows:
-            self.invitegroups.setdefault(row['invite_id'], [])
-            self.invitegroups[row['invite_id']].append(row['group_id'])
-
         super().start_import()
     
     def get_users_from_group(self):
@@ -397,15 +916,6 @@ class CommunitySyncManager(SyncManager):
         
         :rtype: dict of group user records indexed by user_id / invite records indexed by email
         """
-        # https://meta.discourse.org/t/run-data-explorer-queries-with-the-discourse-api/120063
-        columns, rows = self._run_query_paged(current_app.config['DISCOURSE_API_USER_EMAIL_QUERY_FSRC'])
-        emailrows = [dict(zip(columns, row)) for row in rows]
-        self.email2user = {row['email']: row for row in emailrows}
-        id2emails = {}
-        for row in emailrows:
-            id2emails.setdefault(row['user_id'], [])
-            id2emails[row['user_id']].append(row['email'])
-
         # https://docs.discourse.org/#tag/Groups/operation/listGroupMembers
         all_members = []
         offset = 0
@@ -492,11 +1002,10 @@ class CommunitySyncManager(SyncManager):
                 invite = self.invites[email]
                 invite_id = invite['id']
                 email = invite['email']
-                invite_group_ids = self.invitegroups[invite_id]
 
-                # remove this group from the invite
+                # remove this group from the invite; the snapshot is updated once the change has been made
                 # TODO: what should we do if invite has expired?
-                invite_group_ids.remove(self.communitygroupid)
+                invite_group_ids = [g for g in self.invitegroups[invite_id] if g != self.communitygroupid]
                 
                 # still have other groups, so update invite
                 if len(invite_group_ids) != 0:
@@ -504,27 +1013,29 @@ class CommunitySyncManager(SyncManager):
                     current_app.logger.debug(f'{self.finish_import.__qualname__}(): updating '
                                                 f'Discourse invite for email {email} to remove '
                                                 f'group {self.communitygroupname} final group_ids {group_ids}')
-                    # interface reverse engineered from Discourse web app
-                    try:
-                        self.discourse.invites._(invite_id).put({
-                            'email': email,
-                            'group_ids': group_ids,
-                            'skip_email': True,
-                        })
-                    except DiscourseError as e:
-                        current_app.logger.error(f'{self.finish_import.__qualname__}(): error updating Discourse invite for email {email}: {e}')
+                    self.invite_mutations.append(InviteMutation('update', email, invite_id, group_ids))
 
                 # no other groups, so delete invite
                 else:
                     current_app.logger.debug(f'{self.finish_import.__qualname__}(): deleting Discourse invite for email {email} since no more groups remain')
-                    try:
-                        self.discourse.invites.json.delete({'id': invite_id})
-                    except DiscourseError as e:
-                        current_app.logger.error(f'{self.finish_import.__qualname__}(): error deleting Discourse invite for email {email}: {e}')
-                # TODO: do we need to update our local invite tracking info?
+                    self.invite_mutations.append(InviteMutation('delete', email, invite_id, None))
 
+        # make the invite changes
+        if self.invite_mutations:
+            self.invite_report = self.run_invite_mutations(self.invite_mutations)
+            report = {k: v for k, v in self.invite_report.items() if k != 'errors'}
+            current_app.logger.info(f'{self.finish_import.__qualname__}(): group {self.communitygroupname} invites '
+                                    f'{report}, {len(self.invite_report["errors"])} errors')
+
+        # release interprocess lock to prevent multiple imports at once
+        if self.lock:
+            self.lock.release()
+
+    def abort_import(self):
+        """end import process without making any changes"""
         # release interprocess lock to prevent multiple imports at once
-        self.lock.release()
+        if self.lock:
+            self.lock.release()
 
     def add_user_to_group(self, svcuser, groupuserkey):
         """add user to internal group
@@ -554,34 +1065,131 @@ class CommunitySyncManager(SyncManager):
                 # add this group to the invite if it's not already there
                 # TODO: what should we do if invite has expired?
                 if self.communitygroupid not in invite_group_ids:
-                    invite_group_ids.append(self.communitygroupid)
-                    group_ids = ','.join([str(g) for g in invite_group_ids])
+                    # the snapshot is updated once the change has been made
+                    group_ids = ','.join([str(g) for g in invite_group_ids + [self.communitygroupid]])
                     current_app.logger.debug(f'{self.add_user_to_group.__qualname__}(): updating '
                                              f'Discourse invite for email {email} to add '
                                              f'group {self.communitygroupname} final group_ids {group_ids}')
-                    # interface reverse engineered from Discourse web app
-                    try:
-                        self.discourse.invites._(invite_id).put({
-                            'email': email,
-                            'group_ids': group_ids,
-                            'skip_email': True,
-                        })
-                    except DiscourseError as e:
-                        current_app.logger.error(f'{self.add_user_to_group.__qualname__}(): error updating Discourse invite for email {email}: {e}')
-                # TODO: do we need to update our local invite tracking info?
+                    self.invite_mutations.append(InviteMutation('update', email, invite_id, group_ids))
 
             # invite user if no invite exists; only send email if requested
             else:
                 current_app.logger.debug(f'{self.add_user_to_group.__qualname__}(): creating Discourse invite for email {email} to join group {self.communitygroupname}')
+                self.invite_mutations.append(InviteMutation('create', email, None, self.communitygroupid))
+
+    def _run_invite_mutation(self, mutation):
+        """make one invite change
+
+        :param mutation: InviteMutation
+        """
+        if mutation.action == 'create':
+            invite = self.discourse.invites.json.post({
+                'email': mutation.email,
+                'group_ids': mutation.group_ids,
+                'skip_email': self.skipemail,
+            })
+            # later syncs sharing the snapshot add their groups to this invite
+            if isinstance(invite, dict) and 'id' in invite:
+                self.snapshot.add_invite({**invite, 'email': mutation.email}, [self.communitygroupid])
+
+        elif mutation.action == 'update':
+            # interface reverse engineered from Discourse web app
+            self.discourse.invites._(mutation.invite_id).put({
+                'email': mutation.email,
+                'group_ids': mutation.group_ids,
+                'skip_email': True,
+            })
+            # later syncs sharing the snapshot see the invite's new groups
+            self.snapshot.set_invite_groups(mutation.invite_id, [int(g) for g in mutation.group_ids.split(',')])
+
+        else:
+            self.discourse.invites.json.delete({'id': mutation.invite_id})
+            # later syncs sharing the snapshot create a new invite if they need one
+            self.snapshot.remove_invite(mutation.email)
+
+    def _bulk_create_invites(self, creates, report):
+        """create invites through Discourse's bulk invite endpoint
+
+        the endpoint responds with successful_invitations as [{email, invite}, ...] and
+        failed_invitations as [{email, error}, ...]. If skip_email was requested but the created
+        invites were emailed anyway, the remaining invites are created one by one
+
+        :param creates: create InviteMutations
+        :param report: run_invite_mutations() report, updated with the results
+        :returns: creates which still need to be made one by one
+        """
+        bulkmax = current_app.config.get('DISCOURSE_BULK_INVITE_MAX', DISCOURSE_BULK_INVITE_MAX)
+        for i in range(0, len(creates), bulkmax):
+            chunk = creates[i:i + bulkmax]
+            try:
+                # https://meta.discourse.org/t/bulk-invite-api/300541
+                resp = self.discourse.invites._('create-multiple').json.post({
+                    'email': [m.email for m in chunk],
+                    'group_ids': self.communitygroupid,
+                    'skip_email': self.skipemail,
+                })
+            except PageNotFoundError:
+                current_app.logger.debug(f'{self._bulk_create_invites.__qualname__}(): no bulk invite endpoint, creating invites one by one')
+                return creates[i:]
+            except (DiscourseError, RequestException) as e:
+                report['errors'] += [{'action': m.action, 'email': m.email, 'error': str(e)} for m in chunk]
+                current_app.logger.error(f'{self._bulk_create_invites.__qualname__}(): error creating Discourse invites: {e}')
+                continue
+
+            emailed = False
+            created = resp.get('successful_invitations', [])
+            for success in created:
+                invite = success.get('invite') or {}
+                if 'id' in invite:
+                    self.snapshot.add_invite({**invite, 'email': success['email']}, [self.communitygroupid])
+                if invite.get('emailed_status', INVITE_EMAILED_STATUS_NOT_REQUIRED) != INVITE_EMAILED_STATUS_NOT_REQUIRED:
+                    emailed = True
+            report['created'] += resp.get('num_successfully_created_invitations', len(created))
+            for failed in resp.get('failed_invitations', []):
+                email, error = failed.get('email'), failed.get('error', 'failed')
+                report['errors'].append({'action': 'create', 'email': email, 'error': error})
+                current_app.logger.error(f'{self._bulk_create_invites.__qualname__}(): error creating Discourse invite for email {email}: {error}')
+
+            if self.skipemail and emailed:
+                current_app.logger.warning(f'{self._bulk_create_invites.__qualname__}(): bulk invite endpoint ignored skip_email, creating invites one by one')
+                return creates[i + bulkmax:]
+        return []
+
+    def run_invite_mutations(self, mutations):
+        """make invite changes, with bounded concurrency
+
+        creates use the bulk invite endpoint if there's more than one; errors are captured per
+        call rather than stopping the rest
+
+        :param mutations: list of InviteMutation
+        :rtype: dict with created, updated, deleted counts, and errors, list of {action, email, error}
+        """
+        report = {'created': 0, 'updated': 0, 'deleted': 0, 'errors': []}
+        creates = [m for m in mutations if m.action == 'create']
+        if len(creates) > 1:
+            creates = self._bulk_create_invites(creates, report)
+        remaining = creates + [m for m in mutations if m.action != 'create']
+
+        # worker threads need the app context for config and logging
+        app = current_app._get_current_object()
+        def runone(mutation):
+            with app.app_context():
                 try:
-                    self.discourse.invites.json.post({
-                        'email': email,
-                        'group_ids': self.communitygroupid,
-                        'skip_email': self.skipemail,
-                    })
-                except DiscourseError as e:
-                    current_app.logger.error(f'{self.add_user_to_group.__qualname__}(): error creating Discourse invite for email {email}: {e}')
-                # TODO: do we need to update our local invite tracking info?
+                    self._run_invite_mutation(mutation)
+                    return None
+                except (DiscourseError, RequestException) as e:
+                    return e
+
+        concurrency = current_app.config.get('DISCOURSE_INVITE_CONCURRENCY', DISCOURSE_INVITE_CONCURRENCY)
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            for mutation, error in zip(remaining, pool.map(runone, remaining)):
+                if error:
+                    report['errors'].append({'action': mutation.action, 'email': mutation.email, 'error': str(error)})
+                    current_app.logger.error(f'{self.run_invite_mutations.__qualname__}(): error on {mutation.action} '
+                                             f'Discourse invite for email {mutation.email}: {error}')
+                else:
+                    report[{'create': 'created', 'update': 'updated', 'delete': 'deleted'}[mutation.action]] += 1
+        return report
 
     def check_update_user_in_group(self, svcuser, groupuser):
         """this is called when the user is found in the group already. There
@@ -620,11 +1228,11 @@ class DbTagCommunitySyncManager(CommunitySyncManager):
         communitygroupname (str): Discourse community group name
     """
 
-    def __init__(self, interest, tagname, communitygroupname, skipemail):
+    def __init__(self, interest, tagname, communitygroupname, skipemail, snapshot=None):
         """set up for tag-based user retrieval"""
         self.tagname = tagname
         g.interest = interest
-        CommunitySyncManager.__init__(self, interest, communitygroupname, skipemail)
+        CommunitySyncManager.__init__(self, interest, communitygroupname, skipemail, snapshot=snapshot)
         
     def get_email(self, svcuser):
         """get email from service user record
@@ -654,15 +1262,15 @@ class DbTagCommunitySyncManager(CommunitySyncManager):
 class RsuRaceCommunitySyncManager(RsuRaceSyncManager, RsuUserCommunitySyncManager):
     """put participants into discourse community group from RunSignup race"""
     
-    def __init__(self, interest, raceid, communitygroupname, skipemail):
+    def __init__(self, interest, raceid, communitygroupname, skipemail, snapshot=None):
         """initialize Rsu, Discourse, and base classes"""
-        RsuUserCommunitySyncManager.__init__(self, interest, communitygroupname, skipemail)
+        RsuUserCommunitySyncManager.__init__(self, interest, communitygroupname, skipemail, snapshot=snapshot)
         RsuRaceSyncManager.__init__(self, raceid)
 
 class RsuClubCommunitySyncManager(RsuClubSyncManager, RsuUserCommunitySyncManager):
     """put participants into discourse community group from RunSignup race"""
     
-    def __init__(self, interest, clubid, communitygroupname, skipemail):
+    def __init__(self, interest, clubid, communitygroupname, skipemail, snapshot=None):
         """initialize Rsu, Discourse, and base classes"""
-        RsuUserCommunitySyncManager.__init__(self, interest, communitygroupname, skipemail)
+        RsuUserCommunitySyncManager.__init__(self, interest, communitygroupname, skipemail, snapshot=snapshot)
         RsuClubSyncManager.__init__(self, clubid)
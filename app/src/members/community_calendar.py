@@ -8,12 +8,17 @@ required.  Tags appear in event['post']['topic']['tags'] as a list of strings.
 Event location is a separate N+1 risk: the events API doesn't return it (see
 the Discourse API Quirks note in CLAUDE.md), so it has to come from each post's
 raw content. fetch_event_locations() avoids per-post REST calls by resolving
-all of them in one (paged) Data Explorer query instead.
+all of them in one (paged) Data Explorer query instead, and EventLocations
+remembers them so only new or changed posts are resolved again.
 """
 
 # standard
+import json
 import logging as _logging
 import re
+import time as _time
+import threading
+from collections import OrderedDict
 from datetime import date, datetime, time
 from urllib.parse import urlparse
 from zoneinfo import ZoneInfo
@@ -22,10 +27,20 @@ from zoneinfo import ZoneInfo
 from icalendar import Calendar, Event
 
 # homegrown
-from .community import run_query_paged
+from .community import iter_query_paged
 
 _EVENT_LOCATION_RE = re.compile(r'\[event\b[^\]]*\blocation="([^"]*)"', re.IGNORECASE)
 
+# serialized VEVENTs, per process, so a rebuild only serializes events which changed
+VEVENT_CACHE_MAX_ENTRIES = 4096
+_vevent_cache: OrderedDict = OrderedDict()
+# rebuilds can run in background threads (see community_calendar_views)
+_vevent_cache_lock = threading.Lock()
+
+# EventLocations entries are resolved again after this long even if their post looks unchanged,
+# as the events API doesn't say when a post's raw content was last edited
+EVENT_LOCATION_MAX_AGE_SECS = 24 * 60 * 60
+
 
 def _tag_names(tags: list) -> set[str]:
     """Normalise Discourse tag list to a set of name strings.
@@ -63,17 +78,20 @@ def _parse_event_datetime(dt_str: str, tz_name: str) -> datetime:
     raise ValueError(f"Cannot parse datetime: {dt_str!r}")
 
 
-def _fetch_location(discourse, post_id: int, log) -> str | None:
+def _fetch_location(discourse, post_id: int, log, resolved: set | None = None) -> str | None:
     """Fetch a single post's raw content and extract [event location="..."].
 
     Uses /posts/{id}.json rather than /t/{topic_id}.json because the raw field
     is not reliably present in the topic endpoint response. One REST call per
     post -- only used as the fetch_event_locations() fallback when no Data
     Explorer query is configured; otherwise this is exactly the N+1 pattern
-    fetch_event_locations() exists to avoid.
+    fetch_event_locations() exists to avoid. post_id is added to resolved
+    unless the call failed.
     """
     try:
         resp = discourse.posts._(post_id).json.get({})
+        if resolved is not None:
+            resolved.add(post_id)
         raw = resp.get('raw', '')
         m = _EVENT_LOCATION_RE.search(raw)
         return m.group(1) if m else None
@@ -82,7 +100,8 @@ def _fetch_location(discourse, post_id: int, log) -> str | None:
         return None
 
 
-def fetch_event_locations(discourse, post_ids: list[int], query_id: str | None, log) -> dict[int, str]:
+def fetch_event_locations(discourse, post_ids: list[int], query_id: str | None, log,
+                          resolved: set | None = None) -> dict[int, str]:
     """Resolve [event location="..."] for a set of post ids.
 
     query_id -- id of a Discourse Data Explorer query returning (id, raw) for
@@ -93,28 +112,33 @@ def fetch_event_locations(discourse, post_ids: list[int], query_id: str | None,
     post_ids list). Falls back to the old per-post REST calls when query_id
     is absent -- same optional-config/fallback tradeoff as the category-groups
     Data Explorer query in community_taxonomy.py.
+
+    resolved -- if given, the post ids whose raw content was actually fetched,
+    with or without a location, are added to it
     """
     if not post_ids:
         return {}
     if not query_id:
         locations = {}
         for post_id in post_ids:
-            location = _fetch_location(discourse, post_id, log)
+            location = _fetch_location(discourse, post_id, log, resolved=resolved)
             if location is not None:
                 locations[post_id] = location
         return locations
     # int_list must be sent as a comma-separated string, not a JSON array -- a
     # native array's first element is silently dropped (see CLAUDE.md's Data
     # Explorer int_list quirk note for how this was diagnosed)
-    columns, rows = run_query_paged(discourse, query_id, params={'post_ids': ','.join(str(pid) for pid in post_ids)})
+    records = iter_query_paged(discourse, query_id, params={'post_ids': ','.join(str(pid) for pid in post_ids)},
+                               prefetch=True)
     locations = {}
     returned_ids = set()
-    for row in rows:
-        record = dict(zip(columns, row))
+    for record in records:
         returned_ids.add(record['id'])
         m = _EVENT_LOCATION_RE.search(record.get('raw') or '')
         if m:
             locations[record['id']] = m.group(1)
+    if resolved is not None:
+        resolved.update(returned_ids)
     missing_ids = set(post_ids) - returned_ids
     if missing_ids:
         # diagnostic for the 62-vs-63-rows discrepancy: which post id(s) the
@@ -135,6 +159,68 @@ def fetch_event_locations(discourse, post_ids: list[int], query_id: str | None,
     return locations
 
 
+def _post_version(event: dict) -> str:
+    """Fingerprint of what the events API shows of an event's post, which changes when the post is edited."""
+    post = event['post']
+    return json.dumps([post.get('version'), post.get('updated_at'), event.get('updated_at'), event.get('name'),
+                       event.get('timezone'), event['starts_at'], event['ends_at']])
+
+
+class EventLocations:
+    """Event locations remembered by post id, so only new or changed posts are resolved again.
+
+    Serializes to and from a json-compatible dict (asdict()/fromdict()) so callers can
+    persist it.
+
+    locations -- str(post id) -> [location or None, post version, time resolved]
+    """
+
+    def __init__(self, locations: dict | None = None):
+        self.locations = locations if locations is not None else {}
+
+    def resolve(self, discourse, events: list[dict], query_id: str | None, log) -> dict[int, str]:
+        """Locations for the events' posts, as fetch_event_locations(), fetching only the
+        posts which are new, changed or not resolved for EVENT_LOCATION_MAX_AGE_SECS."""
+        now = _time.time()
+        versions = {event['post']['id']: _post_version(event) for event in events}
+        stale = []
+        for post_id, version in versions.items():
+            entry = self.locations.get(str(post_id))
+            if not entry or entry[1] != version or now - entry[2] >= EVENT_LOCATION_MAX_AGE_SECS:
+                stale.append(post_id)
+
+        resolved = set()
+        fetched = fetch_event_locations(discourse, stale, query_id, log, resolved=resolved)
+        # posts which couldn't be fetched are tried again next time
+        for post_id in resolved:
+            self.locations[str(post_id)] = [fetched.get(post_id), versions[post_id], now]
+        log.debug("EventLocations.resolve(): %d/%d posts fetched, %d resolved",
+                  len(stale), len(versions), len(resolved))
+
+        locations = {post_id: self.locations[str(post_id)][0]
+                     for post_id in versions if str(post_id) in self.locations}
+        return {post_id: location for post_id, location in locations.items() if location is not None}
+
+    def merge(self, other: 'EventLocations') -> None:
+        """Keep the more recently resolved of each entry in self and other."""
+        for post_id, entry in other.locations.items():
+            if post_id not in self.locations or self.locations[post_id][2] < entry[2]:
+                self.locations[post_id] = entry
+
+    def prune(self) -> None:
+        """Forget entries too old to be used."""
+        now = _time.time()
+        self.locations = {post_id: entry for post_id, entry in self.locations.items()
+                          if now - entry[2] < EVENT_LOCATION_MAX_AGE_SECS}
+
+    def asdict(self) -> dict:
+        return {'locations': self.locations}
+
+    @classmethod
+    def fromdict(cls, d: dict) -> 'EventLocations':
+        return cls(d['locations'])
+
+
 def _build_vevent(event: dict, base_url: str, location: str | None = None) -> Event:
     """Build an icalendar Event from one /discourse-post-event/events entry."""
     cal_event = Event()
@@ -150,6 +236,23 @@ def _build_vevent(event: dict, base_url: str, location: str | None = None) -> Ev
     return cal_event
 
 
+def _vevent_bytes(event: dict, base_url: str, location: str | None = None) -> bytes:
+    """_build_vevent(...).to_ical(), cached on everything _build_vevent() reads from its arguments."""
+    key = (base_url, event['id'], event.get('name'), event['post']['topic'].get('title'), event.get('timezone'),
+           event['starts_at'], event['ends_at'], event['post']['url'], location)
+    with _vevent_cache_lock:
+        vevent = _vevent_cache.get(key)
+        if vevent is not None:
+            _vevent_cache.move_to_end(key)
+            return vevent
+    vevent = _build_vevent(event, base_url, location=location).to_ical()
+    with _vevent_cache_lock:
+        _vevent_cache[key] = vevent
+        while len(_vevent_cache) > VEVENT_CACHE_MAX_ENTRIES:
+            _vevent_cache.popitem(last=False)
+    return vevent
+
+
 def _fetch_events(discourse, from_date: date | None, to_date: date | None, log) -> list[dict]:
     """Call /discourse-post-event/events for the given date window.
 
@@ -175,17 +278,71 @@ def _fetch_events(discourse, from_date: date | None, to_date: date | None, log)
     return events
 
 
+def _event_window(from_date: date | None, to_date: date | None) -> tuple[date, date]:
+    """Default date window for the calendar feed: Jan 1 of the current year, open-ended future."""
+    today = date.today()
+    return from_date or date(today.year, 1, 1), to_date or date(today.year + 10, 12, 31)
+
+
+class EventIndex:
+    """Events for one date window, with an inverted index from tag to the events carrying it.
+
+    Any union of tags is answered from the index, so feeds for different tags over the
+    same window can share one /discourse-post-event/events fetch. Serializes to and from
+    a json-compatible dict (asdict()/fromdict()) so callers can cache it.
+
+    events -- the /discourse-post-event/events entries, in API order
+    tags   -- tag name -> indexes into events, ascending
+    """
+
+    def __init__(self, events: list[dict], tags: dict[str, list[int]] | None = None):
+        self.events = events
+        if tags is None:
+            tags = {}
+            for i, event in enumerate(events):
+                for tag in _tag_names(event.get('post', {}).get('topic', {}).get('tags', [])):
+                    tags.setdefault(tag, []).append(i)
+        self.tags = tags
+
+    def select(self, tags: list[str] | None = None) -> list[dict]:
+        """Events carrying any of tags, in API order; None or empty means all events."""
+        if not tags:
+            return self.events
+        selected = set()
+        for tag in tags:
+            selected.update(self.tags.get(tag, []))
+        return [self.events[i] for i in sorted(selected)]
+
+    def asdict(self) -> dict:
+        return {'events': self.events, 'tags': self.tags}
+
+    @classmethod
+    def fromdict(cls, d: dict) -> 'EventIndex':
+        return cls(d['events'], d['tags'])
+
+
+def fetch_event_index(discourse, from_date: date | None = None, to_date: date | None = None,
+                      log=None) -> EventIndex:
+    """Fetch the events for a date window (defaults as for filter_tags_to_bytes) and index them by tag."""
+    if log is None:
+        log = _logging.getLogger(__name__)
+    from_date, to_date = _event_window(from_date, to_date)
+    return EventIndex(_fetch_events(discourse, from_date, to_date, log))
+
+
 def filter_tags_to_bytes(base_url: str, discourse, tags: list[str] | None = None,
                          from_date: date | None = None,
                          to_date: date | None = None,
                          location_query_id: str | None = None,
                          admin_discourse=None,
-                         log=None) -> bytes:
+                         log=None,
+                         event_index: EventIndex | None = None,
+                         event_locations: EventLocations | None = None) -> bytes:
     """
     Fetch Discourse events via JSON API and return ICS bytes for a set of tags.
 
     Intended for the web route (on-demand).  No file I/O or disk cache — the
-    caller owns any caching layer (e.g. _ics_cache in community_calendar_views).
+    caller owns any caching layer (e.g. IcsCache in community_calendar_views).
 
     base_url          — Discourse site root
     discourse         — _RateLimitedDiscourse instance; typically authenticated
@@ -206,24 +363,19 @@ def filter_tags_to_bytes(base_url: str, discourse, tags: list[str] | None = None
                          location_query_id is None, since the REST fallback works
                          fine with any authenticated account.
     log               — logger
+    event_index       — events already fetched for from_date/to_date (see
+                         fetch_event_index()), e.g. shared by the feeds for
+                         different tags; None fetches them
+    event_locations   — locations remembered from earlier builds, updated with
+                         any resolved now; None resolves all of them
     """
     if log is None:
         log = _logging.getLogger(__name__)
-    today = date.today()
-    from_date = from_date or date(today.year, 1, 1)
-    to_date = to_date or date(today.year + 10, 12, 31)
     required_tags = set(tags) if tags else None
 
-    events = _fetch_events(discourse, from_date, to_date, log)
-
-    if required_tags is not None:
-        matched_events = []
-        for event in events:
-            topic_tags = _tag_names(event.get('post', {}).get('topic', {}).get('tags', []))
-            if required_tags & topic_tags:
-                matched_events.append(event)
-    else:
-        matched_events = events
+    if event_index is None:
+        event_index = fetch_event_index(discourse, from_date, to_date, log)
+    matched_events = event_index.select(tags)
 
     # dict.fromkeys dedupes while preserving order -- recurring discourse-calendar
     # events can produce multiple event entries (one per occurrence) that all
@@ -231,17 +383,19 @@ def filter_tags_to_bytes(base_url: str, discourse, tags: list[str] | None = None
     # ids than there are matched_events
     post_ids = list(dict.fromkeys(event['post']['id'] for event in matched_events))
     location_discourse = admin_discourse if location_query_id and admin_discourse else discourse
-    locations = fetch_event_locations(location_discourse, post_ids, location_query_id, log)
+    if event_locations is not None:
+        locations = event_locations.resolve(location_discourse, matched_events, location_query_id, log)
+    else:
+        locations = fetch_event_locations(location_discourse, post_ids, location_query_id, log)
 
     cal = Calendar()
     cal.add('PRODID', '-//FSRC Calendar//EN')
     cal.add('VERSION', '2.0')
+    # the same bytes as adding the events to cal, but each event is only serialized once it changes
+    header, footer = cal.to_ical().split(b'END:VCALENDAR')
 
-    count = 0
-    for event in matched_events:
-        location = locations.get(event['post']['id'])
-        cal.add_component(_build_vevent(event, base_url, location=location))
-        count += 1
+    vevents = [_vevent_bytes(event, base_url, location=locations.get(event['post']['id']))
+               for event in matched_events]
 
-    log.debug("Built events.ics (%d events, tags=%s)", count, sorted(required_tags) if required_tags else 'all')
-    return cal.to_ical()
+    log.debug("Built events.ics (%d events, tags=%s)", len(vevents), sorted(required_tags) if required_tags else 'all')
+    return b''.join([header, *vevents, b'END:VCALENDAR', footer])
@@ -2,9 +2,11 @@
 
 # standard
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # pypi
+from flask import current_app
 from fluent_discourse import Discourse, DiscourseError
 from docx import Document
 from docx.shared import Pt, RGBColor, Inches
@@ -17,10 +19,14 @@ from docx.oxml import OxmlElement
 # homegrown
 from .community import (
     _RateLimitedDiscourse, _RateLimiter,
-    DISCOURSE_RATE_LIMIT_MAX_CALLS, DISCOURSE_RATE_LIMIT_WINDOW_SECS,
+    DISCOURSE_RATE_LIMIT_MAX_CALLS, DISCOURSE_RATE_LIMIT_WINDOW_SECS, DISCOURSE_PRIORITY_BULK,
 )
 
 
+# sections fetched at once by fetch_all(); all the fetches share one rate limiter
+TAXONOMY_FETCH_CONCURRENCY = 4
+
+
 # ---------------------------------------------------------------------------
 # Data fetchers
 # ---------------------------------------------------------------------------
@@ -117,7 +123,8 @@ def fetch_all(base_url, api_key, api_username, category_groups_query_id=None):
             api_key=api_key,
             raise_for_rate_limit=False,
         ),
-        _RateLimiter(max_calls=DISCOURSE_RATE_LIMIT_MAX_CALLS, window_secs=DISCOURSE_RATE_LIMIT_WINDOW_SECS),
+        _RateLimiter(max_calls=DISCOURSE_RATE_LIMIT_MAX_CALLS, window_secs=DISCOURSE_RATE_LIMIT_WINDOW_SECS,
+                     priority=DISCOURSE_PRIORITY_BULK),
     )
 
     steps = [
@@ -133,36 +140,52 @@ def fetch_all(base_url, api_key, api_username, category_groups_query_id=None):
         ('Nav items',     'nav_items',     lambda: fetch_nav_items(discourse)),
     ]
 
-    data = {}
-    for label, key, fn in steps:
-        print(f'  Fetching {label}...', end=' ', flush=True)
-        try:
-            data[key] = fn()
-            count = len(data[key]) if isinstance(data[key], list) else len(data[key])
-            print(f'OK ({count} items)')
-        except Exception as e:
-            print(f'WARN: {e}')
-            data[key] = [] if key != 'site_settings' else {}
-
-    data['title'] = fetch_site_title(discourse)
-
-    # Merge category group permissions from Data Explorer query
-    if category_groups_query_id and data.get('categories'):
-        print('  Fetching category group permissions...', end=' ', flush=True)
-        try:
-            cg_rows = fetch_category_groups(discourse, category_groups_query_id)
-            perms_by_cat = {}
-            for row in cg_rows:
-                perms_by_cat.setdefault(row['category_id'], []).append({
-                    'group_name': row['group_name'],
-                    'permission_type': row['permission_type'],
-                })
-            for c in data['categories']:
-                if c['id'] in perms_by_cat:
-                    c['group_permissions'] = perms_by_cat[c['id']]
-            print(f'OK ({len(cg_rows)} rows)')
-        except Exception as e:
-            print(f'WARN: {e}')
+    # the sections are independent, so they're fetched concurrently, and reported in order
+    app = current_app._get_current_object()
+    def in_app_context(fn):
+        def run():
+            with app.app_context():
+                return fn()
+        return run
+
+    with ThreadPoolExecutor(max_workers=TAXONOMY_FETCH_CONCURRENCY) as executor:
+        futures = [(label, key, executor.submit(in_app_context(fn))) for label, key, fn in steps]
+        title = executor.submit(in_app_context(lambda: fetch_site_title(discourse)))
+        cg_rows = None
+
+        data = {}
+        for label, key, future in futures:
+            try:
+                data[key] = future.result()
+                count = len(data[key]) if isinstance(data[key], list) else len(data[key])
+                print(f'  Fetching {label}... OK ({count} items)', flush=True)
+            except Exception as e:
+                print(f'  Fetching {label}... WARN: {e}', flush=True)
+                data[key] = [] if key != 'site_settings' else {}
+
+            # category group permissions are only needed if there are categories, so the query
+            # is started once they're in, while the later sections are still being fetched
+            if key == 'categories' and category_groups_query_id and data['categories']:
+                cg_rows = executor.submit(in_app_context(lambda: fetch_category_groups(discourse, category_groups_query_id)))
+
+        data['title'] = title.result()
+
+        # Merge category group permissions from Data Explorer query
+        if cg_rows:
+            try:
+                cg_rows = cg_rows.result()
+                perms_by_cat = {}
+                for row in cg_rows:
+                    perms_by_cat.setdefault(row['category_id'], []).append({
+                        'group_name': row['group_name'],
+                        'permission_type': row['permission_type'],
+                    })
+                for c in data['categories']:
+                    if c['id'] in perms_by_cat:
+                        c['group_permissions'] = perms_by_cat[c['id']]
+                print(f'  Fetching category group permissions... OK ({len(cg_rows)} rows)', flush=True)
+            except Exception as e:
+                print(f'  Fetching category group permissions... WARN: {e}', flush=True)
 
     return data
 
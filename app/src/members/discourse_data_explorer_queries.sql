@@ -65,7 +65,7 @@ ORDER BY c.name, g.name
 -- Used by: CommunitySyncManager.start_import() (community.py)
 -- Purpose: pending Discourse invites, to reconcile against community group
 --   membership for people who haven't signed up yet.
--- Params: :page_size / :page_num (paged via community.run_query_paged())
+-- Params: :page_size / :page_num (paged via community.iter_query_paged())
 -- Returns: id, email, deleted_at, invalidated_at, redemption_count
 --   (only rows with email set, not deleted/invalidated, and
 --   redemption_count == 0 are kept -- see start_import())
@@ -85,7 +85,7 @@ LIMIT :page_size OFFSET (:page_num * :page_size)
 -- Used by: CommunitySyncManager.start_import() (community.py)
 -- Purpose: which groups each pending invite (see INVITES_QUERY above) is
 --   targeted at.
--- Params: :page_size / :page_num (paged via community.run_query_paged())
+-- Params: :page_size / :page_num (paged via community.iter_query_paged())
 -- Returns: invite_id, group_id
 -- =============================================================================
 
@@ -103,7 +103,7 @@ LIMIT :page_size OFFSET (:page_num * :page_size)
 -- Used by: CommunitySyncManager (community.py)
 -- Purpose: map email addresses to Discourse user ids, since Discourse's own
 --   user-listing REST endpoints don't return email addresses.
--- Params: :page_size / :page_num (paged via community.run_query_paged())
+-- Params: :page_size / :page_num (paged via community.iter_query_paged())
 -- Returns: email, user_id
 -- =============================================================================
 
@@ -114,4 +114,28 @@ LIMIT :page_size OFFSET (:page_num * :page_size)
 SELECT * from user_emails
 
 ORDER BY id
-LIMIT :page_size OFFSET (:page_num * :page_size)
\ No newline at end of file
+LIMIT :page_size OFFSET (:page_num * :page_size)
+
+-- =============================================================================
+-- DISCOURSE_API_USERS_UPDATED_QUERY_FSRC
+-- Used by: DiscourseUserDirectory.users() (community.py)
+-- Purpose: users created or updated since the user directory cache was last
+--   refreshed, so the cache doesn't have to page through admin/users.json.
+--   Optional -- without it every refresh is a full refresh.
+-- Params: datetime :updated_since (UTC), :page_size / :page_num (paged via
+--   community.iter_query_paged())
+-- Returns: id, username, name, active, created_at, updated_at
+-- =============================================================================
+
+-- [params]
+-- datetime :updated_since = 1970-01-01 00:00:00
+-- int :page_num = 0
+-- int :page_size = 1000
+
+SELECT id, username, name, active, created_at, updated_at
+FROM users
+WHERE id > 0
+  AND (updated_at >= :updated_since OR created_at >= :updated_since)
+
+ORDER BY id
+LIMIT :page_size OFFSET (:page_num * :page_size)
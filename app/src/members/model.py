@@ -903,6 +903,21 @@ class TableUpdateTime(Base):
     interest            = relationship('LocalInterest', backref=backref('tableupdatetimes'))
     tablename           = Column(Text)
     lastchecked         = Column(DateTime)
+    # high-water mark: latest service last_modified merged into the table, for incremental updates
+    last_modified       = Column(DateTime)
+
+class MemberCount(Base):
+    '''
+    number of members on each date, maintained as memberdates change by membership update
+    '''
+    __tablename__ = 'membercount'
+    id                  = Column( Integer, primary_key=True )
+    interest_id         = Column(Integer, ForeignKey('localinterest.id'))
+    interest            = relationship('LocalInterest', backref=backref('membercounts'))
+    date                = Column(Date)
+    count               = Column(Integer)
+
+    __table_args__ = (UniqueConstraint('interest_id', 'date', name='uq_membercount_interest_date'),)
 
 rt_config_openbehaviors = 'auto,open,closed'.split(',')
 RT_CONFIG_OPEN_AUTO = 'auto'
@@ -159,6 +159,23 @@ function set_effective_date(effective_date_id, todays_date_id) {
     })
 }
 
+/**
+ * handles CSV button for server side tables, downloading all the rows matching the table's
+ * current search and order from the streaming <rule>/csv endpoint
+ *
+ * @param e - event
+ * @param dt - datatables instance
+ * @param node - button node
+ * @param config - button configuration
+ */
+function serverside_csv(e, dt, node, config) {
+    // ajax.params() includes ondate if it was added by set_effective_date()
+    var params = Object.assign(allUrlParams(), dt.ajax.params());
+    params.start = 0;
+    params.length = -1;
+    window.location.href = window.location.pathname + '/csv?' + $.param(params);
+}
+
 function afterdatatables() {
     console.log('afterdatatables()');
 
@@ -119,12 +119,21 @@ $( function () {
   }
 
   var interest = get_group_val();
-  d3.json('/' + interest + '/_memberstats')
+  // compact format is [{year:year, dates:[date, ...], counts:[count, ...]}, ... ]
+  d3.json('/' + interest + '/_memberstats?format=compact')
     .then((contents) => {
       if (!contents.success) throw "error response from api";
 
       // data is page global for membership_setshowlabels()
-      data = contents.data;
+      // expand compact format to [{year:year, counts: [{'date':date, 'count':count}, ... ]}, ... ]
+      data = contents.data.map(function(yeardata) {
+        return {
+          year: yeardata.year,
+          counts: yeardata.dates.map(function(date, ndx) {
+            return {date: date, count: yeardata.counts[ndx]};
+          })
+        };
+      });
       var cachetime = contents.cachetime;
 
       // do this before parsing all the dates
@@ -1,9 +1,43 @@
 """helper functions for managing user groups
 """
+# standard
+from logging import DEBUG, WARNING
+from time import perf_counter
+
 # pypi
 from flask import current_app
 
-from logging import DEBUG, WARNING
+class SyncPlan(object):
+    """changes needed to bring the internal group in sync with the service
+
+    Args:
+        add (dict): service user records to add, indexed by group user key
+        remove (list): group user keys to remove
+        update (dict): (service user, group user) pairs to check for update, indexed by group user key
+    """
+    def __init__(self, add=None, remove=None, update=None):
+        self.add = add or {}
+        self.remove = remove or []
+        self.update = update or {}
+        # seconds taken by each phase of the import
+        self.timings = {}
+
+    @property
+    def counts(self):
+        return {'add': len(self.add), 'remove': len(self.remove), 'update': len(self.update)}
+
+    def asdict(self):
+        """serializable version of the plan, group user keys only
+
+        :rtype: dict with counts, timings, add, remove, update
+        """
+        return {
+            'counts': self.counts,
+            'timings': {phase: round(secs, 3) for phase, secs in self.timings.items()},
+            'add': list(self.add),
+            'remove': list(self.remove),
+            'update': list(self.update),
+        }
 
 class SyncManager(object):
     def __init__(self):
@@ -54,12 +88,77 @@ class SyncManager(object):
         """
         pass
     
+    def add_users_to_group(self, adds):
+        """add service users to internal group, override to batch the adds
+
+        :param adds: dict of service user records indexed by group user key
+        """
+        for groupuserkey, svcuser in adds.items():
+            self.add_user_to_group(svcuser, groupuserkey)
+
+    def remove_users_from_group(self, groupuserkeys):
+        """remove users from internal group, override to batch the removes
+
+        :param groupuserkeys: list of group user keys
+        """
+        for groupuserkey in groupuserkeys:
+            self.remove_user_from_group(groupuserkey)
+
+    def check_update_users_in_group(self, updates):
+        """update users in internal group, if needed, override to batch the updates
+
+        :param updates: dict of (service user, group user) indexed by group user key
+        """
+        for svcuser, groupuser in updates.values():
+            self.check_update_user_in_group(svcuser, groupuser)
+
     def finish_import(self):
         """finalize import process"""
         pass
+
+    def abort_import(self):
+        """end import process without making any changes, e.g., when only the plan was requested"""
+        pass
+
+    def plan_import(self, svcusers, groupusers):
+        """determine the changes needed to bring the internal group in sync with the service
+
+        the plan follows service order; if several service users have the same group user key,
+        the first one is used
+
+        :param svcusers: dict of service user records, from get_users_from_service()
+        :param groupusers: dict of group user records, from get_users_from_group()
+        :rtype: SyncPlan
+        """
+        svcbykey = {}
+        for svcuser in svcusers.values():
+            svcbykey.setdefault(self.get_group_key_from_service_user(svcuser), svcuser)
+
+        addkeys = svcbykey.keys() - groupusers.keys()
+        updatekeys = svcbykey.keys() & groupusers.keys()
+        removekeys = groupusers.keys() - svcbykey.keys()
+
+        return SyncPlan(
+            add={key: svcuser for key, svcuser in svcbykey.items() if key in addkeys},
+            remove=[key for key in groupusers if key in removekeys],
+            update={key: (svcuser, groupusers[key]) for key, svcuser in svcbykey.items() if key in updatekeys},
+        )
+
+    def apply_plan(self, plan):
+        """make the changes in the plan
+
+        :param plan: SyncPlan from plan_import()
+        """
+        self.check_update_users_in_group(plan.update)
+        self.add_users_to_group(plan.add)
+        self.remove_users_from_group(plan.remove)
     
-    def import_group(self, debug=False, debugrequests=False):
-        """import users from some service to internal group"""
+    def import_group(self, debug=False, debugrequests=False, planonly=False):
+        """import users from some service to internal group
+
+        :param planonly: if True, determine the changes but don't make them
+        :rtype: SyncPlan
+        """
 
         # set up logging
         thislogger = current_app.logger
@@ -78,33 +177,37 @@ class SyncManager(object):
             logging.basicConfig()     
         
         # do any initialization the import requires
+        started = perf_counter()
         self.start_import()
-        
+        timings = {'start': perf_counter() - started}
+
         # download member list from external service and current group members
+        started = perf_counter()
         svcusers = self.get_users_from_service()
+        timings['service'] = perf_counter() - started
+        started = perf_counter()
         groupusers = self.get_users_from_group()
-        
-        # loop through service members
-        for svcuserkey in svcusers:
-            svcuser = svcusers[svcuserkey]
-            groupuserkey = self.get_group_key_from_service_user(svcuser)
-
-            # if svc user is in the group
-            if groupuserkey in groupusers:
-                groupuser = groupusers.pop(groupuserkey)
-                
-                # check if any changes are required, and make them if needed
-                self.check_update_user_in_group(svcuser, groupuser)
-                
-            # if club member is missing from the internal group
-            else:
-                self.add_user_to_group(svcuser, groupuserkey)
-
-        # at this point, groupusers have only those users who are not in svcusers
-        # loop through each of these and remove from the group
-        for groupuserkey in groupusers:
-            self.remove_user_from_group(groupuserkey)
-            
+        timings['group'] = perf_counter() - started
+
+        started = perf_counter()
+        plan = self.plan_import(svcusers, groupusers)
+        timings['plan'] = perf_counter() - started
+        plan.timings = timings
+        current_app.logger.debug(f'{self.import_group.__qualname__}(): plan {plan.counts}')
+
+        # only the plan was requested, so end the import without making the changes
+        if planonly:
+            self.abort_import()
+            return plan
+
+        # make the changes
+        started = perf_counter()
+        self.apply_plan(plan)
+        timings['apply'] = perf_counter() - started
+
         # finalize the import process
+        started = perf_counter()
         self.finish_import()
+        timings['finish'] = perf_counter() - started
 
+        return plan
@@ -15,7 +15,6 @@ from loutilities.user.tables import DbCrudApiInterestsRolePermissions
 from loutilities.filters import filtercontainerdiv, filterdiv
 from loutilities.user.roles import ROLE_SUPER_ADMIN, ROLE_MEMBERSHIP_ADMIN
 from loutilities.timeu import asctime
-from loutilities.transform import Transform
 from sqlalchemy import func, select
 
 # homegrown
@@ -24,6 +23,7 @@ from ...model import db, LocalInterest
 from ...model import Member, Membership, TableUpdateTime, MemberAlias, MemberDates
 from ...version import __docversion__
 from .viewhelpers import localinterest
+from ..membership_common import MemberCountTracker, ServerSideCsvMixin, RenderedRowsServerSideMixin, SERVERSIDE_CSV_BUTTON
 
 class parameterError(Exception): pass
 class dataError(Exception): pass
@@ -41,6 +41,32 @@ adminguide = 'https://members.readthedocs.io/en/{docversion}/membership-admin-gu
 
 module_roles = [ROLE_SUPER_ADMIN, ROLE_MEMBERSHIP_ADMIN]
 
+def touch_member_table():
+    '''
+    bump the member TableUpdateTime lastchecked, as the members page caches its rows against it
+    '''
+    tableupdatetime = TableUpdateTime.query.filter_by(interest=localinterest(), tablename='member').one_or_none()
+    if not tableupdatetime:
+        tableupdatetime = TableUpdateTime(interest=localinterest(), tablename='member')
+        db.session.add(tableupdatetime)
+    tableupdatetime.lastchecked = datetime.today()
+
+class MemberTableUpdateMixin():
+    '''
+    mixin for views which write member data, so the members page shows every admin change
+    '''
+    def createrow(self, formdata):
+        touch_member_table()
+        return super().createrow(formdata)
+
+    def updaterow(self, thisid, formdata):
+        touch_member_table()
+        return super().updaterow(thisid, formdata)
+
+    def deleterow(self, thisid):
+        touch_member_table()
+        return super().deleterow(thisid)
+
 ##########################################################################################
 # clubmembers endpoint
 ##########################################################################################
@@ -50,7 +76,7 @@ clubmembers_formfields = 'rowid,svc_member_id,given_name,family_name,gender,dob,
 clubmembers_dbmapping = dict(zip(clubmembers_dbattrs, clubmembers_formfields))
 clubmembers_formmapping = dict(zip(clubmembers_formfields, clubmembers_dbattrs))
 
-class ClubMembers(DbCrudApiInterestsRolePermissions):
+class ClubMembers(MemberTableUpdateMixin, ServerSideCsvMixin, DbCrudApiInterestsRolePermissions):
     def beforequery(self):
         '''
         add update query parameters based on ondate
@@ -141,12 +167,7 @@ clubmembers_view = ClubMembers(
                     serverside = True,
                     idSrc = 'rowid', 
                     buttons=[
-                        {
-                            'extend': 'csv',
-                            'exportOptions': {
-                                'columns': ':visible'
-                            }
-                        },
+                        SERVERSIDE_CSV_BUTTON,
                     ],
 
                     dtoptions = {
@@ -169,61 +190,63 @@ memberships_formfields = 'rowid,svc_membership_id,svc_member_id,membershiptype,g
 memberships_dbmapping = dict(zip(memberships_dbattrs, memberships_formfields))
 memberships_formmapping = dict(zip(memberships_formfields, memberships_dbattrs))
 
-class MembershipsView(DbCrudApiInterestsRolePermissions):
+class MembershipsView(MemberTableUpdateMixin, ServerSideCsvMixin, DbCrudApiInterestsRolePermissions):
     def open(self):
         linterest = localinterest()
         return super().open()
 
     def deleterow(self, thisid):
-        membership = Membership.query.filter_by(id=thisid).one()
-
-        # update memberdates record(s) by recalculating contiguous membership dates
-        if membership.memberdates:
-            memberdates = membership.memberdates
-
-            # this membership will be deleted, so remove memberdates association 
-            # NOTE: this also removes membership from memberdates.memberships
-            membership.memberdates = None
-
-            # if membership is not wholly contained within memberdates, there was some data error, probably in membership_cli
-            if membership.start_date < memberdates.start_date or membership.end_date > memberdates.end_date:
-                raise dataError(f'membership {membership.id} references memberdates {memberdates.id} but extent of membership goes beyond that of memberdates')
-
-            # if membership extent is same as memberdates, this membership must have been the only membership referenced by memberdates
-            # NOTE: this membership was removed from memberdates.memberships above, so checking against 0
-            if membership.start_date == memberdates.start_date and membership.end_date == memberdates.end_date and len(memberdates.memberships) != 0:
-                raise dataError(f'memberdates {memberdates.id} has same extent as membership {membership.id} but has multiple memberships')
-
-            # if membership extent is same as memberdates, delete the memberdates record
-            if membership.start_date == memberdates.start_date and membership.end_date == memberdates.end_date:
-                db.session.delete(memberdates)
+        # keep MemberCount up to date as memberdates are changed
+        with MemberCountTracker(localinterest()):
+            membership = Membership.query.filter_by(id=thisid).one()
+
+            # update memberdates record(s) by recalculating contiguous membership dates
+            if membership.memberdates:
+                memberdates = membership.memberdates
+
+                # this membership will be deleted, so remove memberdates association 
+                # NOTE: this also removes membership from memberdates.memberships
+                membership.memberdates = None
+
+                # if membership is not wholly contained within memberdates, there was some data error, probably in membership_cli
+                if membership.start_date < memberdates.start_date or membership.end_date > memberdates.end_date:
+                    raise dataError(f'membership {membership.id} references memberdates {memberdates.id} but extent of membership goes beyond that of memberdates')
+
+                # if membership extent is same as memberdates, this membership must have been the only membership referenced by memberdates
+                # NOTE: this membership was removed from memberdates.memberships above, so checking against 0
+                if membership.start_date == memberdates.start_date and membership.end_date == memberdates.end_date and len(memberdates.memberships) != 0:
+                    raise dataError(f'memberdates {memberdates.id} has same extent as membership {membership.id} but has multiple memberships')
+
+                # if membership extent is same as memberdates, delete the memberdates record
+                if membership.start_date == memberdates.start_date and membership.end_date == memberdates.end_date:
+                    db.session.delete(memberdates)
             
-            # if membership extent starts memberdates dates, change start of memberdates to beyond the membership dates
-            elif membership.start_date == memberdates.start_date:
-                memberdates.start_date = membership.end_date + timedelta(1)
+                # if membership extent starts memberdates dates, change start of memberdates to beyond the membership dates
+                elif membership.start_date == memberdates.start_date:
+                    memberdates.start_date = membership.end_date + timedelta(1)
             
-            # if membership extent finishes memberdates dates, change end of memberdates to before the membership dates
-            elif membership.end_date == memberdates.end_date:
-                memberdates.end_date = membership.start_date - timedelta(1)
+                # if membership extent finishes memberdates dates, change end of memberdates to before the membership dates
+                elif membership.end_date == memberdates.end_date:
+                    memberdates.end_date = membership.start_date - timedelta(1)
             
-            # otherwise membership extent must be in the middle, so create a new memberdates record and update memberships to point to it
-            else:
-                # create new memberdates record by copying data in memberdates
-                cols = [k for k in MemberDates.__table__.columns.keys() if k != 'id']
-                memberdatesdata = {c: getattr(memberdates, c) for c in cols}
-                newmemberdates = MemberDates(**memberdatesdata)
-                db.session.add(newmemberdates)
-                memberdates.end_date = membership.start_date - timedelta(1)
-                newmemberdates.start_date = membership.end_date + timedelta(1)
-
-                # copy memberships as we'll be changing the list during the loop
-                thesememberships = memberdates.memberships[:]
-                for mship in thesememberships:
-                    if mship.start_date >= newmemberdates.start_date and mship.end_date <= newmemberdates.end_date:
-                        mship.memberdates = newmemberdates
-
-        # use inherited class to delete the Membership instance
-        return super().deleterow(thisid)
+                # otherwise membership extent must be in the middle, so create a new memberdates record and update memberships to point to it
+                else:
+                    # create new memberdates record by copying data in memberdates
+                    cols = [k for k in MemberDates.__table__.columns.keys() if k != 'id']
+                    memberdatesdata = {c: getattr(memberdates, c) for c in cols}
+                    newmemberdates = MemberDates(**memberdatesdata)
+                    db.session.add(newmemberdates)
+                    memberdates.end_date = membership.start_date - timedelta(1)
+                    newmemberdates.start_date = membership.end_date + timedelta(1)
+
+                    # copy memberships as we'll be changing the list during the loop
+                    thesememberships = memberdates.memberships[:]
+                    for mship in thesememberships:
+                        if mship.start_date >= newmemberdates.start_date and mship.end_date <= newmemberdates.end_date:
+                            mship.memberdates = newmemberdates
+
+            # use inherited class to delete the Membership instance
+            return super().deleterow(thisid)
 
 def memberships_pretablehtml():
     pretablehtml = div()
@@ -305,12 +328,7 @@ memberships_view = MembershipsView(
                     idSrc = 'rowid', 
                     buttons=[
                         'remove',
-                        {
-                            'extend': 'csv',
-                            'exportOptions': {
-                                'columns': ':visible'
-                            }
-                        },
+                        SERVERSIDE_CSV_BUTTON,
                     ],
 
                     dtoptions = {
@@ -433,30 +451,62 @@ expired_members_formmapping = dict(zip(expired_members_formfields, expired_membe
 
 expired_members_formmapping['dob'] = lambda m: ymd.dt2asc(m.dob)
 expired_members_formmapping['end_date'] = lambda m: ymd.dt2asc(m.end_date)
+# rows are from expired_members_stmt()
+expired_members_formmapping['facebookalias'] = lambda m: m.facebookalias
 
-class ExpiredMember():
+def expired_members_stmt(locinterest, sincedate, today):
     '''
-    allows creation of "ExpiredMember" object to simulate database behavior
+    select members whose latest membership ended on or after sincedate, but before today
+
+    a person may have several member records, identified by (family_name, given_name, middle_name, dob).
+    Only the record with the latest membership is used, the lowest member id on ties
+
+    :param locinterest: LocalInterest instance
+    :param sincedate: earliest end date of interest
+    :param today: memberships ending on or after today are not expired
+    :rtype: select statement
     '''
-    def __init__(self, **kwargs):
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
-
-member2expired_member = Transform(
-    {
-        'id': 'id',
-        'family_name': 'family_name',
-        'given_name': 'given_name',
-        'gender': 'gender',
-        'dob': 'dob',
-        'end_date': 'end_date',
-        'hometown': 'hometown',
-        'svc_member_id': 'svc_member_id',
-        'email': 'email',
-        'facebookalias': 'facebookalias',
-    }
-)
-class ExpiredMembers(DbCrudApiInterestsRolePermissions):
+    # latest end date per member
+    latest = (
+        select(Membership.member_id, func.max(Membership.end_date).label('end_date'))
+        .where(Membership.interest_id == locinterest.id, Membership.end_date >= sincedate)
+        .group_by(Membership.member_id)
+        .subquery()
+    )
+    # rank member records of the same person by their latest end date
+    rank = func.row_number().over(
+        partition_by=(Member.family_name, Member.given_name, func.coalesce(Member.middle_name, ''), Member.dob),
+        order_by=(latest.c.end_date.desc(), Member.id),
+    )
+    facebookalias = (
+        select(func.min(MemberAlias.facebookalias))
+        .where(MemberAlias.member_id == Member.id)
+        .scalar_subquery()
+    )
+    ranked = (
+        select(
+            Member.id,
+            Member.svc_member_id,
+            Member.family_name,
+            Member.given_name,
+            Member.middle_name,
+            Member.gender,
+            Member.dob,
+            Member.hometown,
+            Member.email,
+            facebookalias.label('facebookalias'),
+            latest.c.end_date,
+            rank.label('rank'),
+        )
+        .join(latest, latest.c.member_id == Member.id)
+        .subquery()
+    )
+    return (
+        select(*[c for c in ranked.c if c.name != 'rank'])
+        .where(ranked.c.rank == 1, ranked.c.end_date < today)
+    )
+
+class ExpiredMembers(RenderedRowsServerSideMixin, DbCrudApiInterestsRolePermissions):
     def beforequery(self):
         '''
         add update query parameters based on sincedate
@@ -469,75 +519,10 @@ class ExpiredMembers(DbCrudApiInterestsRolePermissions):
         else:
             self.sincedated = datetime.today().date()
 
-    def open(self):
-        locinterest = localinterest()
-        # memberships = (
-        #     Member.query
-        #     .outerjoin(MemberAlias, Member.id==MemberAlias.member_id)
-        #     .join(Membership, Member.id==Membership.member_id)
-        #     .filter_by(interest=locinterest)
-        #     .filter(Membership.end_date>=self.sincedated)
-        # ).all()
-        stmt = (
-            select(
-                Membership.id, 
-                Member.svc_member_id, 
-                Member.family_name, 
-                Member.given_name, 
-                Member.middle_name, 
-                Member.gender, 
-                Member.dob, 
-                Member.hometown, 
-                Member.email,
-                MemberAlias.facebookalias,
-                Membership.member_id,
-                Membership.end_date
-            )
-            .outerjoin(MemberAlias, Member.id==MemberAlias.member_id)
-            .join(Membership, Member.id==Membership.member_id)
-            .order_by(Membership.member_id, Membership.end_date)
-            .filter_by(interest=locinterest)
-            .filter(Membership.end_date>=self.sincedated)            
-        )
-        memberships = db.session.execute(stmt).all()
-        membershipsi = iter(memberships)
-        
-        expired_members_lookup = {}
-        try:
-            membership = next(membershipsi)
-            while True:
-                # top of loop is new member
-                # create/add expired_member
-                expired_member = ExpiredMember()
-                member2expired_member.transform(membership, expired_member)
-                expired_member.end_date = membership.end_date
-
-                # check all the memberships for this member
-                while True:
-                    if membership.end_date > expired_member.end_date:
-                        expired_member.end_date = membership.end_date
-                    
-                    # only use member record with latest membership
-                    member_dob = get_memberdob(membership)
-                    if member_dob not in expired_members_lookup or expired_member.end_date > expired_members_lookup[member_dob].end_date:
-                        expired_members_lookup[member_dob] = expired_member
-                    
-                    last_member_id = membership.member_id
-                    membership = next(membershipsi)
-                    if membership.member_id != last_member_id: break
-                
-        except StopIteration:
-            pass
-        
-        # collect interesting expired members for display
-        expired_members = []
-        for member_dob in expired_members_lookup:
-            expired_member = expired_members_lookup[member_dob]
-            # save members whose end_dates are interesting
-            if expired_member.end_date >= self.sincedated and expired_member.end_date < date.today():
-                expired_members.append(expired_member)
-
-        self.rows = iter(expired_members)
+    def renderedrows(self):
+        # grouping is done in the database, only the expired members are returned
+        stmt = expired_members_stmt(localinterest(), self.sincedated, date.today())
+        return [self.dte.get_response_data(row) for row in db.session.execute(stmt)]
         
 
 def expired_members_filters():
@@ -597,15 +582,10 @@ expired_members_view = ExpiredMembers(
                          'type': 'readonly',
                          },
                     ],
-                    serverside = False,
+                    serverside = True,
                     idSrc = 'rowid', 
                     buttons=[
-                        {
-                            'extend': 'csv',
-                            'exportOptions': {
-                                'columns': ':visible'
-                            }
-                        },
+                        SERVERSIDE_CSV_BUTTON,
                     ],
 
                     dtoptions = {
@@ -7,22 +7,237 @@ any of the listed tags.
 """
 
 # standard
+import json
+import os
+import threading
 import time
-from datetime import date
-from io import BytesIO
+from datetime import date, datetime, timezone
+from hashlib import sha1
+from tempfile import NamedTemporaryFile
 
 # pypi
-from flask import current_app, g, abort, request, send_file
+from fasteners import InterProcessLock
+from flask import current_app, g, abort, request
 
 # homegrown
 from . import bp
-from members.community import make_discourse_client
-from members.community_calendar import filter_tags_to_bytes
-
-# Compiled ICS bytes cached per (interest, tags, from_date, to_date), per worker process.
-_ics_cache: dict = {}
+from members import community
+from members.community import make_discourse_client, DISCOURSE_PRIORITY_INTERACTIVE
+from members.community_calendar import EventIndex, EventLocations, fetch_event_index, filter_tags_to_bytes
 
 ICS_CACHE_TTL = 15 * 60  # rebuild at most once per 15 minutes per (interest, tags, from, to)
+# bound on the number of feeds kept, least recently served are evicted first
+ICS_CACHE_MAX_ENTRIES = 64
+# rebuilds of feeds in the same stripe are serialized, so there is a fixed number of locks however
+# many distinct feeds are requested
+ICS_CACHE_LOCK_STRIPES = 16
+ICS_CACHE_DIRNAME = 'icscache'
+
+# the events behind the feeds, shared by all the feeds for the same (interest, from, to) whatever their tags.
+# refreshed more often than the feeds, as a feed is built from events up to this old
+EVENTS_CACHE_TTL = 5 * 60
+EVENTS_CACHE_MAX_ENTRIES = 16
+EVENTS_CACHE_DIRNAME = 'eventscache'
+
+
+class IcsCache:
+    """Compiled ICS bytes cached per (interest, tags, from_date, to_date), shared by every
+    gunicorn worker through the locks volume
+
+    Each feed is a file whose mtime is when it was built and whose atime is when it was
+    last served. Only one worker builds a given feed at a time. Once a feed is older than
+    ICS_CACHE_TTL it is still served while one worker rebuilds it in the background.
+    """
+    dirname = ICS_CACHE_DIRNAME
+    # stripes' in-process locks, as InterProcessLock doesn't exclude other threads in the same process
+    _local_locks = [threading.Lock() for i in range(ICS_CACHE_LOCK_STRIPES)]
+
+    def __init__(self):
+        self.folder = community._LOCKS_DIR / self.dirname
+        # last background refresh started, for tests
+        self.refreshthread = None
+
+    def ttl(self):
+        return ICS_CACHE_TTL
+
+    def maxentries(self):
+        return ICS_CACHE_MAX_ENTRIES
+
+    def _path(self, key):
+        return self.folder / f'{sha1(repr(key).encode()).hexdigest()}.ics'
+
+    def _stripe(self, path):
+        return int(path.stem, 16) % ICS_CACHE_LOCK_STRIPES
+
+    def _acquire(self, path, blocking):
+        """acquire the stripe locks for path
+
+        :rtype: InterProcessLock to be released with _release(), or None if not acquired
+        """
+        local = self._local_locks[self._stripe(path)]
+        if not local.acquire(blocking=blocking):
+            return None
+        lock = InterProcessLock(str(self.folder / f'build-{self._stripe(path)}.lock'))
+        if not lock.acquire(blocking=blocking):
+            local.release()
+            return None
+        return lock
+
+    def _release(self, path, lock):
+        lock.release()
+        self._local_locks[self._stripe(path)].release()
+
+    def _read(self, path):
+        """
+        :rtype: (ics bytes, build time), or None if not cached
+        """
+        try:
+            with open(path, 'rb') as f:
+                ics_bytes = f.read()
+                built = os.fstat(f.fileno()).st_mtime
+        except OSError:
+            return None
+        # served now, for LRU eviction
+        try:
+            os.utime(path, (time.time(), built))
+        except OSError:
+            pass
+        return ics_bytes, built
+
+    def _write(self, path, ics_bytes):
+        built = time.time()
+        with NamedTemporaryFile('wb', dir=self.folder, suffix='.tmp', delete=False) as f:
+            f.write(ics_bytes)
+        os.utime(f.name, (built, built))
+        os.replace(f.name, path)
+
+        # least recently served are dropped first, never the one just written. another worker
+        # may be pruning at the same time, so files may disappear underneath us
+        try:
+            cachefiles = [p for p in self.folder.glob('*.ics') if p != path]
+            cachefiles.sort(key=lambda p: p.stat().st_atime, reverse=True)
+            for p in cachefiles[self.maxentries()-1:]:
+                p.unlink()
+        except OSError:
+            pass
+        return ics_bytes, built
+
+    def _refresh(self, path, build):
+        lock = self._acquire(path, blocking=False)
+        # another worker is already rebuilding this feed
+        if not lock:
+            return
+        try:
+            # rebuilt while we were getting the lock
+            cached = self._read(path)
+            if cached and time.time() - cached[1] < self.ttl():
+                return
+            self._write(path, build())
+        except Exception:
+            current_app.logger.exception(f'{self._refresh.__qualname__}(): rebuild of {path.name} failed')
+        finally:
+            self._release(path, lock)
+
+    def get(self, key, build, stale=True):
+        """get the cached entry for key, building it if necessary
+
+        :param key: hashable entry identifier
+        :param build: function returning the entry's bytes, called with the app
+            context but outside of the request when refreshing in the background
+        :param stale: if True, an expired entry is returned while it is refreshed in the
+            background, else it is rebuilt first
+        :rtype: (bytes, build time)
+        """
+        self.folder.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+
+        cached = self._read(path)
+        if cached and time.time() - cached[1] < self.ttl():
+            return cached
+        if cached and stale:
+            app = current_app._get_current_object()
+            def refresh():
+                with app.app_context():
+                    self._refresh(path, build)
+            self.refreshthread = threading.Thread(target=refresh, daemon=True)
+            self.refreshthread.start()
+            return cached
+
+        # wait for any other worker building it
+        lock = self._acquire(path, blocking=True)
+        try:
+            cached = self._read(path)
+            if cached and time.time() - cached[1] < self.ttl():
+                return cached
+            return self._write(path, build())
+        finally:
+            self._release(path, lock)
+
+
+class EventIndexCache(IcsCache):
+    """EventIndex per (interest, from_date, to_date), shared by every gunicorn worker
+
+    Never served stale, so a feed isn't rebuilt from old events and then cached as new.
+    """
+    dirname = EVENTS_CACHE_DIRNAME
+    # separate from IcsCache's, which are held while a feed is built from the events
+    _local_locks = [threading.Lock() for i in range(ICS_CACHE_LOCK_STRIPES)]
+
+    def ttl(self):
+        return EVENTS_CACHE_TTL
+
+    def maxentries(self):
+        return EVENTS_CACHE_MAX_ENTRIES
+
+    def get_index(self, key, fetch):
+        """get the cached EventIndex for key
+
+        :param key: hashable window identifier
+        :param fetch: function returning the window's EventIndex
+        :rtype: EventIndex
+        """
+        index_bytes, built = self.get(key, lambda: json.dumps(fetch().asdict()).encode(), stale=False)
+        return EventIndex.fromdict(json.loads(index_bytes))
+
+
+class EventLocationsFile:
+    """EventLocations for an interest, kept on the locks volume so every gunicorn worker and
+    every feed shares the locations already resolved
+
+    Args:
+        interest (str): interest short name
+    """
+    # InterProcessLock doesn't exclude other threads in the same process
+    _local_lock = threading.Lock()
+
+    def __init__(self, interest):
+        self.path = community._LOCKS_DIR / f'event_locations_{interest}.json'
+        self.lockfile = str(community._LOCKS_DIR / f'event_locations_{interest}.lock')
+
+    def _read(self):
+        try:
+            return EventLocations.fromdict(json.loads(self.path.read_text()))
+        except (OSError, ValueError, KeyError):
+            return EventLocations()
+
+    def load(self):
+        """
+        :rtype: EventLocations
+        """
+        return self._read()
+
+    def save(self, event_locations):
+        """save event_locations, merged with any saved by other workers since they were loaded
+
+        :param event_locations: EventLocations
+        """
+        with self._local_lock, InterProcessLock(self.lockfile):
+            saved = self._read()
+            saved.merge(event_locations)
+            saved.prune()
+            with NamedTemporaryFile('w', dir=self.path.parent, suffix='.tmp', delete=False) as f:
+                json.dump(saved.asdict(), f)
+            os.replace(f.name, self.path)
 
 
 def _parse_tags_param() -> list[str] | None:
@@ -70,38 +285,56 @@ def calendar_feed():
     from_date, to_date = _parse_date_params()
 
     cache_key = (interest, tuple(sorted(tags)) if tags else None, from_date, to_date)
-    cached = _ics_cache.get(cache_key)
-    if cached and (time.time() - cached[0]) < ICS_CACHE_TTL:
-        return _ics_response(cached[1])
 
     base_url = current_app.config[f'DISCOURSE_API_URL_{uinterest}']
     username = current_app.config.get(f'DISCOURSE_API_CALENDAR_USERNAME_{uinterest}')
     location_query_id = current_app.config.get(f'DISCOURSE_API_EVENT_LOCATIONS_QUERY_{uinterest}')
-    discourse = make_discourse_client(interest, username=username)
-    # the Data Explorer "run query" endpoint is admin-only, so it can't go through
-    # the calendar's deliberately low-privilege `discourse` client above -- build
-    # a separate admin-privileged one (default INVITE_USERNAME, same API key)
-    # only when there's actually a query configured to run through it.
-    admin_discourse = make_discourse_client(interest) if location_query_id else None
-
-    ics_bytes = filter_tags_to_bytes(
-        base_url=base_url,
-        discourse=discourse,
-        tags=tags,
-        from_date=from_date,
-        to_date=to_date,
-        location_query_id=location_query_id,
-        admin_discourse=admin_discourse,
-        log=current_app.logger,
-    )
-    _ics_cache[cache_key] = (time.time(), ics_bytes)
-    return _ics_response(ics_bytes)
-
-
-def _ics_response(ics_bytes: bytes):
-    return send_file(
-        BytesIO(ics_bytes),
-        mimetype='text/calendar',
-        as_attachment=True,
-        download_name='events.ics',
-    )
+
+    def build():
+        # web request, so use the interactive rate limit priority rather than queueing behind cron commands
+        discourse = make_discourse_client(interest, username=username, priority=DISCOURSE_PRIORITY_INTERACTIVE)
+        # the Data Explorer "run query" endpoint is admin-only, so it can't go through
+        # the calendar's deliberately low-privilege `discourse` client above -- build
+        # a separate admin-privileged one (default INVITE_USERNAME, same API key)
+        # only when there's actually a query configured to run through it.
+        admin_discourse = make_discourse_client(interest, priority=DISCOURSE_PRIORITY_INTERACTIVE) if location_query_id else None
+
+        # one fetch of the window's events is shared by the feeds for all the tags
+        event_index = EventIndexCache().get_index(
+            (interest, from_date, to_date),
+            lambda: fetch_event_index(discourse, from_date, to_date, log=current_app.logger),
+        )
+
+        # only posts which are new or changed since the last build are looked up
+        locationsfile = EventLocationsFile(interest)
+        event_locations = locationsfile.load()
+
+        ics_bytes = filter_tags_to_bytes(
+            base_url=base_url,
+            discourse=discourse,
+            tags=tags,
+            from_date=from_date,
+            to_date=to_date,
+            location_query_id=location_query_id,
+            admin_discourse=admin_discourse,
+            log=current_app.logger,
+            event_index=event_index,
+            event_locations=event_locations,
+        )
+        locationsfile.save(event_locations)
+        return ics_bytes
+
+    ics_bytes, built = IcsCache().get(cache_key, build)
+    return _ics_response(ics_bytes, built)
+
+
+def _ics_response(ics_bytes: bytes, built: float):
+    """calendar response, with validators so unchanged feeds are answered with 304 Not Modified"""
+    response = current_app.response_class(ics_bytes, mimetype='text/calendar')
+    response.headers.set('Content-Disposition', 'attachment', filename='events.ics')
+    response.set_etag(sha1(ics_bytes).hexdigest())
+    response.last_modified = datetime.fromtimestamp(int(built), tz=timezone.utc)
+    # until the cached feed is due to be rebuilt
+    response.cache_control.public = True
+    response.cache_control.max_age = max(0, int(built + ICS_CACHE_TTL - time.time()))
+    return response.make_conditional(request)
@@ -4,9 +4,11 @@ membership_frontend - views handling membership data
 '''
 
 # standard
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from collections import namedtuple
 from traceback import format_exc
 import time
+from os import stat, makedirs, replace, remove, listdir, getpid
 from os.path import join, getmtime
 from platform import system
 
@@ -25,6 +27,7 @@ class parameterError(): pass
 from ..admin.viewhelpers import localinterest
 from ...model import db, LocalInterest
 from ...model import Member, TableUpdateTime, MemberDates
+from ..membership_common import RenderedRowsServerSideMixin, SERVERSIDE_CSV_BUTTON
 from . import bp
 
 ymd = asctime('%Y-%m-%d')
@@ -36,36 +39,37 @@ if system() != 'Windows':
 else:
     cachet = asctime('%#m/%#d/%Y %#I:%M %p')
 
-def _getgivenname(member):
-    # use local time
-    today = time.time()-time.timezone
-    todaydt = epoch2dt(today)
+def _localtoday():
+    '''
+    today's date, local time
 
-    memberage = age(todaydt, member.dob)
-    
+    :rtype: datetime
+    '''
+    return epoch2dt(time.time()-time.timezone)
+
+def _givenname(given_name, memberage):
+    '''
+    gets given name for display
+
+    :param given_name: member's given name
+    :param memberage: member's age today
+    :rtype: given name text
+    '''
     # for members 13 and under, display only initial for given_name
     if memberage <= 13:
-        givenname = f'{member.given_name[0]}.'
+        givenname = f'{given_name[0]}.'
     else:
-        givenname = member.given_name
+        givenname = given_name
     
     return givenname
 
-def _getdivision(member):
+def _division(memberage):
     '''
-    gets division as of Jan 1 
+    gets division for age
 
-    :param member: Member record
+    :param memberage: member's age as of Jan 1
     :rtype: division text
     '''
-
-    # use local time
-    today = time.time()-time.timezone
-    todaydt = epoch2dt(today)
-    jan1 = datetime(todaydt.year, 1, 1)
-
-    memberage = age(jan1, member.dob)
-
     # this must match grand prix configuration in membership database
     # TODO: add api to query this information from scoretility
     if memberage <= 13:
@@ -93,15 +97,72 @@ members_dbattrs = 'id,given_name,family_name,gender,hometown,memberdates.end_dat
 members_formfields = 'rowId,given_name,family_name,gender,hometown,end_date'.split(',')
 members_dbmapping = dict(zip(members_dbattrs, members_formfields))
 members_formmapping = dict(zip(members_formfields, members_dbattrs))
-members_formmapping['given_name'] = _getgivenname
-members_formmapping['div'] = _getdivision
+# rows are FrontendMemberRow, see FrontendMembersView.retrieverows()
+members_formmapping['given_name'] = lambda m: m.givenname
+members_formmapping['div'] = lambda m: m.div
 # see https://datatables.net/manual/data/orthogonal-data#API-interface (must include render option for the field)
 members_formmapping['family_name'] = lambda m: {'display': m.family_name, 'sort': m.family_name.lower() }
-# need to find correct end_date in list of end_dates, even tho we did a join #587
-ondate_f = lambda: ymd.asc2dt(request.args.get('ondate', ymd.dt2asc(datetime.now()))).date()
-members_formmapping['end_date'] = lambda m: mdy.dt2asc([md.end_date for md in m.memberdates if md.start_date <= ondate_f() and md.end_date >= ondate_f()][0])
+# end_date is from the memberdates record which contains ondate, selected in the query #587
+members_formmapping['end_date'] = lambda m: mdy.dt2asc(m.end_date)
+
+# display row for the public members list
+FrontendMemberRow = namedtuple('FrontendMemberRow', 'id givenname family_name gender hometown end_date div')
+
+# rendered rows for the public members list are cached on disk, shared by all the workers, per (interest, ondate)
+# in APP_FILE_FOLDER/<interest>/MEMBERS_CACHE_DIRNAME. Each file records the member TableUpdateTime.lastchecked
+# and the date it was rendered (ages are relative to today), and is ignored if either has changed
+MEMBERS_CACHE_DIRNAME = 'memberscache'
+# bound on the number of ondate files kept per interest
+MEMBERS_CACHE_MAX_FILES = 64
+
+def _memberscache_folder(interest):
+    return join(current_app.config['APP_FILE_FOLDER'], interest, MEMBERS_CACHE_DIRNAME)
+
+def _memberscache_read(cachefile, stamp):
+    '''
+    read cached rows
+
+    :param cachefile: cache file path
+    :param stamp: {'lastchecked': isoformat, 'today': isoformat} which must match the file
+    :rtype: list of response rows, or None if not cached or stale
+    '''
+    try:
+        with open(cachefile, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('stamp') != stamp:
+        return None
+    return cached['data']
+
+def _memberscache_write(cachefile, stamp, data):
+    '''
+    write cached rows atomically, removing stale and excess files from the cache folder
+
+    :param cachefile: cache file path
+    :param stamp: {'lastchecked': isoformat, 'today': isoformat}
+    :param data: list of response rows
+    '''
+    folder = _memberscache_folder(g.interest)
+    makedirs(folder, exist_ok=True)
 
-class FrontendMembersView(DbCrudApiInterestsRolePermissions):
+    # the other workers never see a partially written file
+    tmpfile = f'{cachefile}.{getpid()}.tmp'
+    with open(tmpfile, 'w') as f:
+        json.dump({'stamp': stamp, 'data': data}, f)
+    replace(tmpfile, cachefile)
+
+    # oldest files are dropped first, never the one just written. another worker may be pruning
+    # at the same time, so files may disappear underneath us
+    try:
+        cachefiles = [join(folder, fn) for fn in listdir(folder) if fn.endswith('.json')]
+        cachefiles = sorted((fn for fn in cachefiles if fn != cachefile), key=getmtime, reverse=True)
+        for fn in cachefiles[MEMBERS_CACHE_MAX_FILES-1:]:
+            remove(fn)
+    except OSError:
+        pass
+
+class FrontendMembersView(RenderedRowsServerSideMixin, DbCrudApiInterestsRolePermissions):
     # remove auth_required() decorator
     decorators = []
 
@@ -112,16 +173,53 @@ class FrontendMembersView(DbCrudApiInterestsRolePermissions):
         self.queryfilters = []
         super().beforequery()
         ondate = request.args.get('ondate', ymd.dt2asc(datetime.now()))
-        ondatedt = ymd.asc2dt(ondate)
-        self.queryfilters += [MemberDates.start_date <= ondatedt, MemberDates.end_date >= ondatedt]
+        self.ondate = ymd.asc2dt(ondate).date()
+        self.queryfilters += [MemberDates.start_date <= self.ondate, MemberDates.end_date >= self.ondate]
+
+    def renderedrows(self):
+        '''
+        use the cached rows for this ondate if the member table hasn't been updated since they were
+        rendered, else render the rows and cache them
+
+        :rtype: list of rendered rows
+        '''
+        tableupdatetime = TableUpdateTime.query.filter_by(interest_id=self.queryparams['interest_id'],
+                                                          tablename='member').one_or_none()
+        if not tableupdatetime or not tableupdatetime.lastchecked:
+            return [self.dte.get_response_data(row) for row in self.retrieverows()]
+
+        stamp = {'lastchecked': tableupdatetime.lastchecked.isoformat(), 'today': _localtoday().date().isoformat()}
+        cachefile = join(_memberscache_folder(g.interest), f'members-{self.ondate.isoformat()}.json')
+        rows = _memberscache_read(cachefile, stamp)
+        if rows is None:
+            rows = [self.dte.get_response_data(row) for row in self.retrieverows()]
+            _memberscache_write(cachefile, stamp, rows)
+        return rows
 
-    def open(self):
-        query = (self.model.query
-                 .outerjoin(MemberDates, MemberDates.member_id==Member.id)
-                 .filter_by(**self.queryparams)
+    def retrieverows(self):
+        '''
+        retrieve the members and the end_date of the memberdates record containing ondate in a single
+        query, then build the display rows in one pass
+
+        :rtype: list of FrontendMemberRow
+        '''
+        query = (db.session.query(Member.id, Member.given_name, Member.family_name, Member.gender,
+                                  Member.hometown, Member.dob, MemberDates.end_date)
+                 .select_from(Member)
+                 .join(MemberDates, MemberDates.member_id==Member.id)
+                 .filter(*[getattr(Member, k)==v for k, v in self.queryparams.items()])
                  .filter(*self.queryfilters)
                 )
-        self.rows = iter(query.all())
+
+        # use local time, age as of today for given name and as of Jan 1 for division
+        todaydt = _localtoday()
+        jan1 = datetime(todaydt.year, 1, 1)
+
+        rows = []
+        for id, given_name, family_name, gender, hometown, dob, end_date in query:
+            rows.append(FrontendMemberRow(id, _givenname(given_name, age(todaydt, dob)), family_name, gender,
+                                          hometown, end_date, _division(age(jan1, dob))))
+        return rows
         
     def permission(self):
         '''
@@ -165,12 +263,12 @@ frontendmembers_view = FrontendMembersView(
     dbmapping = members_dbmapping,
     formmapping = members_formmapping,
     rule='<interest>/members',
-    buttons=['csv'],
+    buttons=[SERVERSIDE_CSV_BUTTON],
     dtoptions={
         'order': [[1,'asc']],
         'dom': '<"clear">lBfrtip',
     },
-    serverside = False,
+    serverside = True,
     idSrc='rowId',
     templateargs={
         'frontend_page': True, 
@@ -199,24 +297,116 @@ frontendmembers_view = FrontendMembersView(
 )
 frontendmembers_view.register()
 
+# stats file contents cached per worker process, keyed by file path
+#   {memberstatsfile: {'mtime': st_mtime_ns, 'size': st_size, 'stats': parsed, 'bodies': {(years, format): body}}}
+# the file is rewritten nightly by `flask membership update`, so the cached entry is replaced
+# whenever the file's mtime or size changes
+_memberstats_cache = {}
+
+# bound on the number of serialized (years, format) variants kept per stats file
+MEMBERSTATS_MAX_VARIANTS = 32
+
+MEMBERSTATS_FORMATS = ['full', 'compact']
+
+def _parse_years_param():
+    '''
+    parse ?years=yyyy,yyyy into a sorted tuple of years, or None if omitted (meaning: all years)
+
+    :rtype: tuple of int or None
+    '''
+    years_str = request.args.get('years')
+    if not years_str:
+        return None
+    try:
+        return tuple(sorted({int(y) for y in years_str.split(',') if y.strip()}))
+    except ValueError:
+        raise ValueError(f'invalid years={years_str}')
+
+def compactstats(memberstats):
+    '''
+    columnar encoding of the statistics
+
+    :param memberstats: [{'year': yyyy, 'counts': [{'date': 'mm-dd', 'count': n}, ...]}, ...]
+    :rtype: [{'year': yyyy, 'dates': ['mm-dd', ...], 'counts': [n, ...]}, ...]
+    '''
+    return [{'year': yearstats['year'],
+             'dates': [c['date'] for c in yearstats['counts']],
+             'counts': [c['count'] for c in yearstats['counts']]}
+            for yearstats in memberstats]
+
+def _memberstats_entry(memberstatsfile, statinfo):
+    '''
+    return cache entry for memberstatsfile, (re)loading it if the file changed since it was cached
+    '''
+    entry = _memberstats_cache.get(memberstatsfile)
+    if entry and entry['mtime'] == statinfo.st_mtime_ns and entry['size'] == statinfo.st_size:
+        return entry
+
+    with open(memberstatsfile, 'r') as stats:
+        memberstats = json.loads(stats.read())
+    entry = {
+        'mtime': statinfo.st_mtime_ns,
+        'size': statinfo.st_size,
+        'stats': memberstats,
+        'bodies': {},
+    }
+    _memberstats_cache[memberstatsfile] = entry
+    return entry
+
 class MemberStatsApi(MethodView):
+    '''
+    membership statistics, optionally filtered by year and/or in compact columnar format
+
+    query parameters:
+
+    * years=yyyy[,yyyy...] - return only the indicated years
+    * format=full|compact - full (default) gives [{year, counts: [{date, count}, ...]}, ...],
+      compact gives [{year, dates: [...], counts: [...]}, ...]
+
+    responses carry ETag/Last-Modified headers derived from the stats file, so the browser's
+    conditional requests are answered with 304 Not Modified until the file is rewritten
+    '''
     
     def get(self):
         try:
             # get the club and cache
             memberstatsfile = join(current_app.config['APP_FILE_FOLDER'], g.interest, current_app.config['APP_STATS_FILENAME'])
 
+            years = _parse_years_param()
+            format = request.args.get('format', 'full')
+            if format not in MEMBERSTATS_FORMATS:
+                raise ValueError(f'invalid format={format}')
+
             # get the summarized statistics, and time file was created
-            with open(memberstatsfile, 'r') as stats:
-                memberstats_str = stats.read()
-            mtime = getmtime(memberstatsfile) + time.localtime().tm_gmtoff
-            cachetime = cachet.epoch2asc(mtime)
+            statinfo = stat(memberstatsfile)
+            entry = _memberstats_entry(memberstatsfile, statinfo)
+
+            # serialize this variant only once per stats file
+            variant = (years, format)
+            body = entry['bodies'].get(variant)
+            if body is None:
+                mtime = statinfo.st_mtime + time.localtime().tm_gmtoff
+                cachetime = cachet.epoch2asc(mtime)
+
+                memberstats = entry['stats']
+                if years is not None:
+                    memberstats = [s for s in memberstats if int(s['year']) in years]
+                if format == 'compact':
+                    memberstats = compactstats(memberstats)
 
-            # convert json
-            memberstats = json.loads(memberstats_str)
+                body = current_app.json.dumps(dict(success=True, data=memberstats, cachetime=cachetime))
+                if len(entry['bodies']) >= MEMBERSTATS_MAX_VARIANTS:
+                    entry['bodies'].clear()
+                entry['bodies'][variant] = body
 
             # it's all good
-            return jsonify(success=True, data=memberstats, cachetime=cachetime)
+            response = current_app.response_class(body, mimetype='application/json')
+            yearstag = '.'.join(str(y) for y in years) if years is not None else 'all'
+            response.set_etag(f'{statinfo.st_mtime_ns:x}-{statinfo.st_size:x}-{yearstag}-{format}')
+            response.last_modified = datetime.fromtimestamp(int(statinfo.st_mtime), tz=timezone.utc)
+            # always revalidate, the file changes nightly
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
         
         except Exception as e:
             # er, not so good
@@ -4,50 +4,268 @@ membership_common - admin/frontend common membership view functions
 '''
 
 # standard
-from datetime import datetime, timedelta
+from datetime import datetime, date, timedelta
+from itertools import accumulate, islice
 from json import dumps
+from csv import writer
+from io import StringIO
 
 # pypi
-from loutilities.timeu import asctime
+from flask import request, current_app, stream_with_context, abort
+from sqlalchemy import event, inspect
+from loutilities.tables import DataTables, ParameterError
+# numpy is optional, counting falls back to pure python
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # homegrown
-from ..model import MemberDates
+from ..model import db, MemberDates, MemberCount
 from .admin.viewhelpers import localinterest
 from ..applogging import timenow    # for logpoints
 
-md = asctime('%m-%d')
+# skip early registrations
+STATS_FIRST_YEAR = 2013
 
-def analyzemembership(statsfile=None):
-    # stats will be unordered dict {year1: {date1:count1, date2:count2...}, year2: {...}, ... }
-    stats = {}
-    # stats = SortedDict(key=lambda k, v: k)
+def dailycounts(dateranges, lastdate):
+    '''
+    count members for each date from Jan 1 of STATS_FIRST_YEAR through lastdate
 
-    memberdates = MemberDates.query.filter_by(interest=localinterest()).all()
+    uses a difference array indexed by day: +1 on the first day of each range, -1 on the
+    day after it ends. The running sum of the array is the member count for each day, so
+    the work is proportional to the number of ranges plus the number of days
 
-    # for each member, add 1 for every date the membership represents
-    # only go through today
-    today = datetime.now().date()
-    for memberdate in memberdates:
-        thisdate = memberdate.start_date
-        enddate  = memberdate.end_date
-        while thisdate <= enddate and thisdate <= today:
-            thisyear = thisdate.year
-            # skip early registrations
-            if thisyear >= 2013:     
-                thismd   = md.dt2asc(thisdate)
-                stats.setdefault(thisyear, {})
-                stats[thisyear].setdefault(thismd, 0)
-                stats[thisyear][thismd] += 1
-            thisdate += timedelta(1)
+    :param dateranges: iterable of (start_date, end_date), inclusive
+    :param lastdate: last date to count
+    :rtype: list of counts, one per day starting Jan 1 of STATS_FIRST_YEAR
+    '''
+    firstdate = date(STATS_FIRST_YEAR, 1, 1)
+    ndays = (lastdate - firstdate).days + 1
+    if ndays <= 0:
+        return []
+
+    # day indexes of range starts, and of the day after range ends, clipped to [firstdate, lastdate]
+    starts = []
+    stops = []
+    for start_date, end_date in dateranges:
+        start = max((start_date - firstdate).days, 0)
+        stop = min((end_date - firstdate).days, ndays - 1) + 1
+        if start < stop:
+            starts.append(start)
+            stops.append(stop)
+
+    if np is not None:
+        diff = np.zeros(ndays + 1, dtype=np.int64)
+        np.add.at(diff, np.array(starts, dtype=np.int64), 1)
+        np.add.at(diff, np.array(stops, dtype=np.int64), -1)
+        return np.cumsum(diff[:ndays]).tolist()
+
+    diff = [0] * (ndays + 1)
+    for start in starts:
+        diff[start] += 1
+    for stop in stops:
+        diff[stop] -= 1
+    return list(accumulate(diff[:ndays]))
 
+def _statslist(datecounts):
+    '''
+    group (date, count) by year, for the membership stats page
+
+    :param datecounts: iterable of (date, count), sorted by date
+    :rtype: [{'year': year, 'counts': [{'date': 'mm-dd', 'count': count}, ...]}, ...],
+        only dates with members are included
+    '''
     statslist = []
-    years = sorted(list(stats.keys()))
-    for year in years:
-        yearcounts = {'year' : year, 'counts' : [] }
-        datecounts = sorted(list(stats[year].keys()))
-        for date in datecounts:
-            yearcounts['counts'].append( { 'date' : date, 'count' : stats[year][date] } )
-        statslist.append( yearcounts )
+    yearcounts = None
+    for thisdate, count in datecounts:
+        if not count:
+            continue
+        if not yearcounts or yearcounts['year'] != thisdate.year:
+            yearcounts = {'year': thisdate.year, 'counts': []}
+            statslist.append(yearcounts)
+        yearcounts['counts'].append({'date': f'{thisdate.month:02d}-{thisdate.day:02d}', 'count': count})
+    return statslist
+
+def countmembers(dateranges, today):
+    '''
+    count members for each date from Jan 1 of STATS_FIRST_YEAR through today
+
+    :param dateranges: iterable of (start_date, end_date), inclusive
+    :param today: last date to count
+    :rtype: [{'year': year, 'counts': [{'date': 'mm-dd', 'count': count}, ...]}, ...],
+        only dates with members are included
+    '''
+    firstdate = date(STATS_FIRST_YEAR, 1, 1)
+    counts = dailycounts(dateranges, today)
+    return _statslist((firstdate + timedelta(dayndx), count) for dayndx, count in enumerate(counts))
+
+def rebuildmembercounts(interest):
+    '''
+    recompute the MemberCount table for interest from all of its memberdates
+
+    :param interest: LocalInterest
+    '''
+    MemberCount.query.filter_by(interest=interest).delete()
+
+    memberdates = MemberDates.query.filter_by(interest=interest).all()
+    if not memberdates:
+        return
+    # count future dates too, so they're ready when the date arrives
+    lastdate = max(memberdate.end_date for memberdate in memberdates)
+    counts = dailycounts([(memberdate.start_date, memberdate.end_date) for memberdate in memberdates], lastdate)
+
+    firstdate = date(STATS_FIRST_YEAR, 1, 1)
+    db.session.add_all([MemberCount(interest=interest, date=firstdate + timedelta(dayndx), count=count)
+                        for dayndx, count in enumerate(counts) if count])
+    db.session.flush()
+
+def membercountstats(interest, today):
+    '''
+    membership stats from the MemberCount table for interest, through today
+
+    :param interest: LocalInterest
+    :param today: last date to include
+    :rtype: same as countmembers()
+    '''
+    rows = (db.session.query(MemberCount.date, MemberCount.count)
+            .filter(MemberCount.interest == interest,
+                    MemberCount.date >= date(STATS_FIRST_YEAR, 1, 1),
+                    MemberCount.date <= today,
+                    MemberCount.count > 0)
+            .order_by(MemberCount.date)
+            .all())
+    return _statslist(rows)
+
+class MemberCountTracker():
+    '''
+    keeps the MemberCount table for interest up to date as its memberdates are added, changed and deleted
+
+    While active, each flush records the date spans of the interest's memberdates changes
+    as a difference map ({date: +/-n}). apply() adjusts the MemberCount rows within the
+    changed spans; it is called before every commit, and when the tracker is exited
+    without an exception. Changes are discarded on rollback.
+
+    If the interest has no MemberCount rows yet, they are rebuilt when the tracker starts.
+
+    usage::
+
+        with MemberCountTracker(interest):
+            # add, change, delete MemberDates records
+    '''
+    def __init__(self, interest):
+        self.interest = interest
+        self.diff = {}
+        self.session = None
+
+    def __enter__(self):
+        self.session = db.session()
+        self.session.flush()
+        if not MemberCount.query.filter_by(interest=self.interest).first():
+            rebuildmembercounts(self.interest)
+        event.listen(self.session, 'before_flush', self._before_flush)
+        event.listen(self.session, 'before_commit', self._before_commit)
+        event.listen(self.session, 'after_soft_rollback', self._after_soft_rollback)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.apply()
+        finally:
+            event.remove(self.session, 'before_flush', self._before_flush)
+            event.remove(self.session, 'before_commit', self._before_commit)
+            event.remove(self.session, 'after_soft_rollback', self._after_soft_rollback)
+
+    def _ours(self, memberdates):
+        if memberdates.interest_id is not None:
+            return memberdates.interest_id == self.interest.id
+        return memberdates.interest is self.interest
+
+    def _addrange(self, start_date, end_date, delta):
+        if start_date is None or end_date is None:
+            return
+        start_date = max(start_date, date(STATS_FIRST_YEAR, 1, 1))
+        stop_date = end_date + timedelta(1)
+        if start_date >= stop_date:
+            return
+        self.diff[start_date] = self.diff.get(start_date, 0) + delta
+        self.diff[stop_date] = self.diff.get(stop_date, 0) - delta
+
+    @staticmethod
+    def _committed(memberdates, attr):
+        history = inspect(memberdates).attrs[attr].history
+        if history.deleted:
+            return history.deleted[0]
+        return history.unchanged[0] if history.unchanged else None
+
+    def _before_flush(self, session, flush_context, instances):
+        for obj in session.new:
+            if isinstance(obj, MemberDates) and self._ours(obj):
+                self._addrange(obj.start_date, obj.end_date, 1)
+        for obj in session.dirty:
+            if isinstance(obj, MemberDates) and self._ours(obj) and session.is_modified(obj):
+                self._addrange(self._committed(obj, 'start_date'), self._committed(obj, 'end_date'), -1)
+                self._addrange(obj.start_date, obj.end_date, 1)
+        for obj in session.deleted:
+            if isinstance(obj, MemberDates) and self._ours(obj):
+                self._addrange(self._committed(obj, 'start_date'), self._committed(obj, 'end_date'), -1)
+
+    def _before_commit(self, session):
+        self.apply()
+
+    def _after_soft_rollback(self, session, previous_transaction):
+        self.diff = {}
+
+    def apply(self):
+        '''
+        adjust MemberCount rows for the memberdates changes recorded so far
+        '''
+        # record any pending changes
+        self.session.flush()
+
+        boundaries = sorted(d for d in self.diff if self.diff[d])
+        if not boundaries:
+            self.diff = {}
+            return
+        firstdate, stopdate = boundaries[0], boundaries[-1]
+
+        with self.session.no_autoflush:
+            rows = {row.date: row for row in MemberCount.query
+                    .filter(MemberCount.interest == self.interest,
+                            MemberCount.date >= firstdate,
+                            MemberCount.date < stopdate)}
+            delta = 0
+            thisdate = firstdate
+            while thisdate < stopdate:
+                delta += self.diff.get(thisdate, 0)
+                if delta:
+                    row = rows.get(thisdate)
+                    if not row:
+                        row = MemberCount(interest=self.interest, date=thisdate, count=0)
+                        self.session.add(row)
+                    row.count += delta
+                    if row.count == 0 and thisdate in rows:
+                        self.session.delete(row)
+                thisdate += timedelta(1)
+
+        self.diff = {}
+
+def analyzemembership(statsfile=None, rebuild=False):
+    '''
+    generate the membership stats for the current interest from the MemberCount table
+
+    :param statsfile: optional json file to save the stats in
+    :param rebuild: if True, or the MemberCount table is empty for the interest, rebuild it from memberdates first
+    :rtype: same as countmembers()
+    '''
+    interest = localinterest()
+    if rebuild or not MemberCount.query.filter_by(interest=interest).first():
+        rebuildmembercounts(interest)
+
+    # only go through today
+    today = datetime.now().date()
+    statslist = membercountstats(interest, today)
 
     if statsfile:
         with open(statsfile, 'w') as statsf:
@@ -55,3 +273,220 @@ def analyzemembership(statsfile=None):
             statsf.write(statsjson)
 
     return statslist
+
+
+##########################################################################################
+# server side datatables support
+##########################################################################################
+
+class UnpagedDataTables(DataTables):
+    '''
+    DataTables which applies the request's search and order, but not the paging, and
+    doesn't execute the query. The query is left in self.query, selecting the columns
+    named in self.column_names
+    '''
+    def run(self):
+        self._set_column_filter_expressions()
+        self._set_global_filter_expression()
+        self._set_sort_expressions()
+
+        query = self.query.filter(*[e for e in self.filter_expressions if e is not None])
+        query = query.order_by(*[e for e in self.sort_expressions if e is not None])
+        self.query = query.add_columns(*[c.sqla_expr for c in self.columns])
+        self.column_names = [col.mData if col.mData else str(i) for i, col in enumerate(self.columns)]
+
+def _cellvalue(value, key='display'):
+    '''
+    value of rendered cell, handling orthogonal data, e.g., {'display': ..., 'sort': ...}
+    '''
+    if isinstance(value, dict):
+        return value.get(key, value.get('display'))
+    return value
+
+def _intarg(args, key, default):
+    '''
+    integer DataTables request parameter, aborting with 400 if it isn't an integer
+
+    :param args: DataTables request parameters, e.g., request.args
+    :param key: parameter name
+    :param default: value if parameter is missing
+    :rtype: int
+    '''
+    try:
+        return int(args.get(key, default))
+    except (TypeError, ValueError):
+        abort(400, f'invalid {key}')
+
+def searchrows(rows, args):
+    '''
+    filter and order rendered rows per DataTables server-side request parameters
+
+    :param rows: list of rendered rows (dicts keyed by column data)
+    :param args: DataTables request parameters, e.g., request.args
+    :rtype: list of rows
+    '''
+    columns = []
+    i = 0
+    while f'columns[{i}][data]' in args:
+        columns.append({
+            'data': args[f'columns[{i}][data]'],
+            'searchable': args.get(f'columns[{i}][searchable]', 'true') == 'true',
+            'search': args.get(f'columns[{i}][search][value]', '').lower(),
+        })
+        i += 1
+
+    # global search matches any searchable column, column search matches that column
+    search = args.get('search[value]', '').lower()
+    def matches(row):
+        cells = {c['data']: str(_cellvalue(row.get(c['data'])) or '').lower() for c in columns}
+        if search and not any(search in cells[c['data']] for c in columns if c['searchable']):
+            return False
+        return all(c['search'] in cells[c['data']] for c in columns if c['search'])
+    if search or any(c['search'] for c in columns):
+        rows = [row for row in rows if matches(row)]
+
+    # stable sorts, from least to most significant
+    orders = []
+    i = 0
+    while f'order[{i}][column]' in args:
+        column = _intarg(args, f'order[{i}][column]', 0)
+        if not 0 <= column < len(columns):
+            abort(400, f'invalid order[{i}][column]')
+        orders.append((columns[column]['data'], args.get(f'order[{i}][dir]', 'asc')))
+        i += 1
+    for data, direction in reversed(orders):
+        def sortkey(row):
+            value = _cellvalue(row.get(data), 'sort')
+            # None sorts first
+            return (value is not None, value if value is not None else '')
+        rows = sorted(rows, key=sortkey, reverse=(direction == 'desc'))
+
+    return rows
+
+class ServerSideCsvMixin():
+    '''
+    mixin for DbCrudApi views with serverside=True, adding <rule>/csv which streams all the
+    rows matching the table's current search and order as CSV. The 'csv' button only exports
+    the rows which have been sent to the browser, so views use SERVERSIDE_CSV_BUTTON instead
+    '''
+    csvbatchsize = 500
+
+    def register(self):
+        super().register()
+        self.app.add_url_rule(f'{self.rule}/csv', view_func=self.my_view, methods=['GET'])
+
+    def get(self):
+        if request.path.endswith('/csv'):
+            return self.streamcsv()
+        return super().get()
+
+    def csvrows(self):
+        '''
+        generator of rows for the csv file, default is the servercolumns query
+
+        columns the query doesn't select because the view's formmapping computes them from the
+        model row are filled in here, and each row is then finished as the view's dte finishes
+        its response rows
+
+        :rtype: dicts keyed by column data
+        '''
+        rowtable = UnpagedDataTables(request.args.to_dict(), self.serverquery(), self.servercolumns)
+        if rowtable.error:
+            raise ParameterError(rowtable.error)
+
+        computed = {c['data']: self.dte.formmapping[c['data']] for c in self.clientcolumns
+                    if c.get('data') and c['data'] not in rowtable.column_names
+                    and callable(self.dte.formmapping.get(c['data']))}
+        query = rowtable.query
+        if computed:
+            query = query.add_columns(self.model.id)
+
+        rows = iter(query.yield_per(self.csvbatchsize))
+        while True:
+            batch = list(islice(rows, self.csvbatchsize))
+            if not batch:
+                break
+            if computed:
+                dbrows = {dbrow.id: dbrow for dbrow in self.model.query.filter(self.model.id.in_([row[-1] for row in batch]))}
+            for row in batch:
+                data = dict(zip(rowtable.column_names, row))
+                for key, formfn in computed.items():
+                    data[key] = formfn(dbrows[row[-1]])
+                if self.dte.null2emptystring:
+                    data = {k: '' if v is None else v for k, v in data.items()}
+                self.dte.response_hook(data)
+                yield data
+
+    def streamcsv(self):
+        redirect = self.init()
+        if redirect:
+            return redirect
+
+        # verify user can read the data, otherwise abort
+        if not self.permission():
+            self.rollback()
+            self.abort()
+
+        # set up parameters to query (set self.queryparams, self.queryfilters)
+        self.beforequery()
+
+        columns = [c for c in self.clientcolumns if c.get('data') and c.get('visible', True)]
+        rows = self.csvrows()
+
+        def generate():
+            buffer = StringIO()
+            csv = writer(buffer)
+            csv.writerow([c['label'] for c in columns])
+            for ndx, row in enumerate(rows, 1):
+                csv.writerow([_cellvalue(row.get(c['data'])) for c in columns])
+                if ndx % self.csvbatchsize == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+
+        filename = f'{self.endpoint.split(".")[-1]}.csv'
+        return current_app.response_class(
+            stream_with_context(generate()),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={filename}'},
+        )
+
+class RenderedRowsServerSideMixin(ServerSideCsvMixin):
+    '''
+    mixin for DbCrudApi views with serverside=True whose rows are rendered in python rather than
+    selected through servercolumns. The subclass must supply renderedrows(), returning the list of
+    rendered rows (dicts keyed by column data), which are searched, ordered and paged here per the
+    DataTables request
+
+    every request works through all the rendered rows, so this is only for small tables whose rows
+    are cheap to get again, e.g., the public members list, which has a few thousand rows cached on
+    disk. Larger tables should use DbCrudApi's servercolumns, which search and page in the query
+    '''
+    def __init__(self, **kwargs):
+        if not callable(getattr(self, 'renderedrows', None)):
+            raise ParameterError(f'{type(self).__name__} must supply renderedrows()')
+        super().__init__(**kwargs)
+
+    def open(self):
+        rows = self.renderedrows()
+        found = searchrows(rows, request.args)
+
+        # start before the first row starts at the first row, negative length is all the rows
+        start = max(0, _intarg(request.args, 'start', 0))
+        length = _intarg(request.args, 'length', -1)
+        self.output_result = {
+            'draw': str(_intarg(request.args, 'draw', 1)),
+            'recordsTotal': str(len(rows)),
+            'recordsFiltered': str(len(found)),
+            'data': found[start:start+length] if length >= 0 else found[start:],
+        }
+
+    def csvrows(self):
+        return iter(searchrows(self.renderedrows(), request.args))
+
+# replaces the 'csv' button for ServerSideCsvMixin views
+SERVERSIDE_CSV_BUTTON = {
+    'text': 'CSV',
+    'action': {'eval': 'serverside_csv'},
+}
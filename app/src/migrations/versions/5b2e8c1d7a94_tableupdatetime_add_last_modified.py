@@ -0,0 +1,40 @@
+"""tableupdatetime add last_modified
+
+Revision ID: 5b2e8c1d7a94
+Revises: 73938f9003e0
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e8c1d7a94'
+down_revision = '73938f9003e0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(engine_name):
+    globals()["upgrade_%s" % engine_name]()
+
+
+def downgrade(engine_name):
+    globals()["downgrade_%s" % engine_name]()
+
+
+def upgrade_():
+    op.add_column('tableupdatetime', sa.Column('last_modified', sa.DateTime(), nullable=True))
+
+
+def downgrade_():
+    op.drop_column('tableupdatetime', 'last_modified')
+
+
+def upgrade_users():
+    pass
+
+
+def downgrade_users():
+    pass
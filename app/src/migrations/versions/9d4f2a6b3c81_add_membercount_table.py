@@ -0,0 +1,48 @@
+"""add membercount table
+
+Revision ID: 9d4f2a6b3c81
+Revises: 5b2e8c1d7a94
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4f2a6b3c81'
+down_revision = '5b2e8c1d7a94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(engine_name):
+    globals()["upgrade_%s" % engine_name]()
+
+
+def downgrade(engine_name):
+    globals()["downgrade_%s" % engine_name]()
+
+
+def upgrade_():
+    op.create_table('membercount',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('interest_id', sa.Integer(), nullable=True),
+    sa.Column('date', sa.Date(), nullable=True),
+    sa.Column('count', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['interest_id'], ['localinterest.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('interest_id', 'date', name='uq_membercount_interest_date')
+    )
+
+
+def downgrade_():
+    op.drop_table('membercount')
+
+
+def upgrade_users():
+    pass
+
+
+def downgrade_users():
+    pass
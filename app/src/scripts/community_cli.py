@@ -3,19 +3,46 @@ community_cli - cli tasks needed for community management (discourse integration
 """
 
 # standard
+from json import dumps
 
 # pypi
 from flask import g, current_app
 from flask.cli import with_appcontext
 from click import argument, group, option
+from fasteners import InterProcessLock
 
 # homegrown
 from scripts import catch_errors, ParameterError
 from members.community import RsuRaceCommunitySyncManager, RsuClubCommunitySyncManager, DbTagCommunitySyncManager, make_discourse_client
+from members.community import DiscourseSnapshot, DiscourseUserDirectory, COMMUNITY_LOCKFILE, DISCOURSE_PRIORITY_BULK
 from members.community_taxonomy import fetch_all, build_docx
 from members.community_events import import_events as _import_events
 from members.community_review import check_pending_reviews
 
+# syncmany spec sources
+SYNC_SOURCES = {
+    'race': RsuRaceCommunitySyncManager,
+    'club': RsuClubCommunitySyncManager,
+    'tag': DbTagCommunitySyncManager,
+}
+
+def _import_group(grpmgr, debug, debugrequests, planonly):
+    """run the group import, printing the plan if only the plan was requested"""
+    plan = grpmgr.import_group(debug=debug, debugrequests=debugrequests, planonly=planonly)
+    if planonly:
+        print(dumps({'group': grpmgr.communitygroupname, **plan.asdict()}, indent=2, default=str))
+
+def _parse_syncspec(spec):
+    """parse syncmany spec source:id=communitygroupname
+
+    :rtype: (source, id, communitygroupname)
+    """
+    source, sep, rest = spec.partition(':')
+    sourceid, sep2, communitygroupname = rest.partition('=')
+    if not (sep and sep2 and sourceid and communitygroupname) or source not in SYNC_SOURCES:
+        raise ParameterError(f'invalid spec {spec}, must be source:id=communitygroupname where source is one of {list(SYNC_SOURCES)}')
+    return source, sourceid, communitygroupname
+
 # needs to be before any commands
 @group()
 def community():
@@ -29,15 +56,16 @@ def community():
 @option('--skipemail', is_flag=True, help='if set, skip sending email to new community user')
 @option('--debug', is_flag=True, help='enable debug logging')
 @option('--debugrequests', is_flag=True, help='enable requests debug logging')
+@option('--plan-only', 'planonly', is_flag=True, help='print the changes which would be made, and timing, without making them')
 @with_appcontext
 @catch_errors
-def syncrace(interest, raceid, communitygroupname, skipemail, debug, debugrequests):
+def syncrace(interest, raceid, communitygroupname, skipemail, debug, debugrequests, planonly):
     """
     Sync community group [communitygroupname] membership from RunSignup race
     [raceid] participants within interest [interest]
     """
     grpmgr = RsuRaceCommunitySyncManager(interest, raceid, communitygroupname, skipemail)
-    grpmgr.import_group(debug=debug, debugrequests=debugrequests)
+    _import_group(grpmgr, debug, debugrequests, planonly)
 
 
 @community.command()
@@ -47,15 +75,16 @@ def syncrace(interest, raceid, communitygroupname, skipemail, debug, debugreques
 @option('--skipemail', is_flag=True, help='if set, skip sending email to new community user')
 @option('--debug', is_flag=True, help='enable debug logging')
 @option('--debugrequests', is_flag=True, help='enable requests debug logging')
+@option('--plan-only', 'planonly', is_flag=True, help='print the changes which would be made, and timing, without making them')
 @with_appcontext
 @catch_errors
-def syncclub(interest, clubid, communitygroupname, skipemail, debug, debugrequests):
+def syncclub(interest, clubid, communitygroupname, skipemail, debug, debugrequests, planonly):
     """
     Sync community group [communitygroupname] membership from RunSignup
     membership organization [clubid] members within interest [interest]
     """
     grpmgr = RsuClubCommunitySyncManager(interest, clubid, communitygroupname, skipemail)
-    grpmgr.import_group(debug=debug, debugrequests=debugrequests)
+    _import_group(grpmgr, debug, debugrequests, planonly)
 
 
 @community.command()
@@ -65,15 +94,55 @@ def syncclub(interest, clubid, communitygroupname, skipemail, debug, debugreques
 @option('--skipemail', is_flag=True, help='if set, skip sending email to new community user')
 @option('--debug', is_flag=True, help='enable debug logging')
 @option('--debugrequests', is_flag=True, help='enable requests debug logging')
+@option('--plan-only', 'planonly', is_flag=True, help='print the changes which would be made, and timing, without making them')
 @with_appcontext
 @catch_errors
-def synctag(interest, tagname, communitygroupname, skipemail, debug, debugrequests):
+def synctag(interest, tagname, communitygroupname, skipemail, debug, debugrequests, planonly):
     """
     Sync community group [communitygroupname]  within interest [interest] with users tagged with position
     tag [tagname]
     """
     grpmgr = DbTagCommunitySyncManager(interest, tagname, communitygroupname, skipemail)
-    grpmgr.import_group(debug=debug, debugrequests=debugrequests)
+    _import_group(grpmgr, debug, debugrequests, planonly)
+
+
+@community.command()
+@argument('interest')
+@argument('specs', nargs=-1, required=True)
+@option('--skipemail', is_flag=True, help='if set, skip sending email to new community user')
+@option('--debug', is_flag=True, help='enable debug logging')
+@option('--debugrequests', is_flag=True, help='enable requests debug logging')
+@option('--plan-only', 'planonly', is_flag=True, help='print the changes which would be made, and timing, without making them')
+@with_appcontext
+@catch_errors
+def syncmany(interest, specs, skipemail, debug, debugrequests, planonly):
+    """
+    Sync several community groups within interest [interest] against one snapshot of the Discourse
+    users and invites. Each of [specs] is source:id=communitygroupname, where source is race (id is
+    RunSignup race id), club (id is RunSignup club id) or tag (id is position tag name), e.g.,
+    club:1234=members tag:board=board-members
+    """
+    syncspecs = [_parse_syncspec(spec) for spec in specs]
+
+    # hold the community lock for all the syncs, so Discourse can't change underneath the snapshot
+    with InterProcessLock(COMMUNITY_LOCKFILE):
+        snapshot = DiscourseSnapshot(make_discourse_client(interest), interest).load()
+        for source, sourceid, communitygroupname in syncspecs:
+            grpmgr = SYNC_SOURCES[source](interest, sourceid, communitygroupname, skipemail, snapshot=snapshot)
+            _import_group(grpmgr, debug, debugrequests, planonly)
+
+
+@community.command('refresh-users')
+@argument('interest')
+@with_appcontext
+@catch_errors
+def refresh_users(interest):
+    """
+    Fully refresh the cached Discourse user directory for interest [interest]
+    """
+    with InterProcessLock(COMMUNITY_LOCKFILE):
+        users = DiscourseUserDirectory(interest, make_discourse_client(interest, priority=DISCOURSE_PRIORITY_BULK)).users(fullrefresh=True)
+    print(f'{len(users)} Discourse users cached')
 
 
 @community.command('export-taxonomy')
@@ -139,7 +208,7 @@ def import_events(interest, csv_file, category_id, state_file, post_as, dry_run,
     uinterest = interest.upper()
     base_url = current_app.config[f'DISCOURSE_API_URL_{uinterest}']
     username = post_as or current_app.config.get(f'DISCOURSE_API_EVENT_USERNAME_{uinterest}')
-    discourse = make_discourse_client(interest, username=username)
+    discourse = make_discourse_client(interest, username=username, priority=DISCOURSE_PRIORITY_BULK)
 
     _import_events(
         interest=interest,
@@ -4,11 +4,15 @@ membership_cli - cli tasks needed for memberhip management
 
 # standard
 from logging import basicConfig, DEBUG, INFO, WARNING, getLogger
-from csv import DictReader
+from csv import DictReader, DictWriter
 from datetime import timedelta, datetime
-from os import mkdir
+from os import mkdir, remove, stat
 from os.path import join, exists
 from hashlib import md5
+from heapq import merge as heapmerge
+from itertools import groupby, islice
+from json import dumps, loads
+from tempfile import TemporaryDirectory
 
 # pypi
 from flask import g, current_app
@@ -18,7 +22,8 @@ from loutilities.timeu import asctime
 from loutilities.transform import Transform
 from sortedcollections import ItemSortedDict
 from sortedcontainers import SortedList
-from sqlalchemy import or_, and_, func
+from sqlalchemy import or_, and_, func, inspect
+from sqlalchemy.orm import selectinload
 from mailchimp3 import MailChimp
 from mailchimp3.mailchimpclient import MailChimpError
 
@@ -26,9 +31,10 @@ from mailchimp3.mailchimpclient import MailChimpError
 from scripts import catch_errors, ParameterError
 from members.model import db, Member, MemberDates, Membership, TableUpdateTime
 from members.views.admin.viewhelpers import localinterest
-from members.helpers import make_runsignup_client
+from members.helpers import make_runsignup_client, make_runsignup_fluent_client
+from members.community import rsu_club_snapshot
 from members.applogging import timenow
-from members.views.membership_common import analyzemembership
+from members.views.membership_common import analyzemembership, MemberCountTracker
 
 # set up database date formatter
 isodate = asctime('%Y-%m-%d')
@@ -40,6 +46,580 @@ basicConfig()
 # debug
 debug = False
 
+# set up member, membership transforms to create db records
+# transform: member record from membership "file" format
+memxform = Transform({
+    'family_name':      'FamilyName',
+    'given_name':       'GivenName',
+    'middle_name':      'MiddleName',
+    'gender':           'Gender',
+    'svc_member_id':    'MemberID',
+    'dob':              lambda m: isodate.asc2dt(m['DOB']).date(),
+    'hometown':         lambda m: f'{m["City"]}, {m["State"]}' if 'City' in m and 'State' in m else '',
+    'email':            'Email',
+}, sourceattr=False, targetattr=True)
+memdatesxform = Transform({
+    'start_date':           lambda m: isodate.asc2dt(m['JoinDate']).date(),
+    'end_date':             lambda m: isodate.asc2dt(m['ExpirationDate']).date(),        
+})
+# transform: update member record from membership record
+memupdate = Transform({
+    'svc_member_id':    'svc_member_id',
+    'hometown':         'hometown',
+    'email':            'email',
+}, sourceattr=True, targetattr=True)
+# transform: membership record from membership "file" format
+mshipxform = Transform({
+    'svc_member_id':        'MemberID',
+    'svc_membership_id':    'MembershipID',
+    'membershiptype':       'MembershipType',
+    'hometown':             lambda m: f'{m["City"]}, {m["State"]}' if 'City' in m and 'State' in m else '',
+    'email':                'Email',
+    'start_date':           lambda m: isodate.asc2dt(m['JoinDate']).date(),
+    'end_date':             lambda m: isodate.asc2dt(m['ExpirationDate']).date(),
+    'primary':              lambda m: m['PrimaryMember'].lower() == 't' or m['PrimaryMember'].lower() == 'yes',
+    'last_modified':        lambda m: rsudt.asc2dt(m['LastModified']),
+}, sourceattr=False, targetattr=True)
+
+def merge_membership(m, thesememberdates, linterest, flush=None):
+    """merge a single membership into the member, memberdates, membership tables
+
+    Args:
+        m (dict): membership in common "file" format
+        thesememberdates (SortedList): all memberdates records already in the database for
+            this member, sorted by end_date; updated in place
+        linterest (LocalInterest): interest the records belong to
+        flush (callable, optional): called where later processing needs the pending records
+            flushed to the database. Defaults to db.session.flush
+
+    Returns:
+        Member: the member record the membership was merged into
+    """
+    thislogger = getLogger('members.cli')
+    if flush is None:
+        flush = db.session.flush
+
+    # need MembershipId to be string for comparison with database key
+    m['MembershipID'] = str(m['MembershipID'])
+
+    # if member doesn't exist, create member, memberdates, and membership records
+    if len(thesememberdates) == 0:
+        thismember = Member(interest=linterest)
+        memxform.transform(m, thismember)
+        db.session.add(thismember)
+        # flush so thismember can be referenced in thismship and thismdates, and can be found in later processing
+        flush()
+
+        thismdate = MemberDates(interest=linterest, member=thismember)
+        memdatesxform.transform(m, thismdate)
+        db.session.add(thismdate)
+        thesememberdates.add(thismdate)
+
+        thismship = Membership(interest=linterest, member=thismember, memberdates=thismdate)
+        mshipxform.transform(m, thismship)
+        db.session.add(thismship)
+
+        # flush so thismdate and thismship can be found in later processing
+        flush()
+
+    # if there are already some memberships for this member, merge with this membership (m)
+    else:
+        # assumes memberdates.member is the same for all thesememberdates
+        thismember = thesememberdates[0].member
+
+        # dbmships is keyed by svc_membership_id, sorted by end_date
+        # NOTE: svc_membership_id is unique only within a member -- be careful if the use of dbmships changes 
+        # to include multiple members
+        dbmships = ItemSortedDict(lambda k, v: v.end_date)
+        for thismd in thesememberdates:
+            for mship in thismd.member.memberships:
+                dbmships[mship.svc_membership_id] = mship
+
+        # add membership if not already there for this member
+        mshipid = m['MembershipID']
+        if mshipid not in dbmships:
+            newmship = True
+            thismship = Membership(interest=linterest)
+            db.session.add(thismship)
+            # flush so thismship can be found in later processing
+            flush()
+
+        # update existing membership
+        else:
+            newmship = False
+            thismship = dbmships[mshipid]            
+
+        # merge the new membership record into the database record
+        mshipxform.transform(m, thismship)
+
+        # add new membership to data structure
+        if newmship:
+            dbmships[thismship.svc_membership_id] = thismship
+
+        # need list view for some processing
+        dbmships_keys = dbmships.keys()
+
+        # check for overlaps
+        for thisndx in range(1, len(dbmships_keys)):
+            prevmship = dbmships[dbmships_keys[thisndx-1]]
+            thismship = dbmships[dbmships_keys[thisndx]]
+            if thismship.start_date <= prevmship.end_date:
+                oldstart = thismship.start_date
+                newstart = prevmship.end_date + timedelta(1)
+                oldstartasc = isodate.dt2asc(oldstart)
+                newstartasc = isodate.dt2asc(newstart)
+                endasc = isodate.dt2asc(thismship.end_date)
+                memberkey = f'{m["FamilyName"]},{m["GivenName"]},{m["DOB"]}'
+                # TODO: check for #562 improve membertility member cache processing
+                thislogger.warning(f'overlap detected for {memberkey}: end={endasc} was start={oldstartasc} now start={newstartasc}')
+                thismship.start_date = newstart
+
+        # calculate contigous range for membership records
+        mship_date_range = {}
+        contiguous_mshipids = []
+        class DateRangeItem(object): 
+            def __init__(self, **kwargs):
+                for arg in kwargs:
+                    setattr(self, arg, kwargs[arg])
+        # dbmships is keyed by svc_membership_id, sorted by end_date
+        for mshipid in dbmships_keys:
+            mship = dbmships[mshipid]
+            # contiguous_mshipids is empty (startup condition), let's get it started
+            if not contiguous_mshipids:
+                current_range = DateRangeItem(start_date=mship.start_date, end_date=mship.end_date)
+                contiguous_mshipids = [mshipid]
+            else:
+                last_mshipid = contiguous_mshipids[-1]
+                last_mship = dbmships[last_mshipid]
+                # if membership is contiguous
+                # TODO: check for #562 improve membertility member cache processing
+                if mship.start_date == last_mship.end_date + timedelta(1):
+                    current_range.end_date = mship.end_date
+                    contiguous_mshipids.append(mshipid)
+                # membership not contiguous
+                else:
+                    for contiguous_mshipid in contiguous_mshipids:
+                        mship_date_range[contiguous_mshipid] = current_range
+                    current_range = DateRangeItem(start_date=mship.start_date, end_date=mship.end_date)
+                    contiguous_mshipids = [mshipid]
+        for contiguous_mshipid in contiguous_mshipids:
+            mship_date_range[contiguous_mshipid] = current_range
+
+        # update appropriate memberdates record(s), favoring earlier records
+        # NOTE: membership hometown, email get copied into appropriate member records; 
+        #   since mship list is sorted, last one remains
+        for mshipid in dbmships_keys:
+            mship = dbmships[mshipid]
+            date_range = mship_date_range[mshipid]
+            for nextmndx in range(len(thesememberdates)):
+                thismemberdates = thesememberdates[nextmndx]
+                lastmemberdates = thesememberdates[nextmndx-1] if nextmndx != 0 else None
+
+                # corner case: someone changed their birthdate and/or gender
+                # TODO: use Transform for these
+                thismemberdates.member.dob = isodate.asc2dt(m['DOB']).date()
+                thismemberdates.member.gender = m['Gender']
+
+                # prefer last name found
+                thismemberdates.member.given_name = m['GivenName']
+                thismemberdates.member.family_name = m['FamilyName']
+                thismemberdates.member.middle_name = m['MiddleName'] if m['MiddleName'] else ''
+
+                # mship causes new memberdates record before this one 
+                #   or after end of thesememberdates
+                #   or wholy between thesememberdates
+                if (mship.end_date + timedelta(1) < thismemberdates.start_date or
+                        (nextmndx == len(thesememberdates)-1) and mship.start_date > thismemberdates.end_date + timedelta(1) or
+                        lastmemberdates and mship.start_date > lastmemberdates.end_date + timedelta(1) and mship.end_date < thismemberdates.start_date):
+                    newmemberdates = MemberDates(interest=linterest, member=thismember)
+                    db.session.add(newmemberdates)
+                    # flush so thismemberdates can be referenced in mship, and can be found in later processing
+                    flush()
+                    memdatesxform.transform(m, newmemberdates)
+                    mship.member = thismember
+                    mship.memberdates = newmemberdates
+                    break
+
+                # mship extends this memberdates record from the beginning
+                if mship.end_date + timedelta(1) == thismemberdates.start_date:
+                    thismemberdates.start_date = mship.start_date
+                    mship.member = thismemberdates.member
+                    mship.memberdates = thismemberdates
+                    memupdate.transform(mship, thismemberdates.member)
+                    break
+
+                # mship extends this memberdates from the end
+                if mship.start_date == thismemberdates.end_date + timedelta(1):
+                    thismemberdates.end_date = mship.end_date
+                    mship.member = thismemberdates.member
+                    mship.memberdates = thismemberdates
+                    memupdate.transform(mship, thismemberdates.member)
+                    break
+
+                # mship end date was changed
+                if (mship.start_date >= thismemberdates.start_date and mship.start_date <= thismemberdates.end_date 
+                        and date_range.end_date != thismemberdates.end_date):
+                    thismemberdates.end_date = date_range.end_date
+                    mship.member = thismemberdates.member
+                    mship.memberdates = thismemberdates
+                    memupdate.transform(mship, thismemberdates.member)
+                    break
+
+                # mship start date was changed
+                if (mship.end_date >= thismemberdates.start_date and mship.end_date <= thismemberdates.end_date 
+                        and date_range.start_date != thismemberdates.start_date):
+                    thismemberdates.start_date = date_range.start_date
+                    mship.member = thismemberdates.member
+                    mship.memberdates = thismemberdates
+                    memupdate.transform(mship, thismemberdates.member)
+                    break
+
+                # mship wholly contained within this member
+                if mship.start_date >= thismemberdates.start_date and mship.end_date <= thismemberdates.end_date:
+                    mship.member = thismemberdates.member
+                    mship.memberdates = thismemberdates
+                    memupdate.transform(mship, thismemberdates.member)
+                    break
+
+        # delete unused memberdates records
+        delmemberdates = []
+        for mndx in range(len(thesememberdates)):
+            thismemberdates = thesememberdates[mndx]
+            if len(thismemberdates.member.memberships) == 0:
+                delmemberdates.append(thismemberdates)
+        for delmember in delmemberdates:
+            db.session.delete(delmember)
+            thesememberdates.remove(delmember)
+        if len(delmemberdates) > 0:
+            flush()
+
+        # merge memberdates records as appropriate
+        thisndx = 0
+        delmemberdates = []
+        for nextmndx in range(1, len(thesememberdates)):
+            thismemberdates = thesememberdates[thisndx]
+            nextmemberdates = thesememberdates[nextmndx]
+            if thismemberdates.end_date + timedelta(1) >= nextmemberdates.start_date:
+                for mship in nextmemberdates.member.memberships:
+                    mship.member = thismemberdates.member
+                    mship.memberdates = thismemberdates
+                    delmemberdates.append(nextmemberdates)
+            else:
+                thisndx = nextmndx
+        for delmember in delmemberdates:
+            db.session.delete(delmember)
+        if len(delmemberdates) > 0:
+            flush()
+
+    return thismember
+
+def _perrow_memberdates(m):
+    """query the database for all the memberdates records of the member matching membership m
+
+    Args:
+        m (dict): membership in common "file" format
+
+    Returns:
+        SortedList: memberdates records, sorted by end_date
+    """
+    filternamedob = and_(
+        Member.family_name == m['FamilyName'], 
+        Member.given_name == m['GivenName'], 
+        Member.gender == m['Gender'], 
+        Member.dob == isodate.asc2dt(m['DOB'])
+    )
+    # func.binary forces case sensitive comparison. see https://stackoverflow.com/a/31788828/799921
+    filtermemberid = Member.svc_member_id == func.binary(m['MemberID'])
+    filtermember = or_(filternamedob, filtermemberid)
+
+    # get all the memberdates records for this member
+    # note there may currently be more than one member record, as the memberships may be discontiguous
+    thesememberdates = SortedList(key=lambda md: md.end_date)
+    thesememberdates.update(MemberDates.query.outerjoin(Member, MemberDates.member_id==Member.id).filter(filtermember).all())
+    return thesememberdates
+
+def _isdeleted(obj):
+    """True if obj is pending delete in, or has been deleted from, the session"""
+    return obj in db.session.deleted or inspect(obj).was_deleted
+
+class MemberIndex(object):
+    """in-memory indexes of the Member records for an interest, used for bulk merge
+
+    Members are indexed by svc_member_id, and by (family_name, given_name, gender, dob).
+    Names are compared case insensitively and svc_member_id case sensitively, the way
+    the per-row database query compares them under MySQL's default collation.
+
+    Args:
+        members (list): Member records, with memberdates and memberships loaded
+    """
+    def __init__(self, members):
+        self.bymemberid = {}
+        self.bynamedob = {}
+        # keys each member is currently indexed under, so they can be removed if the member changes
+        self.memberkeys = {}
+        for member in members:
+            self.add(member)
+
+    @staticmethod
+    def _memberidkey(svc_member_id):
+        return str(svc_member_id) if svc_member_id is not None else None
+
+    @staticmethod
+    def _namedobkey(family_name, given_name, gender, dob):
+        if family_name is None or given_name is None or gender is None or dob is None:
+            return None
+        return (family_name.lower(), given_name.lower(), gender.lower(), dob)
+
+    def add(self, member):
+        """index member, reindexing if it was already indexed"""
+        self.remove(member)
+        memberidkey = self._memberidkey(member.svc_member_id)
+        namedobkey = self._namedobkey(member.family_name, member.given_name, member.gender, member.dob)
+        # dicts used as ordered sets
+        if memberidkey is not None:
+            self.bymemberid.setdefault(memberidkey, {})[member] = True
+        if namedobkey is not None:
+            self.bynamedob.setdefault(namedobkey, {})[member] = True
+        self.memberkeys[member] = (memberidkey, namedobkey)
+
+    def remove(self, member):
+        """remove member from the indexes, if present"""
+        if member not in self.memberkeys:
+            return
+        memberidkey, namedobkey = self.memberkeys.pop(member)
+        if memberidkey is not None:
+            self.bymemberid[memberidkey].pop(member, None)
+        if namedobkey is not None:
+            self.bynamedob[namedobkey].pop(member, None)
+
+    def find(self, m):
+        """find the member records matching membership m by name, gender and dob, or by member id
+
+        Args:
+            m (dict): membership in common "file" format
+
+        Returns:
+            list: matching Member records
+        """
+        namedobkey = self._namedobkey(m['FamilyName'], m['GivenName'], m['Gender'], isodate.asc2dt(m['DOB']).date())
+        found = dict(self.bynamedob.get(namedobkey, {}))
+        found.update(self.bymemberid.get(self._memberidkey(m['MemberID']), {}))
+        return list(found)
+
+    def memberdates(self, m):
+        """get all the memberdates records of the member(s) matching membership m
+
+        Args:
+            m (dict): membership in common "file" format
+
+        Returns:
+            SortedList: memberdates records, sorted by end_date
+        """
+        thesememberdates = SortedList(key=lambda md: md.end_date)
+        for member in self.find(m):
+            thesememberdates.update([md for md in member.memberdates if not _isdeleted(md)])
+        return thesememberdates
+
+def merge_memberships(memberships, linterest, bulk=False, flushsize=500):
+    """merge memberships into the member, memberdates, membership tables
+
+    By default each membership is merged after querying the database for its member's
+    memberdates records. If bulk is set, all the interest's member records are loaded in
+    one pass, each membership is resolved against in-memory indexes, and the session is
+    flushed every flushsize memberships. Both produce the same database updates.
+
+    Args:
+        memberships (list): memberships in common "file" format, sorted by member, expiration date
+        linterest (LocalInterest): interest to merge into
+        bulk (bool, optional): merge using in-memory indexes. Defaults to False
+        flushsize (int, optional): for bulk, number of memberships between flushes. Defaults to 500
+    """
+    if not bulk:
+        for m in memberships:
+            thesememberdates = _perrow_memberdates(m)
+            merge_membership(m, thesememberdates, linterest)
+        return
+
+    members = (Member.query
+               .filter_by(interest=linterest)
+               .options(selectinload(Member.memberdates), selectinload(Member.memberships))
+               .all())
+    index = MemberIndex(members)
+
+    # memberships are found through the indexes, so no need to flush for later processing
+    with db.session.no_autoflush:
+        for ndx, m in enumerate(memberships, 1):
+            thesememberdates = index.memberdates(m)
+            touched = {md.member for md in thesememberdates}
+            thismember = merge_membership(m, thesememberdates, linterest, flush=lambda: None)
+            touched.add(thismember)
+
+            # names, dob, gender, svc_member_id may have been updated by the merge
+            for member in touched:
+                index.add(member)
+
+            if ndx % flushsize == 0:
+                db.session.flush()
+
+    db.session.flush()
+
+def membershipkey(m):
+    """sort key for memberships: member (family_name, given_name, gender, dob), expiration_date"""
+    return (m['FamilyName'], m['GivenName'], m['Gender'], m['DOB'], m['ExpirationDate'])
+
+def memberkey(m):
+    """key grouping memberships by member (family_name, given_name, gender, dob)"""
+    return (m['FamilyName'], m['GivenName'], m['Gender'], m['DOB'])
+
+def dedup_memberships(memberships):
+    """remove duplicate memberships (RunSignup sometimes sends duplicate)
+
+    this works because each year gets a unique membership id for the membership (multiple people),
+    and each member has a unique member id
+
+    Args:
+        memberships (iterable): memberships in common "file" format, sorted by membershipkey
+
+    Yields:
+        dict: the last of each run of adjacent duplicate memberships
+    """
+    thislogger = getLogger('members.cli')
+    prev = None
+    for m in memberships:
+        if prev is not None:
+            if m['MemberID'] != prev['MemberID'] or m['MembershipID'] != prev['MembershipID']:
+                yield prev
+            else:
+                thislogger.debug(f"duplicate removed for membership_id={prev['MembershipID']} user_id/member_id={prev['MemberID']}")
+        prev = m
+    if prev is not None:
+        yield prev
+
+def sorted_membershipfile(membershipfile, runsize=10000):
+    """read memberships from a csv file in sorted order, without holding the whole file in memory
+
+    the file is read in runs of runsize memberships, each run is sorted and saved to a temporary
+    file, and the runs are merged as they are read back
+
+    Args:
+        membershipfile (str): csv file with membership data in common "file" format
+        runsize (int, optional): number of memberships sorted in memory at a time. Defaults to 10000
+
+    Yields:
+        dict: memberships, sorted by membershipkey
+    """
+    with TemporaryDirectory() as tmpdir:
+        runpaths = []
+        with open(membershipfile, 'r', newline='') as _MF:
+            MF = DictReader(_MF)
+            while True:
+                run = list(islice(MF, runsize))
+                if not run:
+                    break
+                run.sort(key=membershipkey)
+                runpath = join(tmpdir, f'run{len(runpaths)}.csv')
+                with open(runpath, 'w', newline='') as runf:
+                    RF = DictWriter(runf, fieldnames=MF.fieldnames)
+                    RF.writeheader()
+                    RF.writerows(run)
+                runpaths.append(runpath)
+
+        runfiles = [open(runpath, 'r', newline='') for runpath in runpaths]
+        try:
+            yield from heapmerge(*[DictReader(runf) for runf in runfiles], key=membershipkey)
+        finally:
+            for runf in runfiles:
+                runf.close()
+
+def membershipfile_source(membershipfile):
+    """identify the contents of membershipfile, to tell whether a checkpoint was made from it
+
+    Args:
+        membershipfile (str): membership file name
+
+    Returns:
+        dict: {'size': bytes, 'mtime': modification time}
+    """
+    filestat = stat(membershipfile)
+    return {'size': filestat.st_size, 'mtime': filestat.st_mtime}
+
+def stream_memberships(memberships, linterest, chunksize=100, checkpointfile=None, source=None):
+    """merge memberships one member at a time, committing every chunksize members
+
+    the key of the last member committed is saved in checkpointfile, if supplied, and members up to
+    that key are skipped when restarting after a failure. The checkpoint records source, and is
+    ignored if it was made from a different source. The checkpoint file is removed when all
+    the memberships have been merged.
+
+    Args:
+        memberships (iterable): memberships in common "file" format, sorted by membershipkey
+        linterest (LocalInterest): interest to merge into
+        chunksize (int, optional): number of members per commit. Defaults to 100
+        checkpointfile (str, optional): file to save progress in. Defaults to None
+        source (dict, optional): identifies the memberships, e.g., from membershipfile_source(). Defaults to None
+    """
+    thislogger = getLogger('members.cli')
+
+    resumekey = None
+    if checkpointfile and exists(checkpointfile):
+        with open(checkpointfile, 'r') as cpf:
+            checkpoint = loads(cpf.read())
+        if isinstance(checkpoint, dict) and checkpoint.get('source') == source:
+            resumekey = tuple(checkpoint['key'])
+            thislogger.info(f'resuming after member {resumekey}')
+        else:
+            thislogger.info(f'ignoring checkpoint {checkpointfile}, which was made from different memberships')
+
+    nmembers = 0
+    for key, rows in groupby(memberships, key=memberkey):
+        if resumekey and key <= resumekey:
+            continue
+
+        for m in rows:
+            merge_membership(m, _perrow_memberdates(m), linterest)
+
+        nmembers += 1
+        if nmembers % chunksize == 0:
+            db.session.commit()
+            if checkpointfile:
+                with open(checkpointfile, 'w') as cpf:
+                    cpf.write(dumps({'source': source, 'key': key}))
+
+    db.session.commit()
+    if checkpointfile and exists(checkpointfile):
+        remove(checkpointfile)
+
+def modified_after_timestamp(tableupdatetime, overlap=timedelta(hours=24)):
+    """get the service modified_after_timestamp parameter for an incremental update
+
+    RunSignUp last_modified times are naive, so the high-water mark is backed off by overlap to
+    allow for any timezone difference. Memberships modified within the overlap are merged again,
+    which leaves the database unchanged.
+
+    Args:
+        tableupdatetime (TableUpdateTime): update time record for the member table
+        overlap (timedelta, optional): how far to back off the high-water mark. Defaults to 24 hours
+
+    Returns:
+        int: epoch timestamp, or None if there is no high-water mark yet (a full update is needed)
+    """
+    if not tableupdatetime.last_modified:
+        return None
+    return int((tableupdatetime.last_modified - overlap).timestamp())
+
+def advance_high_water_mark(tableupdatetime, rawmemberships):
+    """advance the member table's high-water mark to the latest last_modified from the service
+
+    Args:
+        tableupdatetime (TableUpdateTime): update time record for the member table
+        rawmemberships (list): memberships as returned from RunSignUp
+    """
+    if not rawmemberships:
+        return
+    latest = max(rsudt.asc2dt(m['last_modified']) for m in rawmemberships)
+    if not tableupdatetime.last_modified or latest > tableupdatetime.last_modified:
+        tableupdatetime.last_modified = latest
+
 # needs to be before any commands
 @group()
 def membership():
@@ -49,9 +629,15 @@ def membership():
 @membership.command()
 @argument('interest')
 @option('--membershipfile', help='csv file with cached membership data')
+@option('--bulk', is_flag=True, help='merge against in-memory indexes of all the interest\'s members, with batched flushes')
+@option('--incremental/--full', default=False, help='merge only memberships modified at the service since the last update, '
+                                                    'or reconcile all current and future memberships (default)')
+@option('--chunksize', type=int, help='with --membershipfile, stream the file and commit every CHUNKSIZE members')
+@option('--checkpointfile', help='with --chunksize, file to track progress for resuming (default: MEMBERSHIPFILE.checkpoint)')
+@option('--rebuildstats', is_flag=True, help='recompute membership stats counts from all memberdates')
 @with_appcontext
 @catch_errors
-def update(interest, membershipfile):
+def update(interest, membershipfile, bulk, incremental, chunksize, checkpointfile, rebuildstats):
     """update member, membership tables, from membershipfile if supplied, or from service based on interest"""
     thislogger = getLogger('members.cli')
     if debug:
@@ -60,17 +646,22 @@ def update(interest, membershipfile):
         thislogger.setLevel(INFO)
     thislogger.propagate = True
 
+    if incremental and membershipfile:
+        raise ParameterError('--incremental cannot be used with --membershipfile')
+    if chunksize and not membershipfile:
+        raise ParameterError('--chunksize requires --membershipfile')
+    if chunksize and bulk:
+        raise ParameterError('--chunksize cannot be used with --bulk')
+
     # set local interest
     g.interest = interest
     linterest = localinterest()
 
     try:
-        # assume update will complete ok
         tableupdatetime = TableUpdateTime.query.filter_by(interest=linterest, tablename='member').one_or_none()
         if not tableupdatetime:
             tableupdatetime = TableUpdateTime(interest=linterest, tablename='member')
             db.session.add(tableupdatetime)
-        tableupdatetime.lastchecked = datetime.today()
         
         # gender logic
         def get_gender(mem):
@@ -124,18 +715,38 @@ def update(interest, membershipfile):
                             sourceattr=False, # source and target are dicts
                             targetattr=False
                             )
-            rsu = make_runsignup_client(debug=debug)
-
             def doxform(ms):
                 membership = {}
                 xform.transform(ms, membership)
                 return membership
 
-            with rsu:
-                # get current and future members from RunSignUp, and put into common format
-                rawmemberships = rsu.members(club_id, current_members_only='F')
-                currfuturememberships = [m for m in rawmemberships if m['membership_end'] >= datetime.today().date().isoformat()]
-                memberships = [doxform(ms) for ms in currfuturememberships]
+            # incremental update only needs memberships modified since the last update
+            since = None
+            if incremental:
+                overlap = timedelta(hours=current_app.config.get('MEMBERSHIP_UPDATE_DELTA_OVERLAP_HOURS', 24))
+                since = modified_after_timestamp(tableupdatetime, overlap=overlap)
+                if not since:
+                    thislogger.info(f'no high-water mark for {interest}, performing full update')
+
+            # memberships come from the club's RunSignUp snapshot, which is shared with the community
+            # sync jobs and only downloads what changed since it was last refreshed. a full update
+            # reconciles against the whole roster as it is now at RunSignUp
+            snapshot = rsu_club_snapshot(make_runsignup_fluent_client(debug=debug), club_id)
+            rawmemberships = list(snapshot.records(fullrefresh=not since).values())
+            if since:
+                sincedt = rsudt.dt2asc(datetime.fromtimestamp(since))
+                rawmemberships = [m for m in rawmemberships if m['last_modified'] >= sincedt]
+
+            # get current and future members, and put into common format
+            currfuturememberships = [m for m in rawmemberships if m['membership_end'] >= datetime.today().date().isoformat()]
+            memberships = [doxform(ms) for ms in currfuturememberships]
+
+            # remember where to start the next incremental update
+            advance_high_water_mark(tableupdatetime, rawmemberships)
+
+        # membershipfile supplied, streamed in sorted order
+        elif chunksize:
+            memberships = sorted_membershipfile(membershipfile)
 
         # membershipfile supplied
         else:
@@ -145,296 +756,36 @@ def update(interest, membershipfile):
                 memberships = [ms for ms in MF]
         
         # sort memberships by member (family_name, given_name, gender, dob), expiration_date
-        memberships.sort(key=lambda m: (m['FamilyName'], m['GivenName'], m['Gender'], m['DOB'], m['ExpirationDate']))
+        # streamed memberships are already sorted
+        if not chunksize:
+            memberships.sort(key=membershipkey)
         
         # optionally deduplicate memberships (RunSignup sometimes sends duplicate)
         if current_app.config.get('MEMBERSHIP_UPDATE_DEDUP', True):
-            # the following will work because: each year gets a unique
-            # membership id for the membership (multiple people), and each
-            # member has a unique member id
             thislogger.debug(f"deduplicating memberships from RunSignup")
-            deduped = []
-            for i in range(len(memberships)):
-                if (    i==len(memberships)-1 
-                        or memberships[i]['MemberID'] != memberships[i+1]['MemberID']
-                        or memberships[i]['MembershipID'] != memberships[i+1]['MembershipID']):
-                    deduped.append(memberships[i])
-                else:
-                    thislogger.debug(f"duplicate removed for membership_id={memberships[i]['MembershipID']} user_id/member_id={memberships[i]['MemberID']}")
-            
-            # replace memberships with deduplicated list
-            memberships = deduped
-
-        # set up member, membership transforms to create db records
-        # transform: member record from membership "file" format
-        memxform = Transform({
-            'family_name':      'FamilyName',
-            'given_name':       'GivenName',
-            'middle_name':      'MiddleName',
-            'gender':           'Gender',
-            'svc_member_id':    'MemberID',
-            'dob':              lambda m: isodate.asc2dt(m['DOB']).date(),
-            'hometown':         lambda m: f'{m["City"]}, {m["State"]}' if 'City' in m and 'State' in m else '',
-            'email':            'Email',
-        }, sourceattr=False, targetattr=True)
-        memdatesxform = Transform({
-            'start_date':           lambda m: isodate.asc2dt(m['JoinDate']).date(),
-            'end_date':             lambda m: isodate.asc2dt(m['ExpirationDate']).date(),        
-        })
-        # transform: update member record from membership record
-        memupdate = Transform({
-            'svc_member_id':    'svc_member_id',
-            'hometown':         'hometown',
-            'email':            'email',
-        }, sourceattr=True, targetattr=True)
-        # transform: membership record from membership "file" format
-        mshipxform = Transform({
-            'svc_member_id':        'MemberID',
-            'svc_membership_id':    'MembershipID',
-            'membershiptype':       'MembershipType',
-            'hometown':             lambda m: f'{m["City"]}, {m["State"]}' if 'City' in m and 'State' in m else '',
-            'email':                'Email',
-            'start_date':           lambda m: isodate.asc2dt(m['JoinDate']).date(),
-            'end_date':             lambda m: isodate.asc2dt(m['ExpirationDate']).date(),
-            'primary':              lambda m: m['PrimaryMember'].lower() == 't' or m['PrimaryMember'].lower() == 'yes',
-            'last_modified':        lambda m: rsudt.asc2dt(m['LastModified']),
-        }, sourceattr=False, targetattr=True)
+            memberships = dedup_memberships(memberships)
 
         # insert member, memberdates, membership records
-        for m in memberships:
-            # need MembershipId to be string for comparison with database key
-            m['MembershipID'] = str(m['MembershipID'])
-
-            filternamedob = and_(
-                Member.family_name == m['FamilyName'], 
-                Member.given_name == m['GivenName'], 
-                Member.gender == m['Gender'], 
-                Member.dob == isodate.asc2dt(m['DOB'])
-            )
-            # func.binary forces case sensitive comparison. see https://stackoverflow.com/a/31788828/799921
-            filtermemberid = Member.svc_member_id == func.binary(m['MemberID'])
-            filtermember = or_(filternamedob, filtermemberid)
-
-            # get all the memberdates records for this member
-            # note there may currently be more than one member record, as the memberships may be discontiguous
-            thesememberdates = SortedList(key=lambda md: md.end_date)
-            thesememberdates.update(MemberDates.query.outerjoin(Member, MemberDates.member_id==Member.id).filter(filtermember).all())
-
-            # if member doesn't exist, create member, memberdates, and membership records
-            if len(thesememberdates) == 0:
-                thismember = Member(interest=localinterest())
-                memxform.transform(m, thismember)
-                db.session.add(thismember)
-                # flush so thismember can be referenced in thismship and thismdates, and can be found in later processing
-                db.session.flush()
-                
-                thismdate = MemberDates(interest=localinterest(), member=thismember)
-                memdatesxform.transform(m, thismdate)
-                db.session.add(thismdate)
-                thesememberdates.add(thismdate)
-
-                thismship = Membership(interest=localinterest(), member=thismember, memberdates=thismdate)
-                mshipxform.transform(m, thismship)
-                db.session.add(thismship)
-                
-                # flush so thismdate and thismship can be found in later processing
-                db.session.flush()
-                
-            # if there are already some memberships for this member, merge with this membership (m)
+        # membership stats counts are adjusted for the memberdates changes
+        with MemberCountTracker(linterest):
+            if chunksize:
+                stream_memberships(memberships, linterest, chunksize=chunksize,
+                                   checkpointfile=checkpointfile or f'{membershipfile}.checkpoint',
+                                   source=membershipfile_source(membershipfile))
             else:
-                # assumes memberdates.member is the same for all thesememberdates
-                thismember = thesememberdates[0].member
-                
-                # dbmships is keyed by svc_membership_id, sorted by end_date
-                # NOTE: svc_membership_id is unique only within a member -- be careful if the use of dbmships changes 
-                # to include multiple members
-                dbmships = ItemSortedDict(lambda k, v: v.end_date)
-                for thismd in thesememberdates:
-                    for mship in thismd.member.memberships:
-                        dbmships[mship.svc_membership_id] = mship
-
-                # add membership if not already there for this member
-                mshipid = m['MembershipID']
-                if mshipid not in dbmships:
-                    newmship = True
-                    thismship = Membership(interest=localinterest())
-                    db.session.add(thismship)
-                    # flush so thismship can be found in later processing
-                    db.session.flush()
-
-                # update existing membership
-                else:
-                    newmship = False
-                    thismship = dbmships[mshipid]            
-
-                # merge the new membership record into the database record
-                mshipxform.transform(m, thismship)
-
-                # add new membership to data structure
-                if newmship:
-                    dbmships[thismship.svc_membership_id] = thismship
-
-                # need list view for some processing
-                dbmships_keys = dbmships.keys()
-
-                # check for overlaps
-                for thisndx in range(1, len(dbmships_keys)):
-                    prevmship = dbmships[dbmships_keys[thisndx-1]]
-                    thismship = dbmships[dbmships_keys[thisndx]]
-                    if thismship.start_date <= prevmship.end_date:
-                        oldstart = thismship.start_date
-                        newstart = prevmship.end_date + timedelta(1)
-                        oldstartasc = isodate.dt2asc(oldstart)
-                        newstartasc = isodate.dt2asc(newstart)
-                        endasc = isodate.dt2asc(thismship.end_date)
-                        memberkey = f'{m["FamilyName"]},{m["GivenName"]},{m["DOB"]}'
-                        # TODO: check for #562 improve membertility member cache processing
-                        thislogger.warning(f'overlap detected for {memberkey}: end={endasc} was start={oldstartasc} now start={newstartasc}')
-                        thismship.start_date = newstart
-
-                # calculate contigous range for membership records
-                mship_date_range = {}
-                contiguous_mshipids = []
-                class DateRangeItem(object): 
-                    def __init__(self, **kwargs):
-                        for arg in kwargs:
-                            setattr(self, arg, kwargs[arg])
-                # dbmships is keyed by svc_membership_id, sorted by end_date
-                for mshipid in dbmships_keys:
-                    mship = dbmships[mshipid]
-                    # contiguous_mshipids is empty (startup condition), let's get it started
-                    if not contiguous_mshipids:
-                        current_range = DateRangeItem(start_date=mship.start_date, end_date=mship.end_date)
-                        contiguous_mshipids = [mshipid]
-                    else:
-                        last_mshipid = contiguous_mshipids[-1]
-                        last_mship = dbmships[last_mshipid]
-                        # if membership is contiguous
-                        # TODO: check for #562 improve membertility member cache processing
-                        if mship.start_date == last_mship.end_date + timedelta(1):
-                            current_range.end_date = mship.end_date
-                            contiguous_mshipids.append(mshipid)
-                        # membership not contiguous
-                        else:
-                            for contiguous_mshipid in contiguous_mshipids:
-                                mship_date_range[contiguous_mshipid] = current_range
-                            current_range = DateRangeItem(start_date=mship.start_date, end_date=mship.end_date)
-                            contiguous_mshipids = [mshipid]
-                for contiguous_mshipid in contiguous_mshipids:
-                    mship_date_range[contiguous_mshipid] = current_range
-                
-                # update appropriate memberdates record(s), favoring earlier records
-                # NOTE: membership hometown, email get copied into appropriate member records; 
-                #   since mship list is sorted, last one remains
-                for mshipid in dbmships_keys:
-                    mship = dbmships[mshipid]
-                    date_range = mship_date_range[mshipid]
-                    for nextmndx in range(len(thesememberdates)):
-                        thismemberdates = thesememberdates[nextmndx]
-                        lastmemberdates = thesememberdates[nextmndx-1] if nextmndx != 0 else None
-
-                        # corner case: someone changed their birthdate and/or gender
-                        # TODO: use Transform for these
-                        thismemberdates.member.dob = isodate.asc2dt(m['DOB']).date()
-                        thismemberdates.member.gender = m['Gender']
-                        
-                        # prefer last name found
-                        thismemberdates.member.given_name = m['GivenName']
-                        thismemberdates.member.family_name = m['FamilyName']
-                        thismemberdates.member.middle_name = m['MiddleName'] if m['MiddleName'] else ''
-                        
-                        # mship causes new memberdates record before this one 
-                        #   or after end of thesememberdates
-                        #   or wholy between thesememberdates
-                        if (mship.end_date + timedelta(1) < thismemberdates.start_date or
-                                (nextmndx == len(thesememberdates)-1) and mship.start_date > thismemberdates.end_date + timedelta(1) or
-                                lastmemberdates and mship.start_date > lastmemberdates.end_date + timedelta(1) and mship.end_date < thismemberdates.start_date):
-                            newmemberdates = MemberDates(interest=localinterest(), member=thismember)
-                            db.session.add(newmemberdates)
-                            # flush so thismemberdates can be referenced in mship, and can be found in later processing
-                            db.session.flush()
-                            memdatesxform.transform(m, newmemberdates)
-                            mship.member = thismember
-                            mship.memberdates = newmemberdates
-                            break
-
-                        # mship extends this memberdates record from the beginning
-                        if mship.end_date + timedelta(1) == thismemberdates.start_date:
-                            thismemberdates.start_date = mship.start_date
-                            mship.member = thismemberdates.member
-                            mship.memberdates = thismemberdates
-                            memupdate.transform(mship, thismemberdates.member)
-                            break
-
-                        # mship extends this memberdates from the end
-                        if mship.start_date == thismemberdates.end_date + timedelta(1):
-                            thismemberdates.end_date = mship.end_date
-                            mship.member = thismemberdates.member
-                            mship.memberdates = thismemberdates
-                            memupdate.transform(mship, thismemberdates.member)
-                            break
-
-                        # mship end date was changed
-                        if (mship.start_date >= thismemberdates.start_date and mship.start_date <= thismemberdates.end_date 
-                                and date_range.end_date != thismemberdates.end_date):
-                            thismemberdates.end_date = date_range.end_date
-                            mship.member = thismemberdates.member
-                            mship.memberdates = thismemberdates
-                            memupdate.transform(mship, thismemberdates.member)
-                            break
-
-                        # mship start date was changed
-                        if (mship.end_date >= thismemberdates.start_date and mship.end_date <= thismemberdates.end_date 
-                                and date_range.start_date != thismemberdates.start_date):
-                            thismemberdates.start_date = date_range.start_date
-                            mship.member = thismemberdates.member
-                            mship.memberdates = thismemberdates
-                            memupdate.transform(mship, thismemberdates.member)
-                            break
-
-                        # mship wholly contained within this member
-                        if mship.start_date >= thismemberdates.start_date and mship.end_date <= thismemberdates.end_date:
-                            mship.member = thismemberdates.member
-                            mship.memberdates = thismemberdates
-                            memupdate.transform(mship, thismemberdates.member)
-                            break
-                        
-                # delete unused memberdates records
-                delmemberdates = []
-                for mndx in range(len(thesememberdates)):
-                    thismemberdates = thesememberdates[mndx]
-                    if len(thismemberdates.member.memberships) == 0:
-                        delmemberdates.append(thismemberdates)
-                for delmember in delmemberdates:
-                    db.session.delete(delmember)
-                    thesememberdates.remove(delmember)
-                if len(delmemberdates) > 0:
-                    db.session.flush()
-
-                # merge memberdates records as appropriate
-                thisndx = 0
-                delmemberdates = []
-                for nextmndx in range(1, len(thesememberdates)):
-                    thismemberdates = thesememberdates[thisndx]
-                    nextmemberdates = thesememberdates[nextmndx]
-                    if thismemberdates.end_date + timedelta(1) >= nextmemberdates.start_date:
-                        for mship in nextmemberdates.member.memberships:
-                            mship.member = thismemberdates.member
-                            mship.memberdates = thismemberdates
-                            delmemberdates.append(nextmemberdates)
-                    else:
-                        thisndx = nextmndx
-                for delmember in delmemberdates:
-                    db.session.delete(delmember)
-                if len(delmemberdates) > 0:
-                    db.session.flush()
+                merge_memberships(list(memberships), linterest, bulk=bulk,
+                                  flushsize=current_app.config.get('MEMBERSHIP_UPDATE_FLUSH_SIZE', 500))
 
         # save statistics file
         groupfolder = join(current_app.config['APP_FILE_FOLDER'], interest)
         if not exists(groupfolder):
             mkdir(groupfolder, mode=0o770)
         statspath = join(groupfolder, current_app.config['APP_STATS_FILENAME'])
-        analyzemembership(statsfile=statspath)
+        analyzemembership(statsfile=statspath, rebuild=rebuildstats)
+
+        # the members page caches its rows against lastchecked, so it is only changed with the final
+        # commit; when streaming, earlier chunks have already been committed
+        tableupdatetime.lastchecked = datetime.today()
 
         # make sure we remember everything we did
         db.session.commit()
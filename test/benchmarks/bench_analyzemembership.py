@@ -0,0 +1,94 @@
+'''
+bench_analyzemembership - compare membership stats difference array with day by day loop
+==========================================================================================
+
+run from the repository root:
+
+    python test/benchmarks/bench_analyzemembership.py [--members N] [--years N]
+'''
+
+# standard
+from argparse import ArgumentParser
+from datetime import date, timedelta
+from random import Random
+from time import perf_counter
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app', 'src'))
+os.environ.setdefault('APP_NAME', 'members')
+os.environ.setdefault('APP_VER', '0.0.0')
+
+# homegrown
+from members.views import membership_common
+from members.views.membership_common import countmembers
+
+
+def loopcounts(dateranges, today):
+    '''day by day count, as analyzemembership() originally did it'''
+    stats = {}
+    for start_date, end_date in dateranges:
+        thisdate = start_date
+        while thisdate <= end_date and thisdate <= today:
+            if thisdate.year >= 2013:
+                thismd = f'{thisdate.month:02d}-{thisdate.day:02d}'
+                stats.setdefault(thisdate.year, {})
+                stats[thisdate.year].setdefault(thismd, 0)
+                stats[thisdate.year][thismd] += 1
+            thisdate += timedelta(1)
+    return [{'year': year, 'counts': [{'date': d, 'count': stats[year][d]} for d in sorted(stats[year])]}
+            for year in sorted(stats)]
+
+
+def synthetic_ranges(members, years, today, seed=1):
+    '''one-year memberships, most members renewing contiguously for a few years'''
+    rand = Random(seed)
+    firstyear = today.year - years + 1
+    ranges = []
+    for _ in range(members):
+        start = date(firstyear, 1, 1) + timedelta(rand.randrange(365 * years))
+        end = start + timedelta(365 * rand.randint(1, 4) - 1)
+        ranges.append((start, end))
+    return ranges
+
+
+def timeit(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = perf_counter()
+        result = fn(*args)
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--members', type=int, default=1000, help='memberdates ranges per year of history')
+    parser.add_argument('--years', type=int, default=8, help='years of history')
+    args = parser.parse_args()
+
+    today = date.today()
+    ranges = synthetic_ranges(args.members * args.years, args.years, today)
+    print(f'{len(ranges)} memberdates ranges over {args.years} years')
+
+    looptime, expected = timeit(loopcounts, ranges, today, repeat=1)
+    print(f'day by day loop:           {looptime:8.3f}s')
+
+    if membership_common.np is not None:
+        nptime, result = timeit(countmembers, ranges, today)
+        assert result == expected
+        print(f'difference array (numpy):  {nptime:8.3f}s  {looptime / nptime:6.1f}x')
+
+    np = membership_common.np
+    membership_common.np = None
+    try:
+        pytime, result = timeit(countmembers, ranges, today)
+    finally:
+        membership_common.np = np
+    assert result == expected
+    print(f'difference array (python): {pytime:8.3f}s  {looptime / pytime:6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
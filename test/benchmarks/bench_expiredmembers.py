@@ -0,0 +1,149 @@
+'''
+bench_expiredmembers - compare expired members SQL grouping with the python loop
+==================================================================================
+
+run from the repository root:
+
+    python test/benchmarks/bench_expiredmembers.py [--members N] [--years N]
+
+uses an in-memory sqlite database; MySQL, where the view runs, pays the same
+per-row transfer cost the SQL grouping avoids
+'''
+
+# standard
+from argparse import ArgumentParser
+from datetime import date, timedelta
+from random import Random
+from time import perf_counter
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app', 'src'))
+os.environ.setdefault('APP_NAME', 'members')
+os.environ.setdefault('APP_VER', '0.0.0')
+
+# pypi
+from flask import Flask
+from sqlalchemy import select, insert
+
+# homegrown
+from members.model import db, LocalInterest, Member, Membership, MemberAlias, MemberDates
+from members.views.admin.membership_admin import expired_members_stmt, get_memberdob
+
+
+def loopexpired(locinterest, sincedate, today):
+    '''python grouping, as ExpiredMembers.open() originally did it'''
+    stmt = (
+        select(
+            Membership.id, Member.svc_member_id, Member.family_name, Member.given_name, Member.middle_name,
+            Member.gender, Member.dob, Member.hometown, Member.email, MemberAlias.facebookalias,
+            Membership.member_id, Membership.end_date,
+        )
+        .outerjoin(MemberAlias, Member.id == MemberAlias.member_id)
+        .join(Membership, Member.id == Membership.member_id)
+        .order_by(Membership.member_id, Membership.end_date)
+        .filter(Membership.interest_id == locinterest.id)
+        .filter(Membership.end_date >= sincedate)
+    )
+    membershipsi = iter(db.session.execute(stmt).all())
+
+    lookup = {}
+    try:
+        membership = next(membershipsi)
+        while True:
+            expired_member = {'member_id': membership.member_id, 'end_date': membership.end_date}
+            while True:
+                if membership.end_date > expired_member['end_date']:
+                    expired_member['end_date'] = membership.end_date
+                member_dob = get_memberdob(membership)
+                if member_dob not in lookup or expired_member['end_date'] > lookup[member_dob]['end_date']:
+                    lookup[member_dob] = expired_member
+                last_member_id = membership.member_id
+                membership = next(membershipsi)
+                if membership.member_id != last_member_id: break
+    except StopIteration:
+        pass
+
+    return sorted((m['member_id'], m['end_date']) for m in lookup.values()
+                  if sincedate <= m['end_date'] < today)
+
+
+def sqlexpired(locinterest, sincedate, today):
+    rows = db.session.execute(expired_members_stmt(locinterest, sincedate, today))
+    return sorted((row.id, row.end_date) for row in rows)
+
+
+def populate(members, years, today, seed=1):
+    '''yearly memberships, members renewing for a random run of years; some people have two member records'''
+    rand = Random(seed)
+    interest = LocalInterest(interest_id=1)
+    db.session.add(interest)
+    db.session.flush()
+
+    firstyear = today.year - years
+    memberrows = []
+    for i in range(members):
+        # about 5% of people re-registered under a new member record
+        person = i if rand.random() > 0.05 or i == 0 else rand.randrange(i)
+        memberrows.append({
+            'id': i + 1, 'interest_id': interest.id, 'svc_member_id': str(i),
+            'family_name': f'Family{person}', 'given_name': f'Given{person}', 'middle_name': None,
+            'gender': 'F', 'dob': date(1950, 1, 1) + timedelta(person % 20000), 'hometown': 'Frederick, MD',
+            'email': f'member{i}@example.com', 'version_id': 1,
+        })
+    db.session.execute(insert(Member), memberrows)
+
+    mshiprows = []
+    for member in memberrows:
+        start = rand.randrange(years + 1)
+        for year in range(firstyear + start, firstyear + start + rand.randint(1, years)):
+            mshiprows.append({
+                'interest_id': interest.id, 'member_id': member['id'], 'svc_member_id': member['svc_member_id'],
+                'start_date': date(year, 1, 1), 'end_date': date(year, 12, 31), 'version_id': 1,
+            })
+    db.session.execute(insert(Membership), mshiprows)
+    db.session.commit()
+    return interest, len(mshiprows)
+
+
+def timeit(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = perf_counter()
+        result = fn(*args)
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--members', type=int, default=20000, help='member records')
+    parser.add_argument('--years', type=int, default=10, help='years of history')
+    args = parser.parse_args()
+
+    app = Flask('members')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_BINDS'] = {'users': 'sqlite:///:memory:'}
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        # only the tables used here, some others use MySQL-only DDL
+        tables = [m.__table__ for m in (LocalInterest, Member, MemberDates, Membership, MemberAlias)]
+        db.metadata.create_all(db.engine, tables=tables)
+        today = date.today()
+        interest, nmemberships = populate(args.members, args.years, today)
+        sincedate = date(today.year - args.years, 1, 1)
+        print(f'{args.members} members, {nmemberships} memberships over {args.years} years')
+
+        looptime, expected = timeit(loopexpired, interest, sincedate, today)
+        print(f'python loop:  {looptime:8.3f}s')
+
+        sqltime, result = timeit(sqlexpired, interest, sincedate, today)
+        assert result == expected
+        print(f'sql grouping: {sqltime:8.3f}s  {looptime / sqltime:6.1f}x  ({len(result)} expired members)')
+
+
+if __name__ == '__main__':
+    main()
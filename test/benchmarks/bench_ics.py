@@ -0,0 +1,108 @@
+'''
+bench_ics - time rebuilding a calendar feed with and without the VEVENT fragment cache
+======================================================================================
+
+run from the repository root:
+
+    python test/benchmarks/bench_ics.py [--events N] [--rebuilds N]
+
+builds a feed of N events spread over several years from an already fetched EventIndex
+(so no Discourse calls are timed), comparing:
+
+* uncached: every event built and the whole Calendar serialized, as before the fragment cache
+* cold: fragment cache empty, so every event is built once
+* warm: nothing changed since the last rebuild
+* one changed: one event edited since the last rebuild
+'''
+
+# standard
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from time import process_time
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app', 'src'))
+os.environ.setdefault('APP_NAME', 'members')
+os.environ.setdefault('APP_VER', '0.0.0')
+
+# pypi
+from icalendar import Calendar
+
+# homegrown
+from members import community_calendar
+from members.community_calendar import EventIndex, _build_vevent, filter_tags_to_bytes
+
+BASE_URL = 'https://community.example.com'
+log = logging.getLogger('bench')
+
+
+def make_events(n):
+    start = datetime(2024, 1, 6, 8)
+    events = []
+    for i in range(n):
+        starts = start + timedelta(days=3 * i)
+        events.append({
+            'id': i,
+            'name': f'Event {i}',
+            'timezone': 'America/New_York',
+            'starts_at': starts.isoformat(),
+            'ends_at': (starts + timedelta(hours=2)).isoformat(),
+            'post': {'id': 1000 + i, 'url': f'/t/event-{i}/{i}', 'topic': {'title': f'Event {i}', 'tags': ['racing']}},
+        })
+    return events
+
+
+def uncached(events):
+    cal = Calendar()
+    cal.add('PRODID', '-//FSRC Calendar//EN')
+    cal.add('VERSION', '2.0')
+    for event in events:
+        cal.add_component(_build_vevent(event, BASE_URL))
+    return cal.to_ical()
+
+
+def rebuild(events):
+    return filter_tags_to_bytes(BASE_URL, discourse=None, log=log, event_index=EventIndex(events))
+
+
+def timed(fn, events, rebuilds):
+    started = process_time()
+    for i in range(rebuilds):
+        ics = fn(events)
+    return (process_time() - started) / rebuilds, ics
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--rebuilds', type=int, default=20)
+    args = parser.parse_args()
+
+    events = make_events(args.events)
+    # no locations to resolve
+    community_calendar.fetch_event_locations = lambda *args: {}
+
+    print(f'{args.events} events, cpu seconds per rebuild')
+    elapsed, expected = timed(uncached, events, args.rebuilds)
+    print(f'  {"uncached":12s} {elapsed:8.4f}s')
+
+    community_calendar._vevent_cache.clear()
+    elapsed, ics = timed(rebuild, events, 1)
+    print(f'  {"cold":12s} {elapsed:8.4f}s')
+    assert ics == expected
+
+    elapsed, ics = timed(rebuild, events, args.rebuilds)
+    print(f'  {"warm":12s} {elapsed:8.4f}s')
+    assert ics == expected
+
+    started = process_time()
+    for i in range(args.rebuilds):
+        events[i] = dict(events[i], name=f'Event {i} (moved)')
+        rebuild(events)
+    print(f'  {"one changed":12s} {(process_time() - started) / args.rebuilds:8.4f}s')
+
+
+if __name__ == '__main__':
+    main()
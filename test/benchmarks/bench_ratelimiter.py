@@ -0,0 +1,121 @@
+'''
+bench_ratelimiter - compare the token-bucket Discourse rate limiter with the sliding window one
+===============================================================================================
+
+run from the repository root:
+
+    python test/benchmarks/bench_ratelimiter.py [--processes N] [--calls N]
+
+two scenarios, each with N processes making calls through one shared limiter:
+
+* overhead: a budget too large to throttle, so the time is all state handling under the lock
+* throttled: a small budget in a short window, where the sliding window limiter sleeps while
+  holding the lock; also checks that no window ever sees more than the budget
+'''
+
+# standard
+from argparse import ArgumentParser
+from functools import partial
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from time import perf_counter
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app', 'src'))
+os.environ.setdefault('APP_NAME', 'members')
+os.environ.setdefault('APP_VER', '0.0.0')
+
+# pypi
+from fasteners import InterProcessLock
+from flask import Flask
+
+# homegrown
+from members import community
+
+
+class SlidingWindowLimiter:
+    '''_RateLimiter as it was, a json list of call timestamps rewritten on every call'''
+    def __init__(self, max_calls, window_secs):
+        self.max_calls = max_calls
+        self.window_secs = window_secs
+
+    def _read_calls(self):
+        try:
+            return json.loads(community._RATE_LIMIT_STATE_FILE.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def acquire(self):
+        with InterProcessLock(community._RATE_LIMIT_STATE_LOCKFILE):
+            now = time.time()
+            calls = [t for t in self._read_calls() if now - t < self.window_secs]
+            if len(calls) >= self.max_calls:
+                wait = self.window_secs - (now - calls[0])
+                if wait > 0:
+                    time.sleep(wait)
+                    now = time.time()
+                    calls = [t for t in calls if now - t < self.window_secs]
+            calls.append(now)
+            community._RATE_LIMIT_STATE_FILE.write_text(json.dumps(calls))
+
+
+LIMITERS = {
+    'sliding window': SlidingWindowLimiter,
+    # no held back burst, for a like for like comparison
+    'token bucket': partial(community._RateLimiter, reserved_burst=0),
+}
+
+
+def worker(args):
+    limitername, statedir, max_calls, window_secs, ncalls = args
+    community._RATE_LIMIT_STATE_FILE = Path(statedir) / 'state'
+    community._RATE_LIMIT_STATE_LOCKFILE = str(Path(statedir) / 'state.lock')
+    limiter = LIMITERS[limitername](max_calls=max_calls, window_secs=window_secs)
+    calltimes = []
+    with Flask('bench').app_context():
+        for i in range(ncalls):
+            limiter.acquire()
+            calltimes.append(time.time())
+    return calltimes
+
+
+def run(limitername, processes, ncalls, max_calls, window_secs):
+    with TemporaryDirectory() as statedir:
+        started = perf_counter()
+        with get_context('spawn').Pool(processes) as pool:
+            # let the pool start before timing the calls
+            pool.map(abs, range(processes))
+            started = perf_counter()
+            results = pool.map(worker, [(limitername, statedir, max_calls, window_secs, ncalls)] * processes)
+        elapsed = perf_counter() - started
+
+    calltimes = sorted(t for r in results for t in r)
+    maxinwindow = max(len([c for c in calltimes[i:] if c - t < window_secs]) for i, t in enumerate(calltimes))
+    return elapsed, maxinwindow
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--calls', type=int, default=500, help='calls per process in the overhead scenario')
+    args = parser.parse_args()
+
+    print(f'overhead: {args.processes} processes x {args.calls} calls, no throttling')
+    for limitername in LIMITERS:
+        elapsed, maxinwindow = run(limitername, args.processes, args.calls, 10**9, 60)
+        calls = args.processes * args.calls
+        print(f'  {limitername:15s} {elapsed:7.3f}s  {elapsed / calls * 1e6:7.1f}us/call')
+
+    max_calls, window_secs, ncalls = 20, 2, 15
+    print(f'throttled: {args.processes} processes x {ncalls} calls, {max_calls} calls per {window_secs}s')
+    for limitername in LIMITERS:
+        elapsed, maxinwindow = run(limitername, args.processes, ncalls, max_calls, window_secs)
+        print(f'  {limitername:15s} {elapsed:7.3f}s  max {maxinwindow} calls in any {window_secs}s window')
+
+
+if __name__ == '__main__':
+    main()
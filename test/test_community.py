@@ -5,21 +5,28 @@ test_community - test members.community
 
 # standard
 import json
-from datetime import date
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, datetime
 
 # pypi
 import pytest
-from flask import g
+from click.testing import CliRunner
+from flask import g, current_app
 
 # homegrown
 from members import community
 from members.community import (
-    _RateLimiter, _RateLimitedDiscourse, make_discourse_client, run_query_paged,
-    DbTagCommunitySyncManager,
+    _RateLimiter, _RateLimitedDiscourse, make_discourse_client, run_query_paged, iter_query_paged,
+    DbTagCommunitySyncManager, fetch_rsu_pages, RsuClubSyncManager, RsuRaceSyncManager,
+    RsuSnapshot, RsuSnapshotChanges, DiscourseSnapshot, DiscourseUserDirectory, InviteMutation,
 )
 from members.model import db, LocalInterest, LocalUser, Position, Tag
 from loutilities.user.model import Interest
 from fakediscourse import FakeDiscourse
+from scripts import community_cli
 
 
 # ----------------------------------------------------------------------
@@ -28,47 +35,215 @@ from fakediscourse import FakeDiscourse
 
 @pytest.fixture
 def ratelimit_files(tmp_path, monkeypatch):
-    state_file = tmp_path / 'state.json'
+    state_file = tmp_path / 'state.bin'
     lock_file = tmp_path / 'state.lock'
     monkeypatch.setattr(community, '_RATE_LIMIT_STATE_FILE', state_file)
     monkeypatch.setattr(community, '_RATE_LIMIT_STATE_LOCKFILE', str(lock_file))
     return state_file
 
 
-def test_ratelimiter_first_acquire_records_one_timestamp(ratelimit_files):
-    rl = _RateLimiter(max_calls=5, window_secs=60)
-    rl.acquire()
-    calls = json.loads(ratelimit_files.read_text())
-    assert len(calls) == 1
+@pytest.fixture
+def fakeclock(monkeypatch):
+    '''time.time() which only moves when time.sleep() is called'''
+    clock = {'now': 1_000_000.0, 'sleeps': []}
+    def sleep(secs):
+        clock['sleeps'].append(secs)
+        clock['now'] += secs
+    monkeypatch.setattr(community.time, 'time', lambda: clock['now'])
+    monkeypatch.setattr(community.time, 'sleep', sleep)
+    return clock
+
+
+def test_ratelimiter_state_is_fixed_size(ratelimit_files, fakeclock, bareapp):
+    rl = _RateLimiter(max_calls=5, window_secs=60, burst=2, reserved_burst=0)
+    with bareapp.app_context():
+        for i in range(4):
+            rl.acquire()
+            assert ratelimit_files.stat().st_size == community._RATE_LIMIT_STATE.size
 
 
-def test_ratelimiter_prunes_calls_outside_window(ratelimit_files, monkeypatch):
-    fixed_now = 1_000_000.0
-    monkeypatch.setattr(community.time, 'time', lambda: fixed_now)
-    # three calls well outside a 60s window
-    ratelimit_files.write_text(json.dumps([fixed_now - 1000, fixed_now - 2000, fixed_now - 3000]))
+def test_ratelimiter_burst_then_paced(ratelimit_files, fakeclock, bareapp):
+    rl = _RateLimiter(max_calls=5, window_secs=60, burst=2, reserved_burst=0)
+    with bareapp.app_context():
+        for i in range(4):
+            rl.acquire()
 
-    rl = _RateLimiter(max_calls=1, window_secs=60)
-    rl.acquire()
+    # two calls back to back, then one every 60 / (5 - 2) seconds
+    assert fakeclock['sleeps'] == [pytest.approx(20.0), pytest.approx(20.0)]
 
-    calls = json.loads(ratelimit_files.read_text())
-    assert calls == [fixed_now]
 
+def test_ratelimiter_idle_bucket_refills(ratelimit_files, fakeclock, bareapp):
+    rl = _RateLimiter(max_calls=5, window_secs=60, burst=2, reserved_burst=0)
+    with bareapp.app_context():
+        rl.acquire()
+        rl.acquire()
+        fakeclock['now'] += 1000
+        rl.acquire()
+        rl.acquire()
+    assert fakeclock['sleeps'] == []
 
-def test_ratelimiter_throttles_when_over_budget(ratelimit_files, monkeypatch, bareapp):
-    fixed_now = 1_000_000.0
-    monkeypatch.setattr(community.time, 'time', lambda: fixed_now)
-    sleeps = []
-    monkeypatch.setattr(community.time, 'sleep', lambda secs: sleeps.append(secs))
-    # two calls already recorded, well within the 60s window
-    ratelimit_files.write_text(json.dumps([fixed_now - 10, fixed_now - 5]))
 
-    rl = _RateLimiter(max_calls=2, window_secs=60)
+def test_ratelimiter_never_exceeds_max_calls_per_window(ratelimit_files, fakeclock, bareapp):
+    rl = _RateLimiter(max_calls=10, window_secs=60, burst=4, reserved_burst=0)
+    calls = []
     with bareapp.app_context():
+        for i in range(50):
+            rl.acquire()
+            calls.append(fakeclock['now'])
+            # callers arrive at irregular times
+            fakeclock['now'] += (i % 7) * 0.9
+
+    for i, t in enumerate(calls):
+        assert len([c for c in calls[i:] if c - t < 60]) <= 10
+
+
+def test_ratelimiter_reserves_from_concurrent_threads(ratelimit_files, fakeclock, bareapp):
+    # interactive, which reserves however far ahead, so every reservation lands
+    rl = _RateLimiter(max_calls=10, window_secs=60, burst=4, priority='interactive')
+    def reserve():
+        for i in range(50):
+            rl._reserve()
+    threads = [threading.Thread(target=reserve) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # every reservation advanced the schedule, none were lost
+    tat, = community._RATE_LIMIT_STATE.unpack(ratelimit_files.read_bytes())
+    assert tat == pytest.approx(fakeclock['now'] + 400 * rl.interval)
+
+
+def test_ratelimiter_sleeps_without_holding_lock(ratelimit_files, fakeclock, bareapp, monkeypatch):
+    rl = _RateLimiter(max_calls=2, window_secs=60, burst=1, reserved_burst=0)
+    lockfree = []
+    def sleep(secs):
+        # fcntl locks are per process, so another process has to try the lock
+        probe = ('import sys, fasteners; lock = fasteners.InterProcessLock(sys.argv[1]); '
+                 'sys.exit(0 if lock.acquire(blocking=False) else 1)')
+        lockfree.append(subprocess.run([sys.executable, '-c', probe, community._RATE_LIMIT_STATE_LOCKFILE]).returncode == 0)
+        fakeclock['now'] += secs
+    monkeypatch.setattr(community.time, 'sleep', sleep)
+
+    with bareapp.app_context():
+        rl.acquire()
         rl.acquire()
+    assert lockfree == [True]
+
 
-    assert len(sleeps) == 1
-    assert sleeps[0] == pytest.approx(50.0)
+def test_ratelimiter_reservations_shared_across_instances(ratelimit_files, fakeclock, bareapp):
+    '''separate limiters (separate processes) draw from the same bucket'''
+    with bareapp.app_context():
+        _RateLimiter(max_calls=3, window_secs=60, burst=1, reserved_burst=0).acquire()
+        _RateLimiter(max_calls=3, window_secs=60, burst=1, reserved_burst=0).acquire()
+    assert fakeclock['sleeps'] == [pytest.approx(30.0)]
+
+
+def _acquireat(rl, clock, at):
+    '''acquire at time at, returning when the call was allowed'''
+    clock['now'] = max(clock['now'], at)
+    rl.acquire()
+    return clock['now']
+
+
+def test_ratelimiter_interactive_burst_held_back(ratelimit_files, fakeclock, bareapp):
+    # burst 4, of which 2 are held back for interactive callers
+    args = dict(max_calls=10, window_secs=60, burst=4, reserved_burst=2)
+    scheduled = _RateLimiter(priority='scheduled', **args)
+    interactive = _RateLimiter(priority='interactive', **args)
+    with bareapp.app_context():
+        # a long sync has the bucket backed up
+        for i in range(6):
+            scheduled.acquire()
+        backlog = fakeclock['now']
+        # interactive calls go right away from the held back burst
+        fakeclock['now'] = backlog
+        assert _acquireat(interactive, fakeclock, backlog) == backlog
+        assert _acquireat(interactive, fakeclock, backlog) == backlog
+
+
+def test_ratelimiter_interactive_uses_whole_burst(ratelimit_files, fakeclock, bareapp):
+    args = dict(max_calls=10, window_secs=60, burst=4, reserved_burst=2)
+    interactive = _RateLimiter(priority='interactive', **args)
+    with bareapp.app_context():
+        # the held back calls as well as the rest of the burst
+        for i in range(4):
+            interactive.acquire()
+    assert fakeclock['sleeps'] == []
+
+
+def test_ratelimiter_bulk_yields(ratelimit_files, fakeclock, bareapp, monkeypatch):
+    args = dict(max_calls=10, window_secs=60, burst=1, reserved_burst=0)
+    bulk = _RateLimiter(priority='bulk', **args)
+    scheduled = _RateLimiter(priority='scheduled', **args)
+    order = []
+    def sleep(secs):
+        # a scheduled caller arrives while bulk is waiting, and takes the slot
+        if not order:
+            order.append('scheduled')
+            scheduled.acquire()
+        fakeclock['now'] += secs
+    with bareapp.app_context():
+        bulk.acquire()
+        monkeypatch.setattr(community.time, 'sleep', sleep)
+        bulk.acquire()
+    order.append('bulk')
+
+    assert order == ['scheduled', 'bulk']
+    # bulk waited for its own slot after the scheduled caller's
+    assert fakeclock['now'] == pytest.approx(1_000_000.0 + 2 * 60 / 9)
+
+
+def test_ratelimiter_priorities_never_exceed_max_calls(ratelimit_files, fakeclock, bareapp):
+    args = dict(max_calls=12, window_secs=60, burst=5, reserved_burst=2)
+    limiters = [_RateLimiter(priority=p, **args) for p in ['interactive', 'scheduled', 'bulk']]
+    calls = []
+    with bareapp.app_context():
+        for i in range(60):
+            limiters[i % 3].acquire()
+            calls.append(fakeclock['now'])
+            fakeclock['now'] += (i % 5) * 0.7
+
+    for i, t in enumerate(calls):
+        assert len([c for c in calls[i:] if c - t < 60]) <= 12
+
+
+def test_ratelimiter_bulk_alongside_interactive(ratelimit_files, fakeclock, bareapp, monkeypatch):
+    args = dict(max_calls=12, window_secs=60, burst=5, reserved_burst=2)
+    bulk = _RateLimiter(priority='bulk', **args)
+    interactive = _RateLimiter(priority='interactive', **args)
+    calls = {'bulk': [], 'interactive': []}
+    waits = []
+    nextinteractive = [fakeclock['now']]
+    def sleep(secs):
+        # interactive callers arrive every 20 seconds while bulk is waiting
+        until = fakeclock['now'] + secs
+        while nextinteractive[0] <= until:
+            fakeclock['now'] = max(fakeclock['now'], nextinteractive[0])
+            wait, reserved = interactive._reserve()
+            assert reserved
+            waits.append(wait)
+            calls['interactive'].append(fakeclock['now'] + wait)
+            nextinteractive[0] += 20
+        fakeclock['now'] = max(fakeclock['now'], until)
+    monkeypatch.setattr(community.time, 'sleep', sleep)
+    with bareapp.app_context():
+        while fakeclock['now'] < 1_000_000.0 + 600:
+            bulk.acquire()
+            calls['bulk'].append(fakeclock['now'])
+
+    # interactive calls never waited behind bulk
+    assert max(waits) == 0
+    # bulk used everything the interactive calls left, nothing was held idle
+    assert len(calls['bulk']) + len(calls['interactive']) >= 600 / bulk.interval
+    allcalls = sorted(calls['bulk'] + calls['interactive'])
+    for i, t in enumerate(allcalls):
+        assert len([c for c in allcalls[i:] if c - t < 60]) <= 12
+
+
+def test_ratelimiter_unknown_priority():
+    with pytest.raises(ValueError):
+        _RateLimiter(max_calls=55, window_secs=60, priority='urgent')
 
 
 # ----------------------------------------------------------------------
@@ -134,6 +309,16 @@ def test_make_discourse_client_returns_rate_limited_wrapper(bareapp):
     assert isinstance(client, _RateLimitedDiscourse)
 
 
+def test_make_discourse_client_priority(bareapp):
+    bareapp.config['DISCOURSE_API_URL_FSRC'] = 'https://community.example.com'
+    bareapp.config['DISCOURSE_API_INVITE_USERNAME_FSRC'] = 'admin'
+    bareapp.config['DISCOURSE_API_KEY_FSRC'] = 'key123'
+    with bareapp.app_context():
+        assert object.__getattribute__(make_discourse_client('fsrc'), '_rl').priority == 'scheduled'
+        client = make_discourse_client('fsrc', priority='interactive')
+    assert object.__getattribute__(client, '_rl').priority == 'interactive'
+
+
 def test_make_discourse_client_missing_config_raises_value_error(bareapp):
     with bareapp.app_context():
         with pytest.raises(ValueError):
@@ -173,6 +358,424 @@ def test_run_query_paged_empty_first_page_returns_empty(bareapp):
     assert rows == []
 
 
+def _pagedquery(pages, pagesfetched=None):
+    """query run response serving pages of rows, recording each page_num requested"""
+    def run(body):
+        page_num = int(body['params']['page_num'])
+        if pagesfetched is not None:
+            pagesfetched.append(page_num)
+        rows = pages[page_num] if page_num < len(pages) else []
+        return {'columns': ['id', 'name'], 'rows': rows, 'result_count': len(rows)}
+    return run
+
+
+def test_iter_query_paged_rowtypes(bareapp):
+    discourse = FakeDiscourse({'admin.plugins.explorer.queries.9.run':
+                               _pagedquery([[[1, 'a'], [2, 'b']], [[3, 'c']]])})
+    with bareapp.app_context():
+        assert list(iter_query_paged(discourse, 9, page_size=2)) == [
+            {'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, {'id': 3, 'name': 'c'}]
+        assert list(iter_query_paged(discourse, 9, page_size=2, rowtype='list')) == [[1, 'a'], [2, 'b'], [3, 'c']]
+        rows = list(iter_query_paged(discourse, 9, page_size=2, rowtype='namedtuple'))
+    assert [(r.id, r.name) for r in rows] == [(1, 'a'), (2, 'b'), (3, 'c')]
+
+    with bareapp.app_context(), pytest.raises(ValueError):
+        list(iter_query_paged(discourse, 9, rowtype='set'))
+
+
+def test_iter_query_paged_fetches_pages_as_consumed(bareapp):
+    pagesfetched = []
+    discourse = FakeDiscourse({'admin.plugins.explorer.queries.9.run':
+                               _pagedquery([[[1, 'a'], [2, 'b']], [[3, 'c'], [4, 'd']], [[5, 'e']]], pagesfetched)})
+    with bareapp.app_context():
+        rows = iter_query_paged(discourse, 9, page_size=2)
+        assert next(rows)['id'] == 1
+        assert pagesfetched == [0]
+        assert next(rows)['id'] == 2
+        assert next(rows)['id'] == 3
+        assert pagesfetched == [0, 1]
+        assert [r['id'] for r in rows] == [4, 5]
+    assert pagesfetched == [0, 1, 2]
+
+
+def test_iter_query_paged_prefetches_next_page(bareapp):
+    pagesfetched = []
+    pages = [[[1, 'a'], [2, 'b']], [[3, 'c'], [4, 'd']], [[5, 'e']]]
+    discourse = FakeDiscourse({'admin.plugins.explorer.queries.9.run': _pagedquery(pages, pagesfetched)})
+    with bareapp.app_context():
+        rows = iter_query_paged(discourse, 9, page_size=2, prefetch=True)
+        assert next(rows)['id'] == 1
+        # wait for the prefetch to finish
+        for i in range(100):
+            if pagesfetched == [0, 1]:
+                break
+            time.sleep(0.01)
+        assert pagesfetched == [0, 1]
+        assert [r['id'] for r in rows] == [2, 3, 4, 5]
+    # a short page is the last, so nothing is fetched past it
+    assert pagesfetched == [0, 1, 2]
+
+    # full last page is followed by an empty one
+    pagesfetched.clear()
+    with bareapp.app_context():
+        assert [r['id'] for r in iter_query_paged(discourse, 9, page_size=2, prefetch=True)] == [1, 2, 3, 4, 5]
+        pages.pop()
+        assert [r['id'] for r in iter_query_paged(discourse, 9, page_size=2, prefetch=True)] == [1, 2, 3, 4]
+
+
+def test_iter_query_paged_abandoned_with_prefetch(bareapp):
+    pagesfetched = []
+    discourse = FakeDiscourse({'admin.plugins.explorer.queries.9.run':
+                               _pagedquery([[[1, 'a'], [2, 'b']], [[3, 'c'], [4, 'd']], [[5, 'e']]], pagesfetched)})
+    with bareapp.app_context():
+        rows = iter_query_paged(discourse, 9, page_size=2, prefetch=True)
+        assert next(rows)['id'] == 1
+        rows.close()
+    # the prefetch is cancelled or waited for, and nothing after it fetched
+    assert pagesfetched in ([0], [0, 1])
+
+
+# ----------------------------------------------------------------------
+# fetch_rsu_pages / Rsu*SyncManager
+# ----------------------------------------------------------------------
+
+class _FakeRsuResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(json.dumps(self.payload))
+
+
+class _FakeRsu:
+    '''fluent RunSignUp chain; handler(path, params) gives the json payload for get()'''
+    def __init__(self, handler, path=(), params=None):
+        self._handler = handler
+        self._path = path
+        self._params = params or {}
+
+    def __getattr__(self, name):
+        return _FakeRsu(self._handler, self._path + (name,), self._params)
+
+    def _(self, segment):
+        return _FakeRsu(self._handler, self._path + (str(segment),), self._params)
+
+    def params(self, params):
+        return _FakeRsu(self._handler, self._path, {**self._params, **params})
+
+    def get(self):
+        return _FakeRsuResponse(self._handler('.'.join(self._path), self._params))
+
+
+def _rsurecord(id, email, page):
+    '''club membership / race registration record'''
+    return {'membership_id': id, 'registration_id': id, 'membership_start': '2020-01-01',
+            'membership_end': '2999-12-31', 'last_modified': '2026-01-01 00:00:00',
+            'user': {'user_id': id, 'email': email, 'page': page}}
+
+
+def _rsupages(npages, pagesize=3):
+    '''pages of users, with a duplicate email across pages (later page wins)'''
+    pages = {}
+    for page in range(1, npages + 1):
+        pages[page] = [_rsurecord(page * 100 + i, f'User{page}-{i}@example.com', page) for i in range(pagesize)]
+    if npages > 1:
+        pages[npages].append(_rsurecord(99999, 'user1-0@example.com', npages))
+    return pages
+
+
+def _serial_users(pages):
+    users = {}
+    for page in sorted(pages):
+        for u in pages[page]:
+            users[u['user']['email'].lower()] = u
+    return users
+
+
+def test_fetch_rsu_pages_yields_pages_in_order(bareapp):
+    pages = _rsupages(10)
+    requested = []
+    lock = threading.Lock()
+    def getpage(page):
+        with lock:
+            requested.append(page)
+        return pages.get(page, [])
+
+    with bareapp.app_context():
+        fetched = list(fetch_rsu_pages(getpage, concurrency=4))
+
+    assert fetched == [(page, pages[page]) for page in range(1, 11)]
+    # empty page 11 ends the fetch, at most concurrency-1 more requested after it
+    assert 11 in requested
+    assert max(requested) <= 14
+
+
+def test_fetch_rsu_pages_empty_first_page(bareapp):
+    requested = []
+    with bareapp.app_context():
+        assert list(fetch_rsu_pages(lambda page: requested.append(page) or [], concurrency=4)) == []
+    assert requested == [1]
+
+
+def test_fetch_rsu_pages_retries_with_backoff(bareapp, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(community.time, 'sleep', sleeps.append)
+    failures = {2: 2}
+    def getpage(page):
+        if failures.get(page):
+            failures[page] -= 1
+            raise community.RequestException('connection reset')
+        return [page] if page <= 3 else []
+
+    with bareapp.app_context():
+        assert [items for page, items in fetch_rsu_pages(getpage, concurrency=2, backoff_secs=0.5)] == [[1], [2], [3]]
+    assert sorted(sleeps) == [0.5, 1.0]
+
+
+def test_fetch_rsu_pages_gives_up_after_retries(bareapp, monkeypatch):
+    monkeypatch.setattr(community.time, 'sleep', lambda secs: None)
+    def getpage(page):
+        if page == 3:
+            raise ValueError('bad json')
+        return [page]
+
+    with bareapp.app_context():
+        with pytest.raises(ValueError):
+            list(fetch_rsu_pages(getpage, concurrency=3, retries=2))
+
+
+@pytest.fixture
+def rsuconfig(bareapp, tmp_path):
+    bareapp.config['RSU_PAGE_FETCH_CONCURRENCY'] = 3
+    bareapp.config['APP_FILE_FOLDER'] = str(tmp_path)
+    return bareapp
+
+
+def test_rsuclubsyncmanager_matches_serial_fetch(rsuconfig, monkeypatch):
+    pages = _rsupages(7)
+    def handler(path, params):
+        assert path == 'club.42.members' and params['current_members_only'] == 'T'
+        return {'club_members': pages.get(params['page'], [])}
+    monkeypatch.setattr(community, 'make_runsignup_fluent_client', lambda: _FakeRsu(handler))
+
+    with rsuconfig.app_context():
+        users = RsuClubSyncManager(42).get_users_from_service()
+
+    assert users == _serial_users(pages)
+    assert list(users) == list(_serial_users(pages))
+    assert users['user1-0@example.com']['user']['page'] == 7
+
+
+def test_rsuracesyncmanager_matches_serial_fetch(rsuconfig, monkeypatch):
+    pages = _rsupages(5)
+    def handler(path, params):
+        if path == 'race.7':
+            return {'race': {'events': [{'event_id': 99}]}}
+        assert path == 'race.7.participants' and params['event_id'] == 99
+        return [{'participants': pages.get(params['page'], [])}]
+    monkeypatch.setattr(community, 'make_runsignup_fluent_client', lambda: _FakeRsu(handler))
+
+    with rsuconfig.app_context():
+        users = RsuRaceSyncManager(7).get_users_from_service()
+
+    assert list(users.items()) == list(_serial_users(pages).items())
+
+
+def test_rsuclubsyncmanager_shares_snapshot(rsuconfig, monkeypatch):
+    pages = _rsupages(2)
+    pages[2].append(dict(_rsurecord(500, 'expired@example.com', 2), membership_end='2021-12-31'))
+    requested = []
+    def handler(path, params):
+        requested.append(params['page'])
+        return {'club_members': pages.get(params['page'], [])}
+    monkeypatch.setattr(community, 'make_runsignup_fluent_client', lambda: _FakeRsu(handler))
+
+    with rsuconfig.app_context():
+        users = RsuClubSyncManager(42).get_users_from_service()
+        fetches = len(requested)
+        # second job within RSU_SNAPSHOT_MAX_AGE_SECS uses the first job's snapshot
+        assert RsuClubSyncManager(42).get_users_from_service() == users
+
+    assert len(requested) == fetches
+    assert 'expired@example.com' not in users
+    assert len(users) == 6
+
+
+# ----------------------------------------------------------------------
+# RsuSnapshot
+# ----------------------------------------------------------------------
+
+class _Roster:
+    '''RunSignUp roster supporting modified_after_timestamp'''
+    def __init__(self, records):
+        self.records = records
+        self.requests = []
+
+    def getpage(self, page, params):
+        self.requests.append(dict(params, page=page))
+        records = self.records
+        if 'modified_after_timestamp' in params:
+            since = datetime.fromtimestamp(params['modified_after_timestamp']).strftime('%Y-%m-%d %H:%M:%S')
+            records = [r for r in records if r['last_modified'] > since]
+        return json.loads(json.dumps(records[(page - 1) * 2:page * 2]))
+
+
+def _rosterrecord(id, last_modified, email=None):
+    return {'membership_id': id, 'last_modified': last_modified, 'user': {'email': email or f'{id}@example.com'}}
+
+
+def _rosterkey(record):
+    return str(record['membership_id'])
+
+
+@pytest.fixture
+def snapshotclock(rsuconfig, monkeypatch):
+    '''controllable time.time() for snapshot aging'''
+    clock = {'now': 1000000.0}
+    monkeypatch.setattr(community.time, 'time', lambda: clock['now'])
+    rsuconfig.config['RSU_SNAPSHOT_OVERLAP_HOURS'] = 1
+    return clock
+
+
+def test_rsusnapshot_incremental_refresh(rsuconfig, snapshotclock):
+    roster = _Roster([_rosterrecord(1, '2026-01-01 00:00:00'), _rosterrecord(2, '2026-01-02 00:00:00'),
+                      _rosterrecord(3, '2026-01-03 00:00:00')])
+
+    with rsuconfig.app_context():
+        snapshot = RsuSnapshot('club-1', roster.getpage, _rosterkey)
+        assert list(snapshot.records()) == ['1', '2', '3']
+        assert snapshot.changes == RsuSnapshotChanges(['1', '2', '3'], [], [])
+
+        # record 2 changed, 4 added, record 1 deleted but incremental refresh can't see that
+        roster.records = [_rosterrecord(2, '2026-01-05 00:00:00', 'new@example.com'),
+                          _rosterrecord(3, '2026-01-03 00:00:00'), _rosterrecord(4, '2026-01-05 00:00:00')]
+        snapshotclock['now'] += community.RSU_SNAPSHOT_MAX_AGE_SECS
+        roster.requests.clear()
+        records = snapshot.records()
+
+    since = datetime(2026, 1, 2, 23, 0, 0).timestamp()
+    assert all(r['modified_after_timestamp'] == since for r in roster.requests)
+    assert snapshot.changes == RsuSnapshotChanges(['4'], ['2'], [])
+    assert list(records) == ['1', '2', '3', '4']
+    assert records['2']['user']['email'] == 'new@example.com'
+
+
+def test_rsusnapshot_fresh_snapshot_not_refreshed(rsuconfig, snapshotclock):
+    roster = _Roster([_rosterrecord(1, '2026-01-01 00:00:00')])
+
+    with rsuconfig.app_context():
+        first = RsuSnapshot('club-1', roster.getpage, _rosterkey).records()
+        roster.requests.clear()
+        snapshotclock['now'] += community.RSU_SNAPSHOT_MAX_AGE_SECS - 1
+        snapshot = RsuSnapshot('club-1', roster.getpage, _rosterkey)
+        assert snapshot.records() == first
+
+    assert roster.requests == []
+    assert snapshot.changes is None
+
+
+def test_rsusnapshot_full_refresh_finds_removed(rsuconfig, snapshotclock):
+    roster = _Roster([_rosterrecord(1, '2026-01-01 00:00:00'), _rosterrecord(2, '2026-01-02 00:00:00')])
+
+    with rsuconfig.app_context():
+        snapshot = RsuSnapshot('club-1', roster.getpage, _rosterkey)
+        snapshot.records()
+        roster.records = roster.records[1:]
+        snapshotclock['now'] += community.RSU_SNAPSHOT_FULL_REFRESH_SECS
+        roster.requests.clear()
+        records = snapshot.records()
+
+    assert all('modified_after_timestamp' not in r for r in roster.requests)
+    assert snapshot.changes == RsuSnapshotChanges([], [], ['1'])
+    assert list(records) == ['2']
+
+
+def test_rsusnapshot_forced_full_refresh(rsuconfig, snapshotclock):
+    roster = _Roster([_rosterrecord(1, '2026-01-01 00:00:00'), _rosterrecord(2, '2026-01-02 00:00:00')])
+
+    with rsuconfig.app_context():
+        snapshot = RsuSnapshot('club-1', roster.getpage, _rosterkey)
+        snapshot.records()
+        roster.records = roster.records[1:]
+        roster.requests.clear()
+        # fresh snapshot, but refreshed anyway
+        records = snapshot.records(fullrefresh=True)
+
+    assert roster.requests and all('modified_after_timestamp' not in r for r in roster.requests)
+    assert list(records) == ['2']
+
+
+def test_rsusnapshot_ignores_other_version(rsuconfig, snapshotclock):
+    roster = _Roster([_rosterrecord(1, '2026-01-01 00:00:00')])
+
+    with rsuconfig.app_context():
+        snapshot = RsuSnapshot('club-1', roster.getpage, _rosterkey)
+        snapshot.records()
+        with open(snapshot.path) as f:
+            old = json.load(f)
+        old['version'] = 1
+        with open(snapshot.path, 'w') as f:
+            json.dump(old, f)
+        roster.requests.clear()
+        snapshot.records()
+
+    assert roster.requests and all('modified_after_timestamp' not in r for r in roster.requests)
+    assert snapshot.changes == RsuSnapshotChanges(['1'], [], [])
+
+
+def test_rsu_club_snapshot_keeps_shared_membership(rsuconfig):
+    # family membership, two people with the same membership_id
+    family = [dict(_rsurecord(7, 'parent@example.com', 1), user={'user_id': 70, 'email': 'parent@example.com'}),
+              dict(_rsurecord(7, 'child@example.com', 1), user={'user_id': 71, 'email': 'child@example.com'})]
+    def handler(path, params):
+        return {'club_members': family if params['page'] == 1 else []}
+
+    with rsuconfig.app_context():
+        records = community.rsu_club_snapshot(_FakeRsu(handler), 42).records()
+
+    assert sorted(r['user']['email'] for r in records.values()) == ['child@example.com', 'parent@example.com']
+
+
+def test_rsu_club_snapshot_current_members_only_when_full(rsuconfig, snapshotclock):
+    requested = []
+    def handler(path, params):
+        requested.append(params)
+        return {'club_members': [_rsurecord(1, 'a@example.com', 1)] if params['page'] == 1 else []}
+
+    with rsuconfig.app_context():
+        snapshot = community.rsu_club_snapshot(_FakeRsu(handler), 42)
+        snapshot.records()
+        full = requested[:]
+        requested.clear()
+        snapshotclock['now'] += community.RSU_SNAPSHOT_MAX_AGE_SECS
+        snapshot.records()
+
+    # full refresh, then incremental which also sees memberships which just expired
+    assert {(p['current_members_only'], 'modified_after_timestamp' in p) for p in full} == {('T', False)}
+    assert {(p['current_members_only'], 'modified_after_timestamp' in p) for p in requested} == {('F', True)}
+
+
+def test_rsusnapshot_drops_deleted_and_refunded(rsuconfig, snapshotclock):
+    roster = _Roster([_rosterrecord(1, '2026-01-01 00:00:00'), _rosterrecord(2, '2026-01-02 00:00:00'),
+                      dict(_rosterrecord(3, '2026-01-02 00:00:00'), status='Deleted')])
+
+    with rsuconfig.app_context():
+        snapshot = RsuSnapshot('race-1', roster.getpage, _rosterkey)
+        assert list(snapshot.records()) == ['1', '2']
+
+        # registration 2 refunded, seen by the incremental refresh
+        roster.records = [_rosterrecord(1, '2026-01-01 00:00:00'),
+                          dict(_rosterrecord(2, '2026-01-03 00:00:00'), status='refunded')]
+        snapshotclock['now'] += community.RSU_SNAPSHOT_MAX_AGE_SECS
+        records = snapshot.records()
+
+    assert snapshot.changes == RsuSnapshotChanges([], [], ['2'])
+    assert list(records) == ['1']
+
+
 # ----------------------------------------------------------------------
 # DbTagCommunitySyncManager / CommunitySyncManager, end to end via import_group()
 # ----------------------------------------------------------------------
@@ -198,7 +801,8 @@ def tagsyncsetup(bare_dbapp):
 
 
 @pytest.fixture
-def discourse_config(bareapp):
+def discourse_config(bareapp, monkeypatch, tmp_path):
+    monkeypatch.setattr(community, '_LOCKS_DIR', tmp_path)
     bareapp.config['DISCOURSE_API_INVITES_QUERY_FSRC'] = 10
     bareapp.config['DISCOURSE_API_INVITE_GROUPS_QUERY_FSRC'] = 11
     bareapp.config['DISCOURSE_API_USER_EMAIL_QUERY_FSRC'] = 12
@@ -272,6 +876,63 @@ def test_communitysyncmanager_import_group_adds_and_removes_members(tagsyncsetup
     assert invite_posts[0]['group_ids'] == 7
 
 
+def test_communitysyncmanager_plan_only_makes_no_changes(tagsyncsetup, discourse_config, monkeypatch, tmp_path):
+    responses = {
+        'admin.users.json': lambda params: [{'id': 42, 'username': 'bob'}] if params['page'] == 1 else [],
+        'groups.json': lambda params: {'groups': [{'id': 7, 'name': 'my-group'}]},
+        'groups.my-group.members.json': lambda params: {'members': [], 'meta': {'total': 0, 'limit': 50}},
+        'admin.plugins.explorer.queries.10.run': lambda body: {'columns': [], 'rows': [], 'result_count': 0},
+        'admin.plugins.explorer.queries.11.run': lambda body: {'columns': [], 'rows': [], 'result_count': 0},
+        'admin.plugins.explorer.queries.12.run': lambda body: {'columns': ['email', 'user_id'],
+                                                               'rows': [['bob@example.com', 42]], 'result_count': 1},
+    }
+    fake = FakeDiscourse(responses)
+    monkeypatch.setattr(community, 'make_discourse_client', lambda interest: fake)
+    monkeypatch.setattr(community, 'COMMUNITY_LOCKFILE', str(tmp_path / 'lock'))
+
+    mgr = DbTagCommunitySyncManager('fsrc', 'board', 'my-group', skipemail=True)
+    plan = mgr.import_group(planonly=True)
+
+    assert sorted(plan.asdict()['add'], key=str) == [42, 'alice@example.com']
+    assert [c for c in fake._calls if c[1] != 'get' and not c[0].startswith('admin.plugins.explorer')] == []
+    # lock released
+    assert mgr.lock.acquire(blocking=False)
+    mgr.lock.release()
+
+
+def test_communitysyncmanager_groups_share_snapshot(tagsyncsetup, discourse_config, monkeypatch, tmp_path):
+    '''two groups synced against one DiscourseSnapshot: the directory and invite queries run
+    once, and the invite created for alice by the first group is updated by the second'''
+    responses = {
+        'admin.users.json': lambda params: [{'id': 42, 'username': 'bob'}] if params['page'] == 1 else [],
+        'groups.json': lambda params: {'groups': [{'id': 7, 'name': 'group-a'}, {'id': 8, 'name': 'group-b'}]} if params['page'] == 0 else {'groups': []},
+        'groups.group-a.members.json': lambda params: {'members': [], 'meta': {'total': 0, 'limit': 50}},
+        'groups.group-b.members.json': lambda params: {'members': [{'id': 42}], 'meta': {'total': 1, 'limit': 50}},
+        'admin.plugins.explorer.queries.10.run': lambda body: {'columns': [], 'rows': [], 'result_count': 0},
+        'admin.plugins.explorer.queries.11.run': lambda body: {'columns': [], 'rows': [], 'result_count': 0},
+        'admin.plugins.explorer.queries.12.run': lambda body: {'columns': ['email', 'user_id'],
+                                                               'rows': [['bob@example.com', 42]], 'result_count': 1},
+        'invites.json': lambda body: {'id': 500, 'email': body['email']},
+        'invites.500': lambda body: {},
+        ('groups.7.members.json', 'put'): lambda body: {},
+    }
+    fake = FakeDiscourse(responses)
+    monkeypatch.setattr(community, 'make_discourse_client', lambda interest: fake)
+    monkeypatch.setattr(community, 'COMMUNITY_LOCKFILE', str(tmp_path / 'lock'))
+
+    snapshot = DiscourseSnapshot(fake, 'fsrc').load()
+    for groupname in ['group-a', 'group-b']:
+        DbTagCommunitySyncManager('fsrc', 'board', groupname, skipemail=True, snapshot=snapshot).import_group()
+
+    paths = [c[0] for c in fake._calls]
+    assert paths.count('admin.users.json') == 2
+    assert paths.count('admin.plugins.explorer.queries.12.run') == 1
+    assert paths.count('groups.json') == 1
+    # alice invited once, for group-a, then group-b was added to that invite
+    assert [c[2]['email'] for c in fake._calls if c[0] == 'invites.json' and c[1] == 'post'] == ['alice@example.com']
+    assert [c[2]['group_ids'] for c in fake._calls if c[0] == 'invites.500'] == ['7,8']
+
+
 def test_communitysyncmanager_start_import_filters_invites(tagsyncsetup, discourse_config, monkeypatch, tmp_path):
     '''start_import() should only keep invites that are active (not deleted/invalidated),
     unredeemed, and targeted to a specific email -- the filter documented in community.py'''
@@ -293,6 +954,8 @@ def test_communitysyncmanager_start_import_filters_invites(tagsyncsetup, discour
         'admin.plugins.explorer.queries.10.run': invites_query,
         'admin.plugins.explorer.queries.11.run': lambda body: {'columns': ['invite_id', 'group_id'],
                                                                 'rows': [], 'result_count': 0},
+        'admin.plugins.explorer.queries.12.run': lambda body: {'columns': ['email', 'user_id'],
+                                                                'rows': [], 'result_count': 0},
     }
     fake = FakeDiscourse(responses)
     monkeypatch.setattr(community, 'make_discourse_client', lambda interest: fake)
@@ -303,3 +966,207 @@ def test_communitysyncmanager_start_import_filters_invites(tagsyncsetup, discour
     mgr.lock.release()
 
     assert set(mgr.invites.keys()) == {'keep@example.com'}
+
+
+def test_syncmany_recreates_invite_deleted_by_earlier_group(tagsyncsetup, discourse_config, monkeypatch, tmp_path):
+    '''syncmany: dave's invite is only for group-a, and he's not on the board, so group-a's sync
+    deletes the invite; group-b (officers, including dave) must then create a new invite, not
+    update the deleted one'''
+    localinterest = tagsyncsetup['localinterest']
+    dave = LocalUser(name='Dave', email='dave@example.com', active=True, interest=localinterest)
+    officers = Tag(tag='officers', description='officers', interest=localinterest)
+    officers.users.append(dave)
+    db.session.add_all([dave, officers])
+    db.session.commit()
+
+    responses = {
+        'admin.users.json': lambda params: [{'id': 42, 'username': 'bob'}] if params['page'] == 1 else [],
+        'groups.json': lambda params: {'groups': [{'id': 7, 'name': 'group-a'}, {'id': 8, 'name': 'group-b'}]} if params['page'] == 0 else {'groups': []},
+        'groups.group-a.members.json': lambda params: {'members': [{'id': 42}], 'meta': {'total': 1, 'limit': 50}},
+        'groups.group-b.members.json': lambda params: {'members': [], 'meta': {'total': 0, 'limit': 50}},
+        'admin.plugins.explorer.queries.10.run': lambda body: {
+            'columns': ['id', 'email', 'deleted_at', 'invalidated_at', 'redemption_count'],
+            'rows': [[500, 'dave@example.com', None, None, 0], [501, 'alice@example.com', None, None, 0]],
+            'result_count': 2},
+        'admin.plugins.explorer.queries.11.run': lambda body: {'columns': ['invite_id', 'group_id'],
+                                                                'rows': [[500, 7], [501, 7]], 'result_count': 2},
+        'admin.plugins.explorer.queries.12.run': lambda body: {'columns': ['email', 'user_id'],
+                                                               'rows': [['bob@example.com', 42]], 'result_count': 1},
+        'invites.json': lambda body: {'id': 600, 'email': body['email']},
+        ('invites.json', 'delete'): lambda params: {},
+        'invites.500': lambda body: {},
+    }
+    fake = FakeDiscourse(responses)
+    monkeypatch.setattr(community, 'make_discourse_client', lambda interest, **kwargs: fake)
+    monkeypatch.setattr(community_cli, 'make_discourse_client', lambda interest, **kwargs: fake)
+    monkeypatch.setattr(community_cli, 'COMMUNITY_LOCKFILE', str(tmp_path / 'lock'))
+
+    result = CliRunner().invoke(community_cli.syncmany, ['fsrc', 'tag:board=group-a', 'tag:officers=group-b', '--skipemail'],
+                                catch_exceptions=False)
+    assert result.exit_code == 0
+
+    assert [c[2] for c in fake._calls if c[0] == 'invites.json' and c[1] == 'delete'] == [{'id': 500}]
+    assert [c for c in fake._calls if c[0] == 'invites.500'] == []
+    assert [(c[2]['email'], c[2]['group_ids']) for c in fake._calls if c[0] == 'invites.json' and c[1] == 'post'] == \
+           [('dave@example.com', 8)]
+
+
+# ----------------------------------------------------------------------
+# CommunitySyncManager invite mutations
+# ----------------------------------------------------------------------
+
+def _invitemgr(bareapp, monkeypatch, responses):
+    fake = FakeDiscourse(responses)
+    monkeypatch.setattr(community, 'make_discourse_client', lambda interest: fake)
+    mgr = DbTagCommunitySyncManager('fsrc', 'board', 'my-group', skipemail=True)
+    mgr.snapshot = DiscourseSnapshot(fake, 'fsrc')
+    mgr.communitygroupid = 7
+    return mgr, fake
+
+
+def _createmultiple(ids, emailed_status=0):
+    '''invites/create-multiple response, as Discourse's InvitesController#create_multiple renders it'''
+    def createmultiple(body):
+        good = [e for e in body['email'] if not e.startswith('bad')]
+        bad = [e for e in body['email'] if e.startswith('bad')]
+        return {'num_successfully_created_invitations': len(good), 'num_failed_invitations': len(bad),
+                'successful_invitations': [{'email': e, 'invite': {'id': next(ids), 'invite_key': 'abc',
+                                                                   'emailed_status': emailed_status}}
+                                           for e in good],
+                'failed_invitations': [{'email': e, 'error': 'invalid email'} for e in bad]}
+    return createmultiple
+
+
+def test_run_invite_mutations_bulk_creates(bareapp, monkeypatch):
+    createmultiple = _createmultiple(iter(range(100, 110)))
+    bareapp.config['DISCOURSE_BULK_INVITE_MAX'] = 3
+    emails = ['u0@example.com', 'bad@example.com', 'u1@example.com', 'u2@example.com']
+    with bareapp.app_context():
+        mgr, fake = _invitemgr(bareapp, monkeypatch, {'invites.create-multiple.json': createmultiple})
+        report = mgr.run_invite_mutations([InviteMutation('create', e, None, 7) for e in emails])
+
+    assert [c[2]['email'] for c in fake._calls] == [emails[:3], emails[3:]]
+    assert report == {'created': 3, 'updated': 0, 'deleted': 0,
+                      'errors': [{'action': 'create', 'email': 'bad@example.com', 'error': 'invalid email'}]}
+    assert mgr.snapshot.invites['u0@example.com']['id'] == 100
+    assert mgr.snapshot.invitegroups[100] == [7]
+
+
+def test_run_invite_mutations_bulk_ignoring_skip_email(bareapp, monkeypatch):
+    # invites came back as pending email, so the rest are created one by one
+    ids = iter(range(200, 210))
+    bareapp.config['DISCOURSE_BULK_INVITE_MAX'] = 2
+    emails = [f'u{i}@example.com' for i in range(5)]
+    with bareapp.app_context():
+        mgr, fake = _invitemgr(bareapp, monkeypatch, {'invites.create-multiple.json': _createmultiple(ids, emailed_status=1),
+                                                      'invites.json': lambda body: {'id': next(ids)}})
+        report = mgr.run_invite_mutations([InviteMutation('create', e, None, 7) for e in emails])
+
+    assert [c[2]['email'] for c in fake._calls if c[0] == 'invites.create-multiple.json'] == [emails[:2]]
+    posts = [c[2] for c in fake._calls if c[0] == 'invites.json' and c[1] == 'post']
+    assert sorted(p['email'] for p in posts) == emails[2:]
+    assert all(p['skip_email'] for p in posts)
+    assert report == {'created': 5, 'updated': 0, 'deleted': 0, 'errors': []}
+    assert set(mgr.snapshot.invites) == set(emails)
+
+
+def test_run_invite_mutations_without_bulk_endpoint(bareapp, monkeypatch):
+    def createmultiple(body):
+        raise community.PageNotFoundError('not found')
+    ids = iter(range(300, 310))
+    with bareapp.app_context():
+        mgr, fake = _invitemgr(bareapp, monkeypatch, {'invites.create-multiple.json': createmultiple,
+                                                      'invites.json': lambda body: {'id': next(ids)}})
+        report = mgr.run_invite_mutations([InviteMutation('create', f'u{i}@example.com', None, 7) for i in range(3)])
+
+    posts = [c[2]['email'] for c in fake._calls if c[0] == 'invites.json' and c[1] == 'post']
+    assert sorted(posts) == ['u0@example.com', 'u1@example.com', 'u2@example.com']
+    assert report == {'created': 3, 'updated': 0, 'deleted': 0, 'errors': []}
+    assert set(mgr.snapshot.invites) == set(posts)
+
+
+def test_run_invite_mutations_captures_errors(bareapp, monkeypatch):
+    def update(body):
+        if body['email'] == 'bad@example.com':
+            raise community.DiscourseError('500')
+        return {}
+    bareapp.config['DISCOURSE_INVITE_CONCURRENCY'] = 3
+    with bareapp.app_context():
+        mgr, fake = _invitemgr(bareapp, monkeypatch, {'invites.1': update, 'invites.2': update,
+                                                      ('invites.json', 'delete'): lambda params: {}})
+        for invite_id, email in [(1, 'ok@example.com'), (2, 'bad@example.com'), (3, 'gone@example.com')]:
+            mgr.snapshot.add_invite({'id': invite_id, 'email': email}, [7])
+        report = mgr.run_invite_mutations([
+            InviteMutation('update', 'ok@example.com', 1, '7,8'),
+            InviteMutation('update', 'bad@example.com', 2, '7,8'),
+            InviteMutation('delete', 'gone@example.com', 3, None),
+        ])
+
+    assert (report['updated'], report['deleted']) == (1, 1)
+    assert report['errors'] == [{'action': 'update', 'email': 'bad@example.com', 'error': '500'}]
+    # the snapshot only has the changes which were made
+    assert mgr.snapshot.invitegroups == {1: [7, 8], 2: [7]}
+    assert set(mgr.snapshot.invites) == {'ok@example.com', 'bad@example.com'}
+
+
+# ----------------------------------------------------------------------
+# DiscourseUserDirectory
+# ----------------------------------------------------------------------
+
+@pytest.fixture
+def userdirectory(bareapp, monkeypatch, tmp_path):
+    '''directory over a fake Discourse with users 1, 2; query 20 returns updated users'''
+    monkeypatch.setattr(community, '_LOCKS_DIR', tmp_path)
+    bareapp.config['DISCOURSE_API_USERS_UPDATED_QUERY_FSRC'] = 20
+    state = {'users': [{'id': 1, 'username': 'ann'}, {'id': 2, 'username': 'bob'}], 'updated': []}
+    responses = {
+        'admin.users.json': lambda params: state['users'] if params['page'] == 1 else [],
+        'admin.plugins.explorer.queries.20.run': lambda body: {
+            'columns': ['id', 'username'], 'rows': [[u['id'], u['username']] for u in state['updated']],
+            'result_count': len(state['updated'])},
+    }
+    fake = FakeDiscourse(responses)
+    with bareapp.app_context():
+        yield DiscourseUserDirectory('fsrc', fake), fake, state
+
+
+def test_userdirectory_first_refresh_is_full(userdirectory):
+    directory, fake, state = userdirectory
+    assert directory.users() == {1: {'id': 1, 'username': 'ann'}, 2: {'id': 2, 'username': 'bob'}}
+    assert [c[0] for c in fake._calls] == ['admin.users.json', 'admin.users.json']
+
+
+def test_userdirectory_incremental_refresh(userdirectory):
+    directory, fake, state = userdirectory
+    directory.users()
+    fake._calls.clear()
+
+    state['updated'] = [{'id': 2, 'username': 'bobby'}, {'id': 3, 'username': 'cat'}]
+    users = directory.users()
+
+    assert [c[0] for c in fake._calls] == ['admin.plugins.explorer.queries.20.run']
+    assert 'updated_since' in fake._calls[0][2]['params']
+    assert {userid: u['username'] for userid, u in users.items()} == {1: 'ann', 2: 'bobby', 3: 'cat'}
+
+
+def test_userdirectory_full_refresh_on_demand_and_max_age(userdirectory, monkeypatch):
+    directory, fake, state = userdirectory
+    directory.users()
+    state['users'] = state['users'][1:]
+
+    # deleted user only noticed by a full refresh
+    assert set(directory.users(fullrefresh=True)) == {2}
+
+    fake._calls.clear()
+    current_app.config['DISCOURSE_USER_DIRECTORY_MAX_AGE_SECS'] = 0
+    directory.users()
+    assert fake._calls[0][0] == 'admin.users.json'
+
+
+def test_userdirectory_without_query_always_full(userdirectory):
+    directory, fake, state = userdirectory
+    del current_app.config['DISCOURSE_API_USERS_UPDATED_QUERY_FSRC']
+    directory.users()
+    fake._calls.clear()
+    directory.users()
+    assert fake._calls[0][0] == 'admin.users.json'
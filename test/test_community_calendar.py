@@ -4,17 +4,21 @@ test_community_calendar - test members.community_calendar
 '''
 
 # standard
+import json
 import logging
 from datetime import date, datetime
 from zoneinfo import ZoneInfo
 
 # pypi
 import pytest
+from icalendar import Calendar
 
 # homegrown
+from members import community_calendar
 from members.community_calendar import (
     _tag_names, _parse_event_datetime, _fetch_location, fetch_event_locations,
-    _build_vevent, _fetch_events, filter_tags_to_bytes,
+    _build_vevent, _fetch_events, filter_tags_to_bytes, EventIndex, fetch_event_index,
+    _vevent_bytes, EventLocations,
 )
 from fakediscourse import FakeDiscourse
 
@@ -106,7 +110,7 @@ def test_fetch_event_locations_fallback_uses_per_post_rest_calls():
     assert result == {884: 'Venue A'}
 
 
-# run_query_paged() (community.py) logs via current_app.logger, so anything that
+# iter_query_paged() (community.py) logs via current_app.logger, so anything that
 # reaches it needs a pushed app context even though these tests never touch the db
 
 def test_fetch_event_locations_query_id_joins_post_ids_as_comma_string(bareapp):
@@ -235,6 +239,16 @@ def test_filter_tags_to_bytes_no_tags_includes_all_events():
     assert ics.decode().count('BEGIN:VEVENT') == 2
 
 
+def test_filter_tags_to_bytes_uses_event_index():
+    events = [_event(1, ['grand-prix']), _event(2, ['social'])]
+    discourse = FakeDiscourse({'posts.200.json': {'raw': ''}})
+
+    ics = filter_tags_to_bytes('https://community.steeplechasers.org', discourse, tags=['social'], log=log,
+                               event_index=EventIndex(events))
+    assert ics.decode().count('BEGIN:VEVENT') == 1
+    assert [c[0] for c in discourse._calls] == ['posts.200.json']
+
+
 def test_filter_tags_to_bytes_uses_admin_discourse_for_location_query(bareapp):
     events = [_event(1, ['grand-prix'])]
     calls = []
@@ -253,3 +267,165 @@ def test_filter_tags_to_bytes_uses_admin_discourse_for_location_query(bareapp):
                                    location_query_id=7, admin_discourse=admin_discourse, log=log)
     assert len(calls) == 1
     assert b'LOCATION:Venue' in ics
+
+
+# ----------------------------------------------------------------------
+# EventIndex
+# ----------------------------------------------------------------------
+
+def test_event_index_selects_union_in_event_order():
+    events = [_event(1, ['grand-prix']), _event(2, ['social']), _event(3, ['social', 'grand-prix']), _event(4, [])]
+    index = EventIndex(events)
+    assert index.tags == {'grand-prix': [0, 2], 'social': [1, 2]}
+    assert [e['id'] for e in index.select(['social', 'grand-prix'])] == [1, 2, 3]
+    assert [e['id'] for e in index.select(['social'])] == [2, 3]
+    assert index.select(['unknown']) == []
+    assert index.select(None) == events
+
+
+def test_event_index_roundtrip():
+    index = EventIndex([_event(1, [{'id': 20, 'name': 'grand-prix'}]), _event(2, ['social'])])
+    loaded = EventIndex.fromdict(json.loads(json.dumps(index.asdict())))
+    assert loaded.tags == index.tags
+    assert loaded.select(['grand-prix']) == index.select(['grand-prix'])
+
+
+def test_fetch_event_index_default_window():
+    discourse = FakeDiscourse({'discourse-post-event.events': {'events': [_event(1, ['social'])]}})
+    index = fetch_event_index(discourse, log=log)
+    assert [e['id'] for e in index.select(['social'])] == [1]
+    params = discourse._calls[0][2]
+    assert params['after'] == f'{date.today().year}-01-01T00:00:00'
+    assert params['before'] == f'{date.today().year + 10}-12-31T23:59:59'
+
+
+# ----------------------------------------------------------------------
+# _vevent_bytes
+# ----------------------------------------------------------------------
+
+@pytest.fixture
+def vevent_cache(monkeypatch):
+    monkeypatch.setattr(community_calendar, '_vevent_cache', community_calendar.OrderedDict())
+    built = []
+    build_vevent = community_calendar._build_vevent
+    def counting_build_vevent(event, base_url, location=None):
+        built.append(event['id'])
+        return build_vevent(event, base_url, location=location)
+    monkeypatch.setattr(community_calendar, '_build_vevent', counting_build_vevent)
+    yield built
+
+
+def test_filter_tags_to_bytes_same_as_calendar(vevent_cache):
+    events = [_event(1, ['grand-prix']), _event(2, ['social'], name='Social')]
+    base_url = 'https://community.steeplechasers.org'
+    discourse = FakeDiscourse({'posts.100.json': {'raw': '[event location="Venue A"][/event]'},
+                               'posts.200.json': {'raw': ''}})
+
+    ics = filter_tags_to_bytes(base_url, discourse, log=log, event_index=EventIndex(events))
+
+    cal = Calendar()
+    cal.add('PRODID', '-//FSRC Calendar//EN')
+    cal.add('VERSION', '2.0')
+    cal.add_component(_build_vevent(events[0], base_url, location='Venue A'))
+    cal.add_component(_build_vevent(events[1], base_url))
+    assert ics == cal.to_ical()
+
+
+def test_vevent_bytes_rebuilds_changed_events_only(vevent_cache):
+    base_url = 'https://community.steeplechasers.org'
+    events = [_event(1, ['grand-prix']), _event(2, ['social'])]
+    for event in events:
+        _vevent_bytes(event, base_url)
+    assert vevent_cache == [1, 2]
+
+    moved = dict(events[1], starts_at='2026-03-04T17:30:00-05:00')
+    assert _vevent_bytes(events[0], base_url) == _build_vevent(events[0], base_url).to_ical()
+    _vevent_bytes(moved, base_url)
+    _vevent_bytes(events[0], base_url, location='Venue A')
+    assert vevent_cache == [1, 2, 2, 1]
+
+
+def test_vevent_bytes_cache_bounded(vevent_cache, monkeypatch):
+    monkeypatch.setattr(community_calendar, 'VEVENT_CACHE_MAX_ENTRIES', 2)
+    base_url = 'https://community.steeplechasers.org'
+    for id in [1, 2, 1, 3, 1, 2]:
+        _vevent_bytes(_event(id, []), base_url)
+    # 2 was least recently used when 3 was added
+    assert vevent_cache == [1, 2, 3, 2]
+
+
+# ----------------------------------------------------------------------
+# EventLocations
+# ----------------------------------------------------------------------
+
+def _locationsdiscourse(raws):
+    """FakeDiscourse serving posts.<id>.json from raws, None for an error"""
+    def post(raw):
+        def get(params):
+            if raw is None:
+                raise RuntimeError('boom')
+            return {'raw': raw}
+        return get
+    return FakeDiscourse({f'posts.{id}.json': post(raw) for id, raw in raws.items()})
+
+
+def _fetchedposts(discourse):
+    return [c[0] for c in discourse._calls]
+
+
+def test_event_locations_resolves_new_and_changed_posts_only():
+    events = [_event(1, []), _event(2, []), _event(3, [])]
+    raws = {100: '[event location="Venue A"][/event]', 200: '[event][/event]', 300: None}
+    event_locations = EventLocations()
+
+    discourse = _locationsdiscourse(raws)
+    assert event_locations.resolve(discourse, events, None, log) == {100: 'Venue A'}
+    assert _fetchedposts(discourse) == ['posts.100.json', 'posts.200.json', 'posts.300.json']
+
+    # unchanged posts are remembered, with or without a location, failed ones tried again
+    raws[300] = '[event location="Venue C"][/event]'
+    discourse = _locationsdiscourse(raws)
+    assert event_locations.resolve(discourse, events, None, log) == {100: 'Venue A', 300: 'Venue C'}
+    assert _fetchedposts(discourse) == ['posts.300.json']
+
+    # edited post
+    events[0] = dict(events[0], starts_at='2026-03-04T17:30:00-05:00')
+    raws[100] = '[event location="Venue B"][/event]'
+    discourse = _locationsdiscourse(raws)
+    assert event_locations.resolve(discourse, events, None, log) == {100: 'Venue B', 300: 'Venue C'}
+    assert _fetchedposts(discourse) == ['posts.100.json']
+
+
+def test_event_locations_expire(monkeypatch):
+    events = [_event(1, [])]
+    event_locations = EventLocations()
+    event_locations.resolve(_locationsdiscourse({100: '[event location="Venue A"][/event]'}), events, None, log)
+
+    resolved = event_locations.locations['100'][2]
+    monkeypatch.setattr(community_calendar._time, 'time',
+                        lambda: resolved + community_calendar.EVENT_LOCATION_MAX_AGE_SECS)
+    discourse = _locationsdiscourse({100: '[event location="Venue B"][/event]'})
+    assert event_locations.resolve(discourse, events, None, log) == {100: 'Venue B'}
+
+    event_locations.locations['999'] = ['Gone', '[]', resolved]
+    event_locations.prune()
+    assert list(event_locations.locations) == ['100']
+
+
+def test_event_locations_merge_and_roundtrip():
+    mine = EventLocations({'1': ['A', 'v1', 10.0], '2': ['B', 'v1', 30.0]})
+    theirs = EventLocations({'1': ['A2', 'v2', 20.0], '2': ['B0', 'v0', 5.0], '3': [None, 'v1', 10.0]})
+    mine.merge(theirs)
+    assert mine.locations == {'1': ['A2', 'v2', 20.0], '2': ['B', 'v1', 30.0], '3': [None, 'v1', 10.0]}
+    assert EventLocations.fromdict(json.loads(json.dumps(mine.asdict()))).locations == mine.locations
+
+
+def test_filter_tags_to_bytes_uses_event_locations(vevent_cache):
+    events = [_event(1, ['grand-prix'])]
+    event_locations = EventLocations()
+    discourse = _locationsdiscourse({100: '[event location="Venue A"][/event]'})
+    for i in range(2):
+        ics = filter_tags_to_bytes('https://community.steeplechasers.org', discourse, log=log,
+                                   event_index=EventIndex(events), event_locations=event_locations)
+        assert b'LOCATION:Venue A' in ics
+    assert _fetchedposts(discourse) == ['posts.100.json']
@@ -0,0 +1,264 @@
+'''
+test_community_calendar_views - test members.views.frontend.community_calendar_views
+====================================================================================
+'''
+
+# standard
+import os
+import threading
+import time
+from datetime import date
+
+# pypi
+import pytest
+from flask import g
+
+# homegrown
+from members import community, community_calendar
+from members.views.frontend import community_calendar_views
+from members.community_calendar import EventIndex, EventLocations
+from members.views.frontend.community_calendar_views import IcsCache, EventIndexCache, EventLocationsFile, calendar_feed
+
+
+@pytest.fixture
+def icsapp(bareapp, monkeypatch, tmp_path):
+    monkeypatch.setattr(community, '_LOCKS_DIR', tmp_path)
+    yield bareapp
+
+
+class Builder:
+    '''build function returning numbered feeds, counting calls'''
+    def __init__(self, wait=None):
+        self.calls = 0
+        self.wait = wait
+
+    def __call__(self):
+        self.calls += 1
+        if self.wait:
+            self.wait.wait(5)
+        return f'feed {self.calls}'.encode()
+
+
+def _age(cache, key, secs):
+    '''make a cached feed look built secs ago'''
+    path = cache._path(key)
+    built = time.time() - secs
+    os.utime(path, (built, built))
+
+
+# ----------------------------------------------------------------------
+# IcsCache
+# ----------------------------------------------------------------------
+
+def test_icscache_shared_between_workers(icsapp):
+    build = Builder()
+    with icsapp.app_context():
+        assert IcsCache().get('a', build)[0] == b'feed 1'
+        # another worker's cache sees the same file
+        assert IcsCache().get('a', build)[0] == b'feed 1'
+        assert IcsCache().get('b', build)[0] == b'feed 2'
+    assert build.calls == 2
+
+
+def test_icscache_serves_stale_while_refreshing(icsapp):
+    build = Builder()
+    with icsapp.app_context():
+        cache = IcsCache()
+        cache.get('a', build)
+        _age(cache, 'a', community_calendar_views.ICS_CACHE_TTL + 1)
+
+        ics_bytes, built = cache.get('a', build)
+        assert ics_bytes == b'feed 1'
+        assert time.time() - built > community_calendar_views.ICS_CACHE_TTL
+        cache.refreshthread.join(5)
+
+        ics_bytes, built = cache.get('a', build)
+        assert ics_bytes == b'feed 2'
+        assert time.time() - built < community_calendar_views.ICS_CACHE_TTL
+    assert build.calls == 2
+
+
+def test_icscache_failed_refresh_keeps_stale(icsapp):
+    def build():
+        raise RuntimeError('discourse down')
+    with icsapp.app_context():
+        cache = IcsCache()
+        cache.get('a', Builder())
+        _age(cache, 'a', community_calendar_views.ICS_CACHE_TTL + 1)
+
+        assert cache.get('a', build)[0] == b'feed 1'
+        cache.refreshthread.join(5)
+        assert cache.get('a', Builder())[0] == b'feed 1'
+
+
+def test_icscache_single_flight(icsapp):
+    release = threading.Event()
+    build = Builder(wait=release)
+    results = []
+
+    def get():
+        with icsapp.app_context():
+            results.append(IcsCache().get('a', build)[0])
+
+    threads = [threading.Thread(target=get) for i in range(3)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert results == [b'feed 1'] * 3
+    assert build.calls == 1
+
+
+def test_icscache_evicts_least_recently_served(icsapp, monkeypatch, tmp_path):
+    monkeypatch.setattr(community_calendar_views, 'ICS_CACHE_MAX_ENTRIES', 2)
+    build = Builder()
+    with icsapp.app_context():
+        cache = IcsCache()
+        cache.get('a', build)
+        cache.get('b', build)
+        # a served more recently than b
+        os.utime(cache._path('b'), (time.time() - 10, os.stat(cache._path('b')).st_mtime))
+        cache.get('c', build)
+
+        assert sorted(p.name for p in (tmp_path / 'icscache').glob('*.ics')) == \
+               sorted(cache._path(k).name for k in ['a', 'c'])
+        assert cache.get('a', build)[0] == b'feed 1'
+        assert cache.get('b', build)[0] == b'feed 4'
+
+
+# ----------------------------------------------------------------------
+# calendar_feed
+# ----------------------------------------------------------------------
+
+def test_calendar_feed_cached(icsapp, monkeypatch):
+    icsapp.config['DISCOURSE_API_URL_FSRC'] = 'https://discourse.example.com'
+    monkeypatch.setattr(community_calendar_views, 'make_discourse_client', lambda *args, **kwargs: None)
+    windows = []
+    def fetch_event_index(discourse, from_date, to_date, log=None):
+        windows.append((from_date, to_date))
+        return EventIndex([])
+    monkeypatch.setattr(community_calendar_views, 'fetch_event_index', fetch_event_index)
+    calls = []
+    def filter_tags_to_bytes(**kwargs):
+        calls.append(kwargs)
+        return b'BEGIN:VCALENDAR'
+    monkeypatch.setattr(community_calendar_views, 'filter_tags_to_bytes', filter_tags_to_bytes)
+
+    for query in ['?tags=social,racing', '?tags=racing,social', '?tags=social', '?tags=social&year=2025']:
+        with icsapp.test_request_context(f'/fsrc/calendars/events.ics{query}'):
+            g.interest = 'fsrc'
+            resp = calendar_feed()
+            assert resp.get_data() == b'BEGIN:VCALENDAR'
+
+    assert [c['tags'] for c in calls] == [['social', 'racing'], ['social'], ['social']]
+    # the events are fetched once per window, whatever the tags
+    assert windows == [(None, None), (date(2025, 1, 1), date(2025, 12, 31))]
+
+
+@pytest.fixture
+def feedapp(icsapp, monkeypatch):
+    icsapp.config['DISCOURSE_API_URL_FSRC'] = 'https://discourse.example.com'
+    monkeypatch.setattr(community_calendar_views, 'make_discourse_client', lambda *args, **kwargs: None)
+    monkeypatch.setattr(community_calendar_views, 'fetch_event_index', lambda *args, **kwargs: EventIndex([]))
+    feed = {'ics': b'BEGIN:VCALENDAR'}
+    monkeypatch.setattr(community_calendar_views, 'filter_tags_to_bytes', lambda **kwargs: feed['ics'])
+    yield icsapp, feed
+
+
+def _getfeed(app, headers=None):
+    with app.test_request_context('/fsrc/calendars/events.ics', headers=headers or {}):
+        g.interest = 'fsrc'
+        return calendar_feed()
+
+
+def test_calendar_feed_validators(feedapp):
+    app, feed = feedapp
+    resp = _getfeed(app)
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/calendar'
+    assert resp.headers['Content-Disposition'] == 'attachment; filename=events.ics'
+    etag, is_weak = resp.get_etag()
+    assert etag and not is_weak
+    assert resp.last_modified
+    assert resp.cache_control.public
+    assert 0 < resp.cache_control.max_age <= community_calendar_views.ICS_CACHE_TTL
+
+    resp = _getfeed(app, {'If-None-Match': f'"{etag}"'})
+    assert resp.status_code == 304
+
+    resp = _getfeed(app, {'If-Modified-Since': resp.headers['Last-Modified']})
+    assert resp.status_code == 304
+
+
+def test_calendar_feed_etag_follows_content(feedapp):
+    app, feed = feedapp
+    with app.app_context():
+        cache = IcsCache()
+    first = _getfeed(app)
+    etag = first.get_etag()[0]
+
+    # rebuilt with the same content, etag still matches
+    key = ('fsrc', None, None, None)
+    _age(cache, key, community_calendar_views.ICS_CACHE_TTL + 1)
+    with app.app_context():
+        cache.get(key, lambda: feed['ics'], stale=False)
+    assert _getfeed(app, {'If-None-Match': f'"{etag}"'}).status_code == 304
+
+    # changed content
+    feed['ics'] = b'BEGIN:VCALENDAR\r\nchanged'
+    _age(cache, key, community_calendar_views.ICS_CACHE_TTL + 1)
+    with app.app_context():
+        cache.get(key, lambda: feed['ics'], stale=False)
+    resp = _getfeed(app, {'If-None-Match': f'"{etag}"'})
+    assert resp.status_code == 200
+    assert resp.get_data() == feed['ics']
+    assert resp.get_etag()[0] != etag
+
+
+def test_eventindexcache_not_served_stale(icsapp):
+    fetches = []
+    def fetch():
+        fetches.append(1)
+        return EventIndex([{'id': len(fetches), 'post': {'topic': {'tags': ['social']}}}])
+    with icsapp.app_context():
+        cache = EventIndexCache()
+        assert cache.get_index('w', fetch).select(['social'])[0]['id'] == 1
+        assert cache.get_index('w', fetch).select(['social'])[0]['id'] == 1
+        _age(cache, 'w', community_calendar_views.EVENTS_CACHE_TTL + 1)
+        assert cache.get_index('w', fetch).select(['social'])[0]['id'] == 2
+    assert cache.refreshthread is None
+
+
+# ----------------------------------------------------------------------
+# EventLocationsFile
+# ----------------------------------------------------------------------
+
+def test_event_locations_file_merges_workers(icsapp):
+    now = time.time()
+    first = EventLocationsFile('fsrc').load()
+    second = EventLocationsFile('fsrc').load()
+    assert first.locations == {}
+
+    first.locations['1'] = ['A', 'v1', now]
+    EventLocationsFile('fsrc').save(first)
+    second.locations['2'] = ['B', 'v1', now]
+    # too old to be used
+    second.locations['3'] = ['C', 'v1', now - community_calendar.EVENT_LOCATION_MAX_AGE_SECS - 1]
+    EventLocationsFile('fsrc').save(second)
+
+    assert EventLocationsFile('fsrc').load().locations == {'1': ['A', 'v1', now], '2': ['B', 'v1', now]}
+    assert EventLocationsFile('other').load().locations == {}
+
+
+def test_calendar_feed_saves_event_locations(feedapp, monkeypatch):
+    app, feed = feedapp
+    def filter_tags_to_bytes(event_locations, **kwargs):
+        event_locations.locations['100'] = ['Venue A', 'v1', time.time()]
+        return feed['ics']
+    monkeypatch.setattr(community_calendar_views, 'filter_tags_to_bytes', filter_tags_to_bytes)
+
+    _getfeed(app)
+    assert EventLocationsFile('fsrc').load().locations['100'][0] == 'Venue A'
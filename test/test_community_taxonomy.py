@@ -3,11 +3,19 @@ test_community_taxonomy - test members.community_taxonomy
 =========================================================
 '''
 
+# standard
+import threading
+import time
+
+# pypi
+import pytest
+
 # homegrown
+from members import community_taxonomy
 from members.community_taxonomy import (
     fetch_categories, fetch_category_groups, fetch_tags, fetch_tag_groups, fetch_groups,
     fetch_site_settings, fetch_user_fields, fetch_badges, fetch_themes, fetch_watched_words,
-    fetch_nav_items, fetch_site_title,
+    fetch_nav_items, fetch_site_title, fetch_all,
     _permission_label, _visibility_label, _access_level_label,
     build_docx,
 )
@@ -186,3 +194,90 @@ def test_build_docx_smoke():
     assert 'Groups' in headings
     assert 'Categories' in headings
     assert 'Tags' in headings
+
+
+# ----------------------------------------------------------------------
+# fetch_all
+# ----------------------------------------------------------------------
+
+TAXONOMY_RESPONSES = {
+    'groups.json': {'groups': [{'name': 'staff'}]},
+    'categories.json': {'category_list': {'categories': [{'id': 1, 'name': 'General'}, {'id': 2, 'name': 'Races'}]}},
+    'tags.json': {'tags': [{'id': 'social'}]},
+    'tag_groups.json': {'tag_groups': []},
+    'admin.site_settings.json': {'site_settings': [{'setting': 'login_required', 'value': 'true'}]},
+    'admin.user_fields.json': {'user_fields': []},
+    'admin.badges.json': {'badges': [{'id': 1}]},
+    'admin.watched_words.json': {'words': []},
+    'about.json': {'about': {'title': 'FSRC Community'}},
+    'admin.plugins.explorer.queries.5.run': {'columns': ['category_id', 'group_name', 'permission_type'],
+                                             'rows': [[2, 'staff', 1]]},
+}
+
+
+def _fetch_all(bareapp, monkeypatch, responses):
+    fake = FakeDiscourse(responses)
+    monkeypatch.setattr(community_taxonomy, 'Discourse', lambda **kwargs: fake)
+    monkeypatch.setattr(community_taxonomy, '_RateLimitedDiscourse', lambda discourse, limiter: discourse)
+    with bareapp.app_context():
+        return fetch_all('https://discourse.example.com', 'key', 'system', category_groups_query_id=5)
+
+
+def test_fetch_all_tolerates_section_errors(bareapp, monkeypatch, capsys):
+    # themes and nav items not configured, so their fetches raise
+    data = _fetch_all(bareapp, monkeypatch, TAXONOMY_RESPONSES)
+
+    assert data['groups'] == [{'name': 'staff'}]
+    assert data['themes'] == []
+    assert data['site_settings']['login_required']['value'] == 'true'
+    assert data['title'] == 'FSRC Community'
+    assert data['categories'][1]['group_permissions'] == [{'group_name': 'staff', 'permission_type': 1}]
+    assert 'group_permissions' not in data['categories'][0]
+
+    # reported in section order, whatever order they finished in
+    lines = capsys.readouterr().out.splitlines()
+    assert [l.split('...')[0].strip() for l in lines] == [
+        'Fetching Groups', 'Fetching Categories', 'Fetching Tags', 'Fetching Tag groups', 'Fetching Site settings',
+        'Fetching User fields', 'Fetching Badges', 'Fetching Themes', 'Fetching Watched words', 'Fetching Nav items',
+        'Fetching category group permissions',
+    ]
+    assert lines[1] == '  Fetching Categories... OK (2 items)'
+    assert lines[7].startswith('  Fetching Themes... WARN: ')
+
+
+@pytest.mark.parametrize('categories', [{'category_list': {'categories': []}}, None])
+def test_fetch_all_skips_category_groups_without_categories(bareapp, monkeypatch, categories):
+    queried = []
+    def query(body):
+        queried.append(body)
+        return TAXONOMY_RESPONSES['admin.plugins.explorer.queries.5.run']
+    responses = dict(TAXONOMY_RESPONSES, **{'admin.plugins.explorer.queries.5.run': query})
+    # categories empty, or not configured so the fetch raises
+    responses.pop('categories.json')
+    if categories:
+        responses['categories.json'] = categories
+
+    data = _fetch_all(bareapp, monkeypatch, responses)
+    assert data['categories'] == []
+    assert queried == []
+
+
+def test_fetch_all_fetches_sections_concurrently(bareapp, monkeypatch):
+    inflight = []
+    maxinflight = []
+    lock = threading.Lock()
+
+    def slow(resp):
+        def get(params):
+            with lock:
+                inflight.append(1)
+                maxinflight.append(len(inflight))
+            time.sleep(0.05)
+            with lock:
+                inflight.pop()
+            return resp
+        return get
+
+    data = _fetch_all(bareapp, monkeypatch, {path: slow(resp) for path, resp in TAXONOMY_RESPONSES.items()})
+    assert data['tags'] == [{'id': 'social'}]
+    assert max(maxinflight) == community_taxonomy.TAXONOMY_FETCH_CONCURRENCY
@@ -0,0 +1,167 @@
+'''
+test_membership_admin - test members.views.admin.membership_admin
+=========================================================
+'''
+
+# standard
+from datetime import date, datetime
+
+# pypi
+import pytest
+
+# homegrown
+from members.views.admin import membership_admin
+from members.views.admin.membership_admin import expired_members_stmt, get_memberdob, MembershipsView, ClubMembers
+from members.views.membership_common import rebuildmembercounts, membercountstats, countmembers
+from members.model import db, LocalInterest, Member, Membership, MemberAlias, MemberDates, TableUpdateTime
+
+
+def _loopexpired(locinterest, sincedate, today):
+    '''python grouping, as ExpiredMembers.open() originally did it'''
+    rows = db.session.query(
+        Member.id, Member.family_name, Member.given_name, Member.middle_name, Member.dob,
+        MemberAlias.facebookalias, Membership.member_id, Membership.end_date,
+    ).select_from(Member).outerjoin(MemberAlias, Member.id == MemberAlias.member_id
+    ).join(Membership, Member.id == Membership.member_id
+    ).filter(Membership.interest_id == locinterest.id, Membership.end_date >= sincedate
+    ).order_by(Membership.member_id, Membership.end_date).all()
+
+    latest = {}
+    for row in rows:
+        latest[row.member_id] = max(latest.get(row.member_id, row.end_date), row.end_date)
+    lookup = {}
+    for row in rows:
+        memberdob = get_memberdob(row)
+        end_date = latest[row.member_id]
+        if memberdob not in lookup or end_date > lookup[memberdob][1]:
+            lookup[memberdob] = (row.member_id, end_date)
+    return sorted((member_id, end_date) for member_id, end_date in lookup.values()
+                  if sincedate <= end_date < today)
+
+
+def _member(interest, family, given, dob, enddates, middle=None, alias=None):
+    member = Member(interest=interest, family_name=family, given_name=given, middle_name=middle,
+                    dob=dob, gender='F')
+    db.session.add(member)
+    for end_date in enddates:
+        db.session.add(Membership(interest=interest, member=member, svc_member_id='x',
+                                  start_date=date(end_date.year, 1, 1), end_date=end_date))
+    if alias:
+        db.session.add(MemberAlias(interest=interest, member=member, facebookalias=alias))
+    return member
+
+
+@pytest.fixture
+def expiredsetup(bare_dbapp):
+    interest = LocalInterest(interest_id=1)
+    other = LocalInterest(interest_id=2)
+    db.session.add_all([interest, other])
+    # expired last year, with facebook alias
+    _member(interest, 'Adams', 'Ann', date(1980, 1, 1), [date(2024, 12, 31), date(2025, 12, 31)], alias='annie')
+    # same person, two member records; the one with the later membership is used
+    _member(interest, 'Baker', 'Bob', date(1970, 2, 2), [date(2025, 6, 30)])
+    _member(interest, 'Baker', 'Bob', date(1970, 2, 2), [date(2025, 9, 30)])
+    # same name, different middle name is a different person
+    _member(interest, 'Baker', 'Bob', date(1970, 2, 2), [date(2025, 3, 31)], middle='Q')
+    # two member records with equal end dates
+    _member(interest, 'Cole', 'Cathy', date(1990, 3, 3), [date(2025, 12, 31)])
+    _member(interest, 'Cole', 'Cathy', date(1990, 3, 3), [date(2025, 12, 31)])
+    # current
+    _member(interest, 'Dunn', 'Dan', date(1985, 4, 4), [date(2025, 12, 31), date(2026, 12, 31)])
+    # old record expired, newer record of same person current
+    _member(interest, 'Evans', 'Eve', date(2000, 5, 5), [date(2025, 12, 31)])
+    _member(interest, 'Evans', 'Eve', date(2000, 5, 5), [date(2026, 12, 31)])
+    # expired before sincedate
+    _member(interest, 'Fox', 'Fran', date(1960, 6, 6), [date(2020, 12, 31)])
+    # other interest
+    _member(other, 'Gray', 'Gus', date(1975, 7, 7), [date(2025, 12, 31)])
+    db.session.commit()
+    yield interest
+
+
+def test_expired_members_stmt_matches_python_grouping(expiredsetup):
+    sincedate, today = date(2025, 1, 1), date(2026, 6, 1)
+    rows = db.session.execute(expired_members_stmt(expiredsetup, sincedate, today)).all()
+
+    assert sorted((row.id, row.end_date) for row in rows) == _loopexpired(expiredsetup, sincedate, today)
+    assert sorted((row.family_name, row.middle_name or '', row.end_date) for row in rows) == [
+        ('Adams', '', date(2025, 12, 31)),
+        ('Baker', '', date(2025, 9, 30)),
+        ('Baker', 'Q', date(2025, 3, 31)),
+        ('Cole', '', date(2025, 12, 31)),
+    ]
+    assert [row.facebookalias for row in rows if row.family_name == 'Adams'] == ['annie']
+
+
+def test_expired_members_stmt_sincedate(expiredsetup):
+    rows = db.session.execute(expired_members_stmt(expiredsetup, date(2025, 7, 1), date(2026, 6, 1))).all()
+    assert sorted(row.family_name for row in rows) == ['Adams', 'Baker', 'Cole']
+
+
+# ----------------------------------------------------------------------
+# MembershipsView
+# ----------------------------------------------------------------------
+
+TODAY = date(2026, 12, 31)
+
+
+@pytest.fixture
+def deletesetup(bare_dbapp, monkeypatch):
+    interest = LocalInterest(interest_id=1)
+    db.session.add(interest)
+    member = Member(interest=interest, family_name='Adams', given_name='Ann', dob=date(1980, 1, 1), gender='F')
+    memberdates = MemberDates(interest=interest, member=member, start_date=date(2023, 1, 1), end_date=date(2026, 12, 31))
+    db.session.add_all([member, memberdates])
+    for year in range(2023, 2027):
+        db.session.add(Membership(interest=interest, member=member, svc_member_id='x', memberdates=memberdates,
+                                  start_date=date(year, 1, 1), end_date=date(year, 12, 31)))
+    rebuildmembercounts(interest)
+    db.session.commit()
+
+    monkeypatch.setattr(membership_admin, 'localinterest', lambda: interest)
+    view = MembershipsView.__new__(MembershipsView)
+    view.model = Membership
+    view.db = db
+    yield interest, view
+
+
+def _deleteyear(view, year):
+    membership = Membership.query.filter(Membership.start_date == date(year, 1, 1)).one()
+    view.deleterow(membership.id)
+    db.session.commit()
+
+
+@pytest.mark.parametrize('years', [[2024], [2023], [2026], [2024, 2023, 2026, 2025]])
+def test_memberships_deleterow_keeps_membercount(deletesetup, years):
+    interest, view = deletesetup
+    for year in years:
+        _deleteyear(view, year)
+
+    ranges = [(md.start_date, md.end_date) for md in MemberDates.query.filter_by(interest=interest).all()]
+    assert membercountstats(interest, TODAY) == countmembers(ranges, TODAY)
+
+
+def test_memberships_deleterow_bumps_lastchecked(deletesetup):
+    interest, view = deletesetup
+    lastchecked = datetime(2026, 5, 31, 3)
+    db.session.add(TableUpdateTime(interest=interest, tablename='member', lastchecked=lastchecked))
+    db.session.commit()
+
+    _deleteyear(view, 2024)
+    assert TableUpdateTime.query.filter_by(interest=interest, tablename='member').one().lastchecked > lastchecked
+
+
+@pytest.mark.parametrize('viewclass', [MembershipsView, ClubMembers])
+@pytest.mark.parametrize('write', [lambda view: view.createrow({}), lambda view: view.updaterow(1, {})])
+def test_admin_writes_bump_lastchecked(deletesetup, monkeypatch, viewclass, write):
+    interest, view = deletesetup
+    lastchecked = datetime(2026, 5, 31, 3)
+    db.session.add(TableUpdateTime(interest=interest, tablename='member', lastchecked=lastchecked))
+    db.session.commit()
+    # the inherited writes need a form, only the bump is of interest here
+    monkeypatch.setattr(membership_admin.DbCrudApiInterestsRolePermissions, 'createrow', lambda self, formdata: {})
+    monkeypatch.setattr(membership_admin.DbCrudApiInterestsRolePermissions, 'updaterow', lambda self, thisid, formdata: {})
+
+    write(viewclass.__new__(viewclass))
+    db.session.commit()
+    assert TableUpdateTime.query.filter_by(interest=interest, tablename='member').one().lastchecked > lastchecked
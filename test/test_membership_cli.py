@@ -0,0 +1,305 @@
+'''
+test_membership_cli - test scripts.membership_cli
+=========================================================
+'''
+
+# standard
+from csv import DictWriter
+from datetime import date, datetime, timedelta
+from json import dumps
+
+# pypi
+import pytest
+
+# homegrown
+from scripts.membership_cli import (
+    merge_memberships, MemberIndex, modified_after_timestamp, advance_high_water_mark,
+    membershipkey, dedup_memberships, sorted_membershipfile, stream_memberships,
+    membershipfile_source,
+)
+from members.model import db, LocalInterest, Member, MemberDates, Membership, TableUpdateTime
+from members.views.membership_common import MemberCountTracker, membercountstats, countmembers
+
+
+def _mship(memberid, mshipid, family, given, dob, start, end, gender='Female', city='Frederick'):
+    '''membership in common "file" format'''
+    return {
+        'MemberID': memberid,
+        'MembershipID': mshipid,
+        'MembershipType': 'Individual',
+        'FamilyName': family,
+        'GivenName': given,
+        'MiddleName': '',
+        'Gender': gender,
+        'DOB': dob,
+        'City': city,
+        'State': 'MD',
+        'Email': f'{given.lower()}@example.com',
+        'PrimaryMember': 'T',
+        'JoinDate': start,
+        'ExpirationDate': end,
+        'LastModified': f'{start} 00:00:00',
+    }
+
+
+def _member(interest, memberid, family, given, dob, ranges, gender='Female'):
+    '''member with one memberdates record and one membership per (mshipid, start, end) in ranges'''
+    member = Member(interest=interest, svc_member_id=memberid, family_name=family, given_name=given,
+                    middle_name='', gender=gender, dob=date.fromisoformat(dob))
+    db.session.add(member)
+    memberdates = MemberDates(interest=interest, member=member,
+                              start_date=date.fromisoformat(ranges[0][1]),
+                              end_date=date.fromisoformat(ranges[-1][2]))
+    db.session.add(memberdates)
+    for mshipid, start, end in ranges:
+        db.session.add(Membership(interest=interest, member=member, memberdates=memberdates,
+                                  svc_member_id=memberid, svc_membership_id=mshipid,
+                                  start_date=date.fromisoformat(start), end_date=date.fromisoformat(end)))
+    return member
+
+
+def _seed():
+    interest = LocalInterest(interest_id=1)
+    db.session.add(interest)
+    _member(interest, '100', 'Adams', 'Ann', '1980-01-01', [('m100', '2020-01-01', '2020-12-31')])
+    _member(interest, '200', 'Baker', 'Bob', '1970-02-02', [('m200', '2018-01-01', '2018-12-31')], gender='Male')
+    _member(interest, '300', 'Cole', 'Cathy', '1990-03-03', [('m300', '2020-01-01', '2020-12-31')])
+    # discontiguous memberships, gap filled by incoming membership
+    fran = _member(interest, '400', 'Fox', 'Fran', '1985-04-04', [('m400a', '2019-01-01', '2019-12-31')])
+    laterdates = MemberDates(interest=interest, member=fran,
+                             start_date=date(2021, 1, 1), end_date=date(2021, 12, 31))
+    db.session.add(laterdates)
+    db.session.add(Membership(interest=interest, member=fran, memberdates=laterdates,
+                              svc_member_id='400', svc_membership_id='m400c',
+                              start_date=date(2021, 1, 1), end_date=date(2021, 12, 31)))
+    db.session.flush()
+    return interest
+
+
+def _memberships():
+    memberships = [
+        # renewal, contiguous
+        _mship('100', 'm100b', 'Adams', 'Ann', '1980-01-01', '2021-01-01', '2021-12-31'),
+        # renewal after a gap
+        _mship('200', 'm200b', 'Baker', 'Bob', '1970-02-02', '2021-01-01', '2021-12-31', gender='Male'),
+        # name changed, found by member id
+        _mship('300', 'm300b', 'Cole-Dunn', 'Cathy', '1990-03-03', '2021-01-01', '2021-12-31'),
+        # new member, two memberships, the second of which overlaps the first
+        _mship('500', 'm500a', 'Evans', 'Eve', '2000-05-05', '2021-01-01', '2021-12-31'),
+        _mship('500', 'm500b', 'Evans', 'Eve', '2000-05-05', '2021-12-01', '2022-12-31'),
+        # gap filler, memberdates should be merged
+        _mship('400', 'm400b', 'Fox', 'Fran', '1985-04-04', '2020-01-01', '2020-12-31'),
+        # existing membership updated
+        _mship('100', 'm100', 'Adams', 'Ann', '1980-01-01', '2020-01-01', '2020-12-31', city='Walkersville'),
+    ]
+    memberships.sort(key=lambda m: (m['FamilyName'], m['GivenName'], m['Gender'], m['DOB'], m['ExpirationDate']))
+    return memberships
+
+
+def _snapshot():
+    '''database contents independent of primary keys and row order'''
+    # reload relationships from the database
+    db.session.flush()
+    db.session.expire_all()
+    snapshot = []
+    for member in Member.query.all():
+        memberdates = sorted((md.start_date, md.end_date) for md in member.memberdates)
+        memberships = sorted(
+            (ms.svc_membership_id, ms.start_date, ms.end_date, ms.hometown,
+             (ms.memberdates.start_date, ms.memberdates.end_date) if ms.memberdates else None)
+            for ms in member.memberships)
+        snapshot.append((member.family_name, member.given_name, member.gender, member.dob,
+                         str(member.svc_member_id), member.hometown, member.email,
+                         tuple(memberdates), tuple(memberships)))
+    return sorted(snapshot, key=repr)
+
+
+@pytest.fixture
+def mergedb(bare_dbapp):
+    # the per-row query uses MySQL's BINARY() for a case sensitive member id comparison
+    db.session.connection().connection.driver_connection.create_function(
+        'binary', 1, lambda v: str(v) if v is not None else None)
+    yield bare_dbapp
+
+
+def test_merge_memberships_bulk_matches_perrow(mergedb):
+    interest = _seed()
+    merge_memberships(_memberships(), interest)
+    perrow = _snapshot()
+    db.session.rollback()
+    db.session.expunge_all()
+
+    interest = _seed()
+    merge_memberships(_memberships(), interest, bulk=True, flushsize=2)
+    bulk = _snapshot()
+
+    assert bulk == perrow
+
+
+def test_merge_memberships_bulk_extends_and_merges_memberdates(mergedb):
+    interest = _seed()
+    merge_memberships(_memberships(), interest, bulk=True)
+
+    ann = Member.query.filter_by(svc_member_id='100').one()
+    anndates = MemberDates.query.filter_by(member=ann).all()
+    assert [(md.start_date, md.end_date) for md in anndates] == [(date(2020, 1, 1), date(2021, 12, 31))]
+
+    fran = Member.query.filter_by(svc_member_id='400').one()
+    frandates = MemberDates.query.filter_by(member=fran).all()
+    assert [(md.start_date, md.end_date) for md in frandates] == [(date(2019, 1, 1), date(2021, 12, 31))]
+    assert Membership.query.filter_by(member=fran, memberdates=frandates[0]).count() == 3
+
+
+def test_merge_memberships_bulk_creates_single_new_member(mergedb):
+    interest = _seed()
+    merge_memberships(_memberships(), interest, bulk=True)
+
+    eve = Member.query.filter_by(family_name='Evans').one()
+    assert len(eve.memberships) == 2
+    # overlap moved the later start date
+    assert sorted(ms.start_date for ms in eve.memberships) == [date(2021, 1, 1), date(2022, 1, 1)]
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_merge_memberships_maintains_member_counts(mergedb, bulk):
+    interest = _seed()
+    with MemberCountTracker(interest):
+        merge_memberships(_memberships(), interest, bulk=bulk, flushsize=2)
+    db.session.commit()
+
+    today = date(2023, 12, 31)
+    ranges = [(md.start_date, md.end_date) for md in MemberDates.query.filter_by(interest=interest).all()]
+    assert membercountstats(interest, today) == countmembers(ranges, today)
+
+
+def test_member_index_reindexes_changed_name(mergedb):
+    interest = _seed()
+    index = MemberIndex(Member.query.all())
+    cathy = Member.query.filter_by(svc_member_id='300').one()
+
+    cathy.family_name = 'Cole-Dunn'
+    index.add(cathy)
+
+    byname = _mship(None, 'x', 'cole-dunn', 'CATHY', '1990-03-03', '2021-01-01', '2021-12-31')
+    oldname = _mship(None, 'x', 'Cole', 'Cathy', '1990-03-03', '2021-01-01', '2021-12-31')
+    assert index.find(byname) == [cathy]
+    assert index.find(oldname) == []
+
+
+# ----------------------------------------------------------------------
+# incremental update high-water mark
+# ----------------------------------------------------------------------
+
+def test_modified_after_timestamp_none_without_high_water_mark():
+    assert modified_after_timestamp(TableUpdateTime(tablename='member')) is None
+
+
+def test_modified_after_timestamp_backs_off_by_overlap():
+    mark = datetime(2026, 10, 1, 12, 0, 0)
+    tableupdatetime = TableUpdateTime(tablename='member', last_modified=mark)
+    since = modified_after_timestamp(tableupdatetime, overlap=timedelta(hours=2))
+    assert since == int(datetime(2026, 10, 1, 10, 0, 0).timestamp())
+
+
+def test_advance_high_water_mark_uses_latest_last_modified():
+    tableupdatetime = TableUpdateTime(tablename='member', last_modified=datetime(2026, 1, 1))
+    advance_high_water_mark(tableupdatetime, [
+        {'last_modified': '2026-03-01 08:00:00'},
+        {'last_modified': '2026-03-02 09:30:00'},
+    ])
+    assert tableupdatetime.last_modified == datetime(2026, 3, 2, 9, 30, 0)
+
+
+def test_advance_high_water_mark_never_moves_backwards():
+    mark = datetime(2026, 6, 1)
+    tableupdatetime = TableUpdateTime(tablename='member', last_modified=mark)
+    advance_high_water_mark(tableupdatetime, [{'last_modified': '2026-03-01 08:00:00'}])
+    assert tableupdatetime.last_modified == mark
+    advance_high_water_mark(tableupdatetime, [])
+    assert tableupdatetime.last_modified == mark
+
+
+# ----------------------------------------------------------------------
+# streaming membershipfile ingestion
+# ----------------------------------------------------------------------
+
+def _writecsv(path, memberships):
+    with open(path, 'w', newline='') as f:
+        writer = DictWriter(f, fieldnames=list(memberships[0].keys()))
+        writer.writeheader()
+        writer.writerows(memberships)
+
+
+def test_sorted_membershipfile_merges_sorted_runs(tmp_path):
+    memberships = list(reversed(_memberships()))
+    path = tmp_path / 'memberships.csv'
+    _writecsv(path, memberships)
+
+    streamed = list(sorted_membershipfile(str(path), runsize=2))
+
+    assert [membershipkey(m) for m in streamed] == sorted(membershipkey(m) for m in memberships)
+
+
+def test_dedup_memberships_keeps_last_of_adjacent_duplicates():
+    first = _mship('100', 'm1', 'Adams', 'Ann', '1980-01-01', '2021-01-01', '2021-12-31')
+    dup = dict(first, Email='new@example.com')
+    other = _mship('100', 'm2', 'Adams', 'Ann', '1980-01-01', '2022-01-01', '2022-12-31')
+
+    assert list(dedup_memberships([first, dup, other])) == [dup, other]
+    assert list(dedup_memberships([])) == []
+
+
+def test_stream_memberships_matches_merge_memberships(mergedb, tmp_path):
+    interest = _seed()
+    merge_memberships(_memberships(), interest)
+    expected = _snapshot()
+    db.session.rollback()
+    db.session.expunge_all()
+
+    interest = _seed()
+    checkpointfile = tmp_path / 'checkpoint'
+    stream_memberships(_memberships(), interest, chunksize=2, checkpointfile=str(checkpointfile))
+
+    assert _snapshot() == expected
+    assert not checkpointfile.exists()
+
+
+def _checkpoint(tmp_path, source):
+    # members up to and including Cole,Cathy were committed before a failure
+    checkpointfile = tmp_path / 'checkpoint'
+    checkpointfile.write_text(dumps({'source': source, 'key': ['Cole-Dunn', 'Cathy', 'Female', '1990-03-03']}))
+    return checkpointfile
+
+
+def test_stream_memberships_resumes_after_checkpoint(mergedb, tmp_path):
+    interest = _seed()
+    db.session.commit()
+    membershipfile = tmp_path / 'memberships.csv'
+    _writecsv(membershipfile, _memberships())
+    source = membershipfile_source(str(membershipfile))
+    checkpointfile = _checkpoint(tmp_path, source)
+
+    stream_memberships(_memberships(), interest, chunksize=2, checkpointfile=str(checkpointfile), source=source)
+
+    # Adams, Baker, Cole-Dunn skipped; Evans, Fox merged
+    assert Membership.query.filter_by(svc_membership_id='m100b').count() == 0
+    assert Membership.query.filter_by(svc_membership_id='m500a').count() == 1
+    assert Membership.query.filter_by(svc_membership_id='m400b').count() == 1
+    assert not checkpointfile.exists()
+
+
+def test_stream_memberships_ignores_checkpoint_from_other_file(mergedb, tmp_path):
+    interest = _seed()
+    db.session.commit()
+    membershipfile = tmp_path / 'memberships.csv'
+    _writecsv(membershipfile, _memberships()[:2])
+    checkpointfile = _checkpoint(tmp_path, membershipfile_source(str(membershipfile)))
+
+    # membership file replaced since the checkpoint was made
+    _writecsv(membershipfile, _memberships())
+    source = membershipfile_source(str(membershipfile))
+    stream_memberships(_memberships(), interest, chunksize=2, checkpointfile=str(checkpointfile), source=source)
+
+    assert Membership.query.filter_by(svc_membership_id='m100b').count() == 1
+    assert Membership.query.filter_by(svc_membership_id='m500a').count() == 1
+    assert not checkpointfile.exists()
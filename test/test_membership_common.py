@@ -0,0 +1,324 @@
+'''
+test_membership_common - test members.views.membership_common
+=========================================================
+'''
+
+# standard
+from datetime import date, timedelta
+from random import Random
+
+# pypi
+import pytest
+from datatables import ColumnDT
+from loutilities.tables import DataTablesEditor, ParameterError
+from werkzeug.exceptions import BadRequest
+
+# homegrown
+from members.views import membership_common
+from members.views.membership_common import (
+    countmembers, rebuildmembercounts, membercountstats, MemberCountTracker,
+    searchrows, UnpagedDataTables, ServerSideCsvMixin, RenderedRowsServerSideMixin,
+)
+from members.model import db, LocalInterest, Member, MemberDates, MemberCount
+
+
+def _loopcounts(dateranges, today):
+    '''day by day count, as analyzemembership() originally did it'''
+    stats = {}
+    for start_date, end_date in dateranges:
+        thisdate = start_date
+        while thisdate <= end_date and thisdate <= today:
+            if thisdate.year >= 2013:
+                thismd = f'{thisdate.month:02d}-{thisdate.day:02d}'
+                stats.setdefault(thisdate.year, {})
+                stats[thisdate.year].setdefault(thismd, 0)
+                stats[thisdate.year][thismd] += 1
+            thisdate += timedelta(1)
+    return [{'year': year, 'counts': [{'date': d, 'count': stats[year][d]} for d in sorted(stats[year])]}
+            for year in sorted(stats)]
+
+
+def _randomranges(n, seed=1):
+    rand = Random(seed)
+    ranges = []
+    for _ in range(n):
+        start = date(2011, 1, 1) + timedelta(rand.randrange(365 * 15))
+        ranges.append((start, start + timedelta(rand.randrange(-5, 800))))
+    return ranges
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def countmode(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(membership_common, 'np', None)
+    return request.param
+
+
+def test_countmembers_matches_day_by_day_loop(countmode):
+    ranges = _randomranges(300)
+    today = date(2024, 6, 15)
+    assert countmembers(ranges, today) == _loopcounts(ranges, today)
+
+
+def test_countmembers_clips_to_first_year_and_today(countmode):
+    ranges = [(date(2012, 12, 30), date(2013, 1, 2)), (date(2013, 1, 2), date(2013, 1, 10))]
+    stats = countmembers(ranges, date(2013, 1, 3))
+    assert stats == [{'year': 2013, 'counts': [
+        {'date': '01-01', 'count': 1},
+        {'date': '01-02', 'count': 2},
+        {'date': '01-03', 'count': 1},
+    ]}]
+
+
+def test_countmembers_omits_dates_without_members(countmode):
+    ranges = [(date(2014, 12, 31), date(2014, 12, 31)), (date(2016, 1, 1), date(2016, 1, 1))]
+    stats = countmembers(ranges, date(2020, 1, 1))
+    assert stats == [
+        {'year': 2014, 'counts': [{'date': '12-31', 'count': 1}]},
+        {'year': 2016, 'counts': [{'date': '01-01', 'count': 1}]},
+    ]
+
+
+def test_countmembers_ignores_future_and_early_ranges(countmode):
+    ranges = [(date(2010, 1, 1), date(2012, 12, 31)), (date(2030, 1, 1), date(2030, 12, 31))]
+    assert countmembers(ranges, date(2025, 1, 1)) == []
+
+
+# ----------------------------------------------------------------------
+# MemberCount maintenance
+# ----------------------------------------------------------------------
+
+TODAY = date(2030, 12, 31)
+
+
+def _ranges(interest):
+    return [(md.start_date, md.end_date) for md in MemberDates.query.filter_by(interest=interest).all()]
+
+
+@pytest.fixture
+def countsetup(bare_dbapp):
+    interest = LocalInterest(interest_id=1)
+    db.session.add(interest)
+    for start, end in _randomranges(50, seed=2):
+        member = Member(interest=interest)
+        db.session.add_all([member, MemberDates(interest=interest, member=member, start_date=start, end_date=end)])
+    db.session.commit()
+    return interest
+
+
+def test_rebuildmembercounts_matches_countmembers(countsetup):
+    interest = countsetup
+    rebuildmembercounts(interest)
+    assert membercountstats(interest, TODAY) == countmembers(_ranges(interest), TODAY)
+    assert membercountstats(interest, date(2020, 6, 1)) == countmembers(_ranges(interest), date(2020, 6, 1))
+
+
+def test_membercounttracker_rebuilds_empty_counts(countsetup):
+    interest = countsetup
+    with MemberCountTracker(interest):
+        pass
+    assert MemberCount.query.filter_by(interest=interest).count() > 0
+    assert membercountstats(interest, TODAY) == countmembers(_ranges(interest), TODAY)
+
+
+def test_membercounttracker_adjusts_for_memberdates_changes(countsetup):
+    interest = countsetup
+    rebuildmembercounts(interest)
+    db.session.commit()
+
+    with MemberCountTracker(interest):
+        memberdates = MemberDates.query.filter_by(interest=interest).order_by(MemberDates.id).all()
+        memberdates[0].end_date = memberdates[0].end_date + timedelta(400)
+        memberdates[1].start_date = memberdates[1].start_date - timedelta(30)
+        db.session.delete(memberdates[2])
+        db.session.flush()
+        # changed again after a flush
+        memberdates[0].start_date = memberdates[0].start_date + timedelta(10)
+        member = Member(interest=interest)
+        db.session.add_all([member, MemberDates(interest=interest, member=member,
+                                                start_date=date(2012, 6, 1), end_date=date(2019, 3, 1))])
+        db.session.commit()
+        # after commit, tracking continues
+        memberdates[3].end_date = memberdates[3].end_date - timedelta(5)
+
+    db.session.commit()
+    assert membercountstats(interest, TODAY) == countmembers(_ranges(interest), TODAY)
+
+
+def test_membercounttracker_discards_rolled_back_changes(countsetup):
+    interest = countsetup
+    rebuildmembercounts(interest)
+    db.session.commit()
+    expected = membercountstats(interest, TODAY)
+
+    with MemberCountTracker(interest):
+        memberdates = MemberDates.query.filter_by(interest=interest).first()
+        memberdates.end_date = memberdates.end_date + timedelta(100)
+        db.session.flush()
+        db.session.rollback()
+
+    db.session.commit()
+    assert membercountstats(interest, TODAY) == expected
+
+
+def test_membercounttracker_ignores_other_interests(countsetup):
+    interest = countsetup
+    rebuildmembercounts(interest)
+    other = LocalInterest(interest_id=2)
+    db.session.add(other)
+    db.session.commit()
+    expected = membercountstats(interest, TODAY)
+
+    with MemberCountTracker(interest):
+        member = Member(interest=other)
+        db.session.add_all([member, MemberDates(interest=other, member=member,
+                                                start_date=date(2020, 1, 1), end_date=date(2020, 12, 31))])
+
+    db.session.commit()
+    assert membercountstats(interest, TODAY) == expected
+
+
+# ----------------------------------------------------------------------
+# server side datatables support
+# ----------------------------------------------------------------------
+
+def _dtargs(columns, search='', order=(), colsearch=None):
+    args = {'draw': '1', 'start': '0', 'length': '-1', 'search[value]': search}
+    for i, data in enumerate(columns):
+        args[f'columns[{i}][data]'] = data
+        args[f'columns[{i}][searchable]'] = 'true'
+        args[f'columns[{i}][search][value]'] = (colsearch or {}).get(data, '')
+    for i, (column, dir) in enumerate(order):
+        args[f'order[{i}][column]'] = str(column)
+        args[f'order[{i}][dir]'] = dir
+    return args
+
+
+ROWS = [
+    {'name': {'display': 'Baker', 'sort': 'baker'}, 'city': 'Frederick', 'n': 2},
+    {'name': {'display': 'adams', 'sort': 'adams'}, 'city': 'Walkersville', 'n': 2},
+    {'name': {'display': 'Cole', 'sort': 'cole'}, 'city': 'Frederick', 'n': 1},
+]
+
+
+def test_searchrows_orders_by_sort_value_and_multiple_columns():
+    found = searchrows(ROWS, _dtargs(['name', 'city', 'n'], order=[(2, 'desc'), (0, 'asc')]))
+    assert [r['name']['display'] for r in found] == ['adams', 'Baker', 'Cole']
+
+
+def test_searchrows_bad_order_column(bareapp):
+    for column in ['3', '-1', 'name']:
+        with pytest.raises(BadRequest):
+            searchrows(ROWS, dict(_dtargs(['name', 'city', 'n']), **{'order[0][column]': column}))
+
+
+def test_renderedrowsserversidemixin_requires_renderedrows():
+    class NoRows(RenderedRowsServerSideMixin):
+        pass
+    with pytest.raises(ParameterError):
+        NoRows()
+
+
+def test_searchrows_global_and_column_search():
+    found = searchrows(ROWS, _dtargs(['name', 'city', 'n'], search='FRED'))
+    assert [r['name']['display'] for r in found] == ['Baker', 'Cole']
+
+    found = searchrows(ROWS, _dtargs(['name', 'city', 'n'], search='fred', colsearch={'name': 'co'}))
+    assert [r['name']['display'] for r in found] == ['Cole']
+
+
+@pytest.fixture
+def csvsetup(bare_dbapp):
+    interest = LocalInterest(interest_id=1)
+    other = LocalInterest(interest_id=2)
+    db.session.add_all([interest, other])
+    for i, (family, given) in enumerate([('Cole', 'Cathy'), ('Adams', 'Ann'), ('Baker', 'Bob'), ('Adams', 'Al')]):
+        db.session.add(Member(interest=interest, svc_member_id=str(i), family_name=family, given_name=given))
+    db.session.add(Member(interest=other, svc_member_id='9', family_name='Adams', given_name='Other'))
+    db.session.commit()
+    yield bare_dbapp, interest
+
+
+class _CsvView(ServerSideCsvMixin):
+    '''just enough of DbCrudApi for streamcsv()'''
+    endpoint = 'admin.clubmembers'
+    clientcolumns = [
+        {'data': 'family_name', 'label': 'Last Name'},
+        {'data': 'given_name', 'label': 'First Name'},
+        {'data': 'svc_member_id', 'label': 'Member ID', 'visible': False},
+    ]
+    servercolumns = [
+        ColumnDT(Member.family_name, mData='family_name'),
+        ColumnDT(Member.given_name, mData='given_name'),
+        ColumnDT(Member.id, mData='rowid'),
+    ]
+    csvbatchsize = 2
+    model = Member
+
+    def __init__(self, interest):
+        self.interest = interest
+        formmapping = {'rowid': 'id', 'family_name': 'family_name', 'given_name': 'given_name',
+                       'svc_member_id': 'svc_member_id'}
+        self.dte = DataTablesEditor({}, formmapping, null2emptystring=True)
+
+    def init(self):
+        return None
+
+    def permission(self):
+        return True
+
+    def beforequery(self):
+        self.queryparams = {'interest_id': self.interest.id}
+
+    def serverquery(self):
+        return db.session.query().select_from(Member).filter_by(**self.queryparams)
+
+
+def test_unpageddatatables_applies_search_and_order_without_paging(csvsetup):
+    app, interest = csvsetup
+    args = dict(_dtargs(['family_name', 'given_name', 'rowid'], search='a', order=[(0, 'asc'), (1, 'asc')]),
+                length='1')
+    rowtable = UnpagedDataTables(args, db.session.query().select_from(Member).filter_by(interest_id=interest.id),
+                                 _CsvView.servercolumns)
+    assert rowtable.error is None
+    assert [tuple(r)[:2] for r in rowtable.query] == [('Adams', 'Al'), ('Adams', 'Ann'), ('Baker', 'Bob'),
+                                                      ('Cole', 'Cathy')]
+
+
+def test_streamcsv_streams_matching_rows(csvsetup):
+    app, interest = csvsetup
+    args = _dtargs(['family_name', 'given_name', 'rowid'], order=[(0, 'asc'), (1, 'asc')],
+                   colsearch={'family_name': 'a'})
+    with app.test_request_context('/admin/fsrc/members/csv', query_string=args):
+        view = _CsvView(interest)
+        view.beforequery()
+        response = view.streamcsv()
+        chunks = list(response.response)
+
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=clubmembers.csv'
+    # batches of csvbatchsize rows, invisible column not included
+    assert len(chunks) == 2
+    assert ''.join(chunks).splitlines() == ['Last Name,First Name', 'Adams,Al', 'Adams,Ann', 'Baker,Bob']
+
+
+def test_streamcsv_formats_rows_through_dte(csvsetup):
+    app, interest = csvsetup
+    Member.query.filter_by(given_name='Al').one().given_name = None
+    db.session.commit()
+
+    args = _dtargs(['family_name', 'given_name', 'rowid'], order=[(0, 'asc'), (1, 'asc')])
+    with app.test_request_context('/admin/fsrc/members/csv', query_string=args):
+        view = _CsvView(interest)
+        # display name computed by the formmapping, which the server query doesn't select
+        view.clientcolumns = view.clientcolumns + [{'data': 'name', 'label': 'Name'}]
+        view.dte.formmapping['name'] = lambda member: f'{member.given_name} {member.family_name}'
+        view.dte.set_response_hook(lambda row: row.update(family_name=row['family_name'].upper()))
+        view.beforequery()
+        response = view.streamcsv()
+        lines = ''.join(response.response).splitlines()
+
+    assert lines == ['Last Name,First Name,Name', 'ADAMS,,None Adams', 'ADAMS,Ann,Ann Adams',
+                     'BAKER,Bob,Bob Baker', 'COLE,Cathy,Cathy Cole']
@@ -0,0 +1,271 @@
+'''
+test_membership_frontend - test members.views.frontend.membership_frontend
+=========================================================================
+'''
+
+# standard
+from datetime import date, datetime
+from json import dumps, loads
+import os
+
+# pypi
+import pytest
+from flask import g
+from sqlalchemy import event
+from werkzeug.exceptions import BadRequest
+
+# homegrown
+from members.views.frontend import membership_frontend
+from members.views.frontend.membership_frontend import MemberStatsApi, compactstats, frontendmembers_view
+from members.model import db, LocalInterest, Member, MemberDates, TableUpdateTime
+
+# ----------------------------------------------------------------------
+# public members list
+# ----------------------------------------------------------------------
+
+def _addmember(interest, given, family, dob, ranges):
+    member = Member(interest=interest, given_name=given, family_name=family, gender='F',
+                    hometown='Frederick, MD', dob=dob)
+    db.session.add(member)
+    for start, end in ranges:
+        db.session.add(MemberDates(interest=interest, member=member, start_date=start, end_date=end))
+    return member
+
+
+@pytest.fixture
+def membersapp(bare_dbapp, tmp_path, monkeypatch):
+    bare_dbapp.config['APP_FILE_FOLDER'] = str(tmp_path)
+    monkeypatch.setattr(membership_frontend, '_localtoday', lambda: datetime(2026, 6, 1))
+    interest = LocalInterest(interest_id=1)
+    db.session.add(interest)
+    # two memberdates, only the second contains ondate
+    _addmember(interest, 'Ann', 'Adams', date(1980, 1, 1),
+               [(date(2020, 1, 1), date(2020, 12, 31)), (date(2025, 1, 1), date(2026, 12, 31))])
+    # 13 as of today, 12 as of Jan 1
+    _addmember(interest, 'Kim', 'Kid', date(2013, 3, 1), [(date(2026, 1, 1), date(2026, 12, 31))])
+    # birthday on Jan 1 is in the next division
+    _addmember(interest, 'Nora', 'New', date(1996, 1, 1), [(date(2026, 1, 1), date(2026, 12, 31))])
+    # expired
+    _addmember(interest, 'Ed', 'Expired', date(1970, 1, 1), [(date(2020, 1, 1), date(2020, 12, 31))])
+    db.session.commit()
+    yield bare_dbapp, interest
+
+
+def _memberrows(app, interest, ondate, method='renderedrows', query=''):
+    with app.test_request_context(f'/fsrc/members/rest?ondate={ondate}{query}'):
+        g.interest = 'fsrc'
+        # what beforequery() sets up
+        frontendmembers_view.queryparams = {'interest_id': interest.id}
+        frontendmembers_view.ondate = date.fromisoformat(ondate)
+        frontendmembers_view.queryfilters = [MemberDates.start_date <= frontendmembers_view.ondate,
+                                             MemberDates.end_date >= frontendmembers_view.ondate]
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            if method == 'open':
+                frontendmembers_view.open()
+                return statements, frontendmembers_view.output_result
+            rows = getattr(frontendmembers_view, method)()
+            if method == 'retrieverows':
+                rows = [frontendmembers_view.dte.get_response_data(r) for r in rows]
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+    return statements, sorted(rows, key=lambda r: r['family_name']['sort'])
+
+
+EXPECTED_MEMBERS = [
+    ('Ann', 'Adams', '40-49', '12/31/2026'),
+    ('K.', 'Kid', '13 and under', '12/31/2026'),
+    ('Nora', 'New', '30-39', '12/31/2026'),
+]
+
+
+def _summary(rows):
+    return [(r['given_name'], r['family_name']['display'], r['div'], r['end_date']) for r in rows]
+
+
+def test_frontendmembers_rows_single_query(membersapp):
+    app, interest = membersapp
+    statements, rows = _memberrows(app, interest, '2026-06-01', method='retrieverows')
+
+    assert len(statements) == 1
+    assert _summary(rows) == EXPECTED_MEMBERS
+
+
+def test_frontendmembers_rows_cached_until_table_updated(membersapp, tmp_path):
+    app, interest = membersapp
+    tableupdatetime = TableUpdateTime(interest=interest, tablename='member', lastchecked=datetime(2026, 5, 31, 3))
+    db.session.add(tableupdatetime)
+    db.session.commit()
+
+    statements, rows = _memberrows(app, interest, '2026-06-01')
+    assert len(statements) == 2
+    assert _summary(rows) == EXPECTED_MEMBERS
+    assert (tmp_path / 'fsrc' / 'memberscache' / 'members-2026-06-01.json').exists()
+
+    # served from the cache, only TableUpdateTime is queried
+    statements, cachedrows = _memberrows(app, interest, '2026-06-01')
+    assert len(statements) == 1
+    assert cachedrows == rows
+
+    # different ondate is cached separately
+    statements, rows = _memberrows(app, interest, '2020-06-01')
+    assert [r['family_name']['display'] for r in rows] == ['Adams', 'Expired']
+
+    # membership update invalidates the cache
+    db.session.add(MemberDates(interest=interest, member=Member.query.filter_by(family_name='Expired').one(),
+                               start_date=date(2026, 5, 31), end_date=date(2027, 5, 30)))
+    tableupdatetime.lastchecked = datetime(2026, 6, 1, 3)
+    db.session.commit()
+    statements, rows = _memberrows(app, interest, '2026-06-01')
+    assert len(statements) == 2
+    assert [r['family_name']['display'] for r in rows] == ['Adams', 'Expired', 'Kid', 'New']
+
+
+def test_frontendmembers_cache_keeps_bounded_files(membersapp, tmp_path, monkeypatch):
+    app, interest = membersapp
+    db.session.add(TableUpdateTime(interest=interest, tablename='member', lastchecked=datetime(2026, 5, 31, 3)))
+    db.session.commit()
+    monkeypatch.setattr(membership_frontend, 'MEMBERS_CACHE_MAX_FILES', 2)
+
+    for day in range(1, 5):
+        _memberrows(app, interest, f'2026-06-0{day}')
+    assert len(list((tmp_path / 'fsrc' / 'memberscache').iterdir())) == 2
+
+
+def _dtargs(start=0, length=10, search='', order=((1, 'asc'),)):
+    columns = ['given_name', 'family_name', 'div', 'hometown', 'end_date']
+    args = {'draw': '3', 'start': str(start), 'length': str(length), 'search[value]': search}
+    for i, data in enumerate(columns):
+        args[f'columns[{i}][data]'] = data
+        args[f'columns[{i}][searchable]'] = 'true'
+    for i, (column, dir) in enumerate(order):
+        args[f'order[{i}][column]'] = str(column)
+        args[f'order[{i}][dir]'] = dir
+    return '&' + '&'.join(f'{k}={v}' for k, v in args.items())
+
+
+def test_frontendmembers_serverside_pages_and_searches(membersapp):
+    app, interest = membersapp
+
+    statements, output = _memberrows(app, interest, '2026-06-01', method='open',
+                                     query=_dtargs(start=1, length=1, order=((1, 'desc'),)))
+    assert (output['draw'], output['recordsTotal'], output['recordsFiltered']) == ('3', '3', '3')
+    assert [r['family_name']['display'] for r in output['data']] == ['Kid']
+
+    statements, output = _memberrows(app, interest, '2026-06-01', method='open', query=_dtargs(search='30-3'))
+    assert (output['recordsTotal'], output['recordsFiltered']) == ('3', '1')
+    assert [r['family_name']['display'] for r in output['data']] == ['New']
+
+
+def test_frontendmembers_serverside_bad_parameters(membersapp):
+    app, interest = membersapp
+
+    # start before the first row and negative length are clamped
+    statements, output = _memberrows(app, interest, '2026-06-01', method='open', query=_dtargs(start=-5, length=-3))
+    assert len(output['data']) == 3
+
+    for query in [_dtargs(start='x'), _dtargs(length='1.5'), _dtargs(order=((9, 'asc'),)),
+                  _dtargs(order=(('y', 'asc'),)), _dtargs().replace('draw=3', 'draw=z')]:
+        with pytest.raises(BadRequest):
+            _memberrows(app, interest, '2026-06-01', method='open', query=query)
+
+
+STATS = [
+    {'year': 2024, 'counts': [{'date': '01-01', 'count': 5}, {'date': '01-02', 'count': 6}]},
+    {'year': 2025, 'counts': [{'date': '01-01', 'count': 7}]},
+    {'year': 2026, 'counts': [{'date': '01-01', 'count': 8}, {'date': '03-15', 'count': 9}]},
+]
+
+
+@pytest.fixture
+def statsapp(bareapp, tmp_path, monkeypatch):
+    bareapp.config['APP_FILE_FOLDER'] = str(tmp_path)
+    bareapp.config['APP_STATS_FILENAME'] = 'stats.json'
+    (tmp_path / 'fsrc').mkdir()
+    monkeypatch.setattr(membership_frontend, '_memberstats_cache', {})
+    yield bareapp
+
+
+def _writestats(app, stats, mtime=1700000000):
+    path = os.path.join(app.config['APP_FILE_FOLDER'], 'fsrc', app.config['APP_STATS_FILENAME'])
+    with open(path, 'w') as f:
+        f.write(dumps(stats))
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def _get(app, query='', headers=None):
+    with app.test_request_context(f'/fsrc/_memberstats{query}', headers=headers or {}):
+        g.interest = 'fsrc'
+        return MemberStatsApi().get()
+
+
+def test_memberstats_full(statsapp):
+    _writestats(statsapp, STATS)
+    resp = _get(statsapp)
+    assert resp.status_code == 200
+    assert resp.json['success'] is True
+    assert resp.json['data'] == STATS
+    assert resp.headers['ETag']
+    assert resp.headers['Last-Modified']
+
+
+def test_memberstats_years_filter_and_compact(statsapp):
+    _writestats(statsapp, STATS)
+    resp = _get(statsapp, '?years=2026,2024&format=compact')
+    assert resp.json['data'] == [
+        {'year': 2024, 'dates': ['01-01', '01-02'], 'counts': [5, 6]},
+        {'year': 2026, 'dates': ['01-01', '03-15'], 'counts': [8, 9]},
+    ]
+
+
+def test_memberstats_variants_have_distinct_etags(statsapp):
+    _writestats(statsapp, STATS)
+    etags = {_get(statsapp, q).headers['ETag'] for q in ['', '?format=compact', '?years=2025']}
+    assert len(etags) == 3
+
+
+def test_memberstats_not_modified(statsapp):
+    _writestats(statsapp, STATS)
+    etag = _get(statsapp).headers['ETag']
+
+    resp = _get(statsapp, headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+
+
+def test_memberstats_cache_invalidated_by_mtime(statsapp):
+    _writestats(statsapp, STATS)
+    first = _get(statsapp)
+
+    _writestats(statsapp, STATS[:1], mtime=1700086400)
+    resp = _get(statsapp, headers={'If-None-Match': first.headers['ETag']})
+    assert resp.status_code == 200
+    assert resp.json['data'] == STATS[:1]
+    assert resp.headers['ETag'] != first.headers['ETag']
+
+
+def test_memberstats_reuses_cached_body(statsapp):
+    path = _writestats(statsapp, STATS)
+    first = _get(statsapp, '?format=compact')
+    entry = membership_frontend._memberstats_cache[path]
+
+    for i in range(3):
+        resp = _get(statsapp, '?format=compact')
+        assert resp.get_data() == first.get_data()
+    assert membership_frontend._memberstats_cache[path] is entry
+    assert list(entry['bodies']) == [(None, 'compact')]
+
+
+def test_memberstats_bad_parameters(statsapp):
+    _writestats(statsapp, STATS)
+    assert _get(statsapp, '?years=abc').json['success'] is False
+    assert _get(statsapp, '?format=xml').json['success'] is False
+
+
+def test_compactstats_roundtrip():
+    expanded = [{'year': s['year'], 'counts': [{'date': d, 'count': c} for d, c in zip(s['dates'], s['counts'])]}
+                for s in compactstats(STATS)]
+    assert expanded == loads(dumps(STATS))
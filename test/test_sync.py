@@ -5,9 +5,10 @@ test_sync - test members.sync
 
 # standard
 import logging
+import json
 
 # homegrown
-from members.sync import SyncManager
+from members.sync import SyncManager, SyncPlan
 
 
 class _RecordingSyncManager(SyncManager):
@@ -20,6 +21,7 @@ class _RecordingSyncManager(SyncManager):
         self.group_key_map = group_key_map
         self.started = False
         self.finished = False
+        self.aborted = False
         self.updated = []
         self.added = []
         self.removed = []
@@ -48,6 +50,9 @@ class _RecordingSyncManager(SyncManager):
     def finish_import(self):
         self.finished = True
 
+    def abort_import(self):
+        self.aborted = True
+
 
 def test_import_group_adds_service_user_missing_from_group(bareapp):
     mgr = _RecordingSyncManager(svcusers={'a': 'svc-a'}, groupusers={}, group_key_map={'svc-a': 'key-a'})
@@ -97,3 +102,65 @@ def test_import_group_no_debug_sets_logger_warning_level(bareapp):
     with bareapp.app_context():
         mgr.import_group(debug=False)
     assert bareapp.logger.level == logging.WARNING
+
+
+# ----------------------------------------------------------------------
+# plan / apply
+# ----------------------------------------------------------------------
+
+def _mixedmgr():
+    return _RecordingSyncManager(
+        svcusers={'a': 'svc-a', 'b': 'svc-b', 'c': 'svc-c', 'c2': 'svc-c2'},
+        groupusers={'key-b': 'group-b', 'key-x': 'group-x', 'key-y': 'group-y'},
+        # svc-c2 is the same group user as svc-c
+        group_key_map={'svc-a': 'key-a', 'svc-b': 'key-b', 'svc-c': 'key-c', 'svc-c2': 'key-c'})
+
+
+def test_plan_import_computes_changes(bareapp):
+    mgr = _mixedmgr()
+    plan = mgr.plan_import(mgr.get_users_from_service(), mgr.get_users_from_group())
+
+    assert plan.add == {'key-a': 'svc-a', 'key-c': 'svc-c'}
+    assert plan.remove == ['key-x', 'key-y']
+    assert plan.update == {'key-b': ('svc-b', 'group-b')}
+    assert plan.counts == {'add': 2, 'remove': 2, 'update': 1}
+    # nothing applied
+    assert mgr.added == mgr.removed == mgr.updated == []
+
+
+def test_import_group_plan_only_makes_no_changes(bareapp):
+    mgr = _mixedmgr()
+    with bareapp.app_context():
+        plan = mgr.import_group(planonly=True)
+
+    assert mgr.added == mgr.removed == mgr.updated == []
+    assert (mgr.finished, mgr.aborted) == (False, True)
+    serialized = json.loads(json.dumps(plan.asdict()))
+    assert serialized['counts'] == {'add': 2, 'remove': 2, 'update': 1}
+    assert serialized['add'] == ['key-a', 'key-c']
+    assert set(serialized['timings']) == {'start', 'service', 'group', 'plan'}
+
+
+def test_import_group_applies_plan(bareapp):
+    mgr = _mixedmgr()
+    with bareapp.app_context():
+        plan = mgr.import_group()
+
+    assert mgr.added == [('svc-a', 'key-a'), ('svc-c', 'key-c')]
+    assert mgr.updated == [('svc-b', 'group-b')]
+    assert mgr.removed == ['key-x', 'key-y']
+    assert isinstance(plan, SyncPlan)
+    assert (mgr.finished, mgr.aborted) == (True, False)
+    assert set(plan.timings) == {'start', 'service', 'group', 'plan', 'apply', 'finish'}
+
+
+def test_apply_plan_uses_batch_hooks(bareapp):
+    class _BatchingSyncManager(_RecordingSyncManager):
+        def add_users_to_group(self, adds):
+            self.added.append(sorted(adds))
+
+    mgr = _BatchingSyncManager(svcusers={'a': 'svc-a', 'b': 'svc-b'}, groupusers={},
+                               group_key_map={'svc-a': 'key-a', 'svc-b': 'key-b'})
+    with bareapp.app_context():
+        mgr.import_group()
+    assert mgr.added == [['key-a', 'key-b']]